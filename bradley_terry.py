@@ -0,0 +1,331 @@
+#!/usr/bin/env python3
+"""
+Bradley-Terry Solver (NumPy)
+============================
+Port of `computeBTStrengthParams` / `rankByStrength` from
+scoringSystem-cf/packages/backend/src/utils/bradley-terry.ts for offline
+re-scoring of the AI BT ranking suggestions stored in `aiservicecalls`.
+
+The JS version keeps wins/plays in a Map of Maps and runs an O(n²) inner
+loop per item per MM iteration. Here the same MM update is a handful of
+array operations:
+
+    p_i ← W_i / Σ_j n_ij / (p_i + p_j)    (items with no games keep p_i)
+    p   ← p / Σ p
+
+with the same start (1/n), convergence rule (max |Δp| < tolerance, at most
+maxIterations) and output (log strength, shifted so the upper median is 0;
+items that never won get -inf, which JSON.stringify stores as null).
+
+Dense (n × n) and sparse (one entry per compared pair) forms give the same
+result; the sparse form is used automatically for large, thinly sampled
+stages. `solve_batch` runs many stages in lockstep on padded 3-D arrays;
+`solve_problems` feeds it groups of equal item count capped at
+BATCH_MAX_CELLS, and sends stages of SPARSE_MIN_ITEMS or more items through
+the sparse solver one at a time, so one large call never sizes a batch.
+
+Usage:
+    python bradley_terry.py --db path/to/d1.sqlite      # re-score every ranking_bt call
+
+Requires: numpy
+"""
+
+import argparse
+import json
+import sys
+
+import numpy as np
+
+DEFAULT_MAX_ITERATIONS = 100
+DEFAULT_TOLERANCE = 1e-6
+
+# Use the sparse solver when fewer than this fraction of pairs were compared
+SPARSE_DENSITY = 0.1
+SPARSE_MIN_ITEMS = 64
+
+# Dense batches hold at most this many stages × width × width cells (8 MB per float array)
+BATCH_MAX_CELLS = 1 << 20
+
+
+def comparison_pairs(comparisons, item_ids):
+    """Aggregate decided comparisons into (winner, loser, count) index arrays
+
+    Comparisons without a winner are skipped, as in the backend. Unknown
+    item ids raise ValueError (the JS version throws on them).
+    """
+    columns = {item_id: i for i, item_id in enumerate(item_ids)}
+    counts = {}
+    for comparison in comparisons:
+        winner = comparison.get('winner')
+        if not winner:
+            continue
+        item_a, item_b = comparison['itemA'], comparison['itemB']
+        loser = item_b if winner == item_a else item_a
+        try:
+            key = (columns[winner], columns[loser])
+        except KeyError as e:
+            raise ValueError(f"comparison references unknown item {e.args[0]!r}") from None
+        counts[key] = counts.get(key, 0) + 1
+
+    if not counts:
+        empty = np.zeros(0, dtype=np.int64)
+        return empty, empty, np.zeros(0)
+    keys = np.array(list(counts), dtype=np.int64)
+    return keys[:, 0], keys[:, 1], np.array(list(counts.values()), dtype=float)
+
+
+def dense_matrices(n, winners, losers, counts):
+    """wins[i, j] = times i beat j; played[i, j] = games between i and j (diagonal ignored)"""
+    wins = np.zeros((n, n))
+    np.add.at(wins, (winners, losers), counts)
+    np.fill_diagonal(wins, 0.0)
+    played = wins + wins.T
+    return wins, played
+
+
+def _mm_step(strength, total_wins, denom):
+    new = np.where(denom > 0, total_wins / np.where(denom > 0, denom, 1.0), strength)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return new / new.sum(axis=-1, keepdims=True)
+
+
+def mm_dense(wins, played, max_iterations=DEFAULT_MAX_ITERATIONS, tolerance=DEFAULT_TOLERANCE):
+    """MM iterations on dense win/play matrices; returns normalized strengths (sum 1)"""
+    n = wins.shape[0]
+    total_wins = wins.sum(axis=1)
+    strength = np.full(n, 1.0 / n)
+    for _ in range(max_iterations):
+        pair_sum = strength[:, None] + strength[None, :]
+        denom = np.divide(played, pair_sum, out=np.zeros_like(played), where=played > 0).sum(axis=1)
+        new = _mm_step(strength, total_wins, denom)
+        max_diff = np.max(np.abs(new - strength))
+        strength = new
+        if max_diff < tolerance:
+            break
+    return strength
+
+
+def mm_sparse(n, winners, losers, counts, max_iterations=DEFAULT_MAX_ITERATIONS, tolerance=DEFAULT_TOLERANCE):
+    """MM iterations on aggregated (winner, loser, count) pairs; O(pairs) per iteration"""
+    keep = winners != losers
+    winners, losers, counts = winners[keep], losers[keep], counts[keep]
+    total_wins = np.bincount(winners, weights=counts, minlength=n)
+    strength = np.full(n, 1.0 / n)
+    for _ in range(max_iterations):
+        # Each game contributes 1/(p_i + p_j) to both players' denominators
+        share = counts / (strength[winners] + strength[losers])
+        denom = np.bincount(winners, weights=share, minlength=n) + np.bincount(losers, weights=share, minlength=n)
+        new = _mm_step(strength, total_wins, denom)
+        max_diff = np.max(np.abs(new - strength))
+        strength = new
+        if max_diff < tolerance:
+            break
+    return strength
+
+
+def log_median_centered(strength):
+    """log(strength) shifted so the upper median (values[floor(n/2)]) is 0"""
+    with np.errstate(divide='ignore', invalid='ignore'):
+        log_strength = np.log(strength)
+        median = np.sort(log_strength)[log_strength.size // 2]
+        return log_strength - median
+
+
+def compute_bt_strength_params(comparisons, item_ids, max_iterations=DEFAULT_MAX_ITERATIONS,
+                               tolerance=DEFAULT_TOLERANCE, sparse=None):
+    """Port of computeBTStrengthParams: {itemId: log strength, median-centered}"""
+    item_ids = list(item_ids)
+    n = len(item_ids)
+    winners, losers, counts = comparison_pairs(comparisons, item_ids)
+    if sparse is None:
+        sparse = n >= SPARSE_MIN_ITEMS and counts.size < SPARSE_DENSITY * n * n
+
+    if sparse:
+        strength = mm_sparse(n, winners, losers, counts, max_iterations, tolerance)
+    else:
+        wins, played = dense_matrices(n, winners, losers, counts)
+        strength = mm_dense(wins, played, max_iterations, tolerance)
+    return dict(zip(item_ids, log_median_centered(strength).tolist()))
+
+
+def rank_by_strength(strength_params):
+    """Port of rankByStrength: item ids from strongest to weakest (stable for ties)"""
+    return [item_id for item_id, _ in sorted(strength_params.items(), key=lambda item: -item[1])]
+
+
+def solve_batch(problems, max_iterations=DEFAULT_MAX_ITERATIONS, tolerance=DEFAULT_TOLERANCE):
+    """Solve many stages at once on padded stages × n × n arrays
+
+    `problems` is a list of (comparisons, item_ids). Each stage stops updating
+    once it converges, so results match solving the stages one by one.
+    Returns a list of {itemId: log strength} dicts.
+    """
+    if not problems:
+        return []
+    sizes = np.array([len(item_ids) for _, item_ids in problems])
+    width = int(sizes.max())
+    stages = len(problems)
+
+    wins = np.zeros((stages, width, width))
+    for s, (comparisons, item_ids) in enumerate(problems):
+        n = len(item_ids)
+        winners, losers, counts = comparison_pairs(comparisons, item_ids)
+        wins[s, :n, :n] = dense_matrices(n, winners, losers, counts)[0]
+    played = wins + wins.transpose(0, 2, 1)
+    total_wins = wins.sum(axis=2)
+
+    # Padding columns start (and stay) at 0 so they never enter the normalization
+    valid = np.arange(width)[None, :] < sizes[:, None]
+    strength = np.where(valid, 1.0 / np.maximum(sizes, 1)[:, None], 0.0)
+    active = np.ones(stages, dtype=bool)
+    for _ in range(max_iterations):
+        pair_sum = strength[:, :, None] + strength[:, None, :]
+        denom = np.divide(played, pair_sum, out=np.zeros_like(played), where=played > 0).sum(axis=2)
+        new = _mm_step(strength, total_wins, denom)
+        max_diff = np.max(np.abs(new - strength), axis=1, where=valid, initial=0.0)
+        strength[active] = new[active]
+        active &= ~(max_diff < tolerance)
+        if not active.any():
+            break
+
+    return [
+        dict(zip(item_ids, log_median_centered(strength[s, :len(item_ids)]).tolist()))
+        for s, (_, item_ids) in enumerate(problems)
+    ]
+
+
+def solve_problems(problems, max_iterations=DEFAULT_MAX_ITERATIONS, tolerance=DEFAULT_TOLERANCE):
+    """Solve (comparisons, item_ids) problems with bounded memory; results in input order
+
+    Stages with SPARSE_MIN_ITEMS or more items run alone through mm_sparse
+    (O(pairs) memory). The rest are grouped by item count, so nothing is
+    padded, and each group is solved in solve_batch chunks of at most
+    BATCH_MAX_CELLS cells.
+    """
+    results = [None] * len(problems)
+    by_size = {}
+    for index, (comparisons, item_ids) in enumerate(problems):
+        if len(item_ids) >= SPARSE_MIN_ITEMS:
+            results[index] = compute_bt_strength_params(comparisons, item_ids, max_iterations, tolerance,
+                                                        sparse=True)
+        else:
+            by_size.setdefault(len(item_ids), []).append(index)
+
+    for n, indices in by_size.items():
+        step = max(1, BATCH_MAX_CELLS // max(1, n * n))
+        for start in range(0, len(indices), step):
+            chunk = indices[start:start + step]
+            solved = solve_batch([problems[index] for index in chunk], max_iterations, tolerance)
+            for index, params in zip(chunk, solved):
+                results[index] = params
+    return results
+
+
+def _stored_item_ids(row, comparisons):
+    """Item order used by the consumer: btStrengthParams keys, else first appearance"""
+    try:
+        stored = json.loads(row['btStrengthParams']) if row['btStrengthParams'] else {}
+    except ValueError:
+        stored = {}
+    if stored:
+        return list(stored), stored
+    item_ids = {}
+    for comparison in comparisons:
+        item_ids.setdefault(comparison['itemA'], None)
+        item_ids.setdefault(comparison['itemB'], None)
+    return list(item_ids), stored
+
+
+def rescore_bt_calls(conn, tolerance=1e-6, batch_size=256):
+    """Re-score every successful ranking_bt call; returns one dict per call"""
+    cursor = conn.execute("""
+        SELECT callId, projectId, stageId, rankingType, result, btComparisons, btStrengthParams
+        FROM aiservicecalls
+        WHERE serviceType = 'ranking_bt' AND status = 'success' AND btComparisons IS NOT NULL
+        ORDER BY createdAt
+    """)
+    reports = []
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            break
+        problems, pending = [], []
+        for row in rows:
+            report = {'callId': row['callId'], 'projectId': row['projectId'], 'stageId': row['stageId']}
+            reports.append(report)
+            try:
+                comparisons = json.loads(row['btComparisons'])
+                item_ids, stored = _stored_item_ids(row, comparisons)
+                if len(item_ids) < 2:
+                    raise ValueError('fewer than 2 items')
+                comparison_pairs(comparisons, item_ids)
+            except (ValueError, TypeError, KeyError) as e:
+                report['error'] = str(e)
+                continue
+            problems.append((comparisons, item_ids))
+            pending.append((report, row, stored))
+
+        for params, (report, row, stored) in zip(solve_problems(problems), pending):
+            try:
+                stored_ranking = json.loads(row['result']) if row['result'] else None
+            except ValueError:
+                stored_ranking = None
+            max_diff = 0.0
+            for item_id, value in params.items():
+                want = stored.get(item_id)
+                # JSON.stringify writes -Infinity / NaN as null
+                if want is None or not np.isfinite(value):
+                    if (want is None) != (not np.isfinite(value)):
+                        max_diff = float('inf')
+                    continue
+                max_diff = max(max_diff, abs(value - want))
+            report.update({
+                'itemCount': len(params),
+                'maxParamDiff': max_diff,
+                'paramsMatch': bool(stored) and max_diff <= tolerance,
+                'rankingMatch': stored_ranking == rank_by_strength(params),
+                'ranking': rank_by_strength(params),
+            })
+    return reports
+
+
+def main():
+    """Main entry point"""
+    from test_settlement import open_connection, resolve_db_path
+
+    parser = argparse.ArgumentParser(description="Re-score stored Bradley-Terry AI ranking suggestions")
+    parser.add_argument('--db', default=None, help='SQLite database path (default: as test_settlement.py)')
+    parser.add_argument('--tolerance', type=float, default=1e-6,
+                        help='allowed difference between stored and recomputed log strengths')
+    args = parser.parse_args()
+
+    db_path = resolve_db_path(args.db)
+    print("="*80)
+    print("🤖 BRADLEY-TERRY RE-SCORE")
+    print("="*80)
+    print(f"Database: {db_path}")
+    if not db_path.exists():
+        print(f"\n❌ Database file not found: {db_path}")
+        sys.exit(1)
+
+    conn = open_connection(db_path, read_only=True)
+    try:
+        reports = rescore_bt_calls(conn, args.tolerance)
+    finally:
+        conn.close()
+
+    failed = 0
+    for report in reports:
+        if 'error' in report:
+            failed += 1
+            print(f"   ❌ {report['callId']}: {report['error']}")
+        elif not (report['paramsMatch'] and report['rankingMatch']):
+            failed += 1
+            print(f"   ❌ {report['callId']} ({report['itemCount']} items): "
+                  f"max strength diff {report['maxParamDiff']:.3g}, ranking match: {report['rankingMatch']}")
+    print(f"\n📊 Re-scored {len(reports)} BT calls, {failed} differ from stored results")
+    sys.exit(0 if failed == 0 else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+"""
+Comment Settlement Simulation
+=============================
+Replays the COMMENT SETTLEMENT step of settlement.ts for one stage.
+
+The comment handlers decide eligibility per comment through
+utils/commentVotingUtils.ts (`batchCheckCommentsHaveHelpfulReaction`,
+`batchCalculateReactionUsers`, `batchCalculateReplyUsers`,
+`getRankableComments`). Here the same answers come from one pass per stage:
+the stage's comments and the latest reaction of every (comment, user) pair
+are read with two set-based queries, project memberships and teacher /
+observer viewers once per project, and every per-comment lookup after that
+is a dict or set probe.
+
+Scoring then runs on the index: the percentile top-N comes from the unique
+eligible authors (the settlement.ts COUNT(DISTINCT authorEmail) query), and
+teacher + student comment ballots go through the same engine as groups.
+
+Usage:
+    python test_settlement.py            # simulates the test stage's comment pool
+    python test_settlement.py --batch    # and every replayed stage with a comment pool
+"""
+
+import json
+
+from settlement_engine import (
+    MAX_SQL_PARAMS,
+    aggregate_teacher_rankings,
+    calculate_comment_reward_limit,
+    parse_ranking_data,
+    score_ballots,
+)
+
+
+STAFF_ROLES = ('teacher', 'observer')
+VOTABLE_ROLES = ('leader', 'member')
+
+
+def parse_mentions(raw):
+    """Decode a mentionedGroups / mentionedUsers column; None when it is not valid JSON"""
+    if not raw:
+        return []
+    try:
+        value = json.loads(raw)
+    except ValueError:
+        return None
+    return value if isinstance(value, list) else []
+
+
+class ProjectMembership:
+    """Active memberships and staff of one project, loaded once and shared by its stages"""
+
+    def __init__(self, conn, project_id):
+        self.conn = conn
+        self.project_id = project_id
+        self.group_members = {}     # groupId -> [(userEmail, hasAccount)], active rows only
+        self.roles = {}             # userEmail -> set of active usergroups roles
+        self.staff = set()          # active teacher / observer projectviewers
+        self._accounts = {}         # userEmail -> exists in users (filled lazily)
+
+        for group_id, user_email, role, has_account in conn.execute("""
+            SELECT ug.groupId, ug.userEmail, ug.role, u.userEmail IS NOT NULL
+            FROM usergroups ug
+            LEFT JOIN users u ON u.userEmail = ug.userEmail
+            WHERE ug.projectId = ? AND ug.isActive = 1
+            ORDER BY ug.groupId, ug.joinTime
+        """, (project_id,)):
+            self.group_members.setdefault(group_id, []).append((user_email, bool(has_account)))
+            self.roles.setdefault(user_email, set()).add(role)
+            self._accounts[user_email] = bool(has_account)
+
+        self.staff = {row[0] for row in conn.execute(f"""
+            SELECT userEmail FROM projectviewers
+            WHERE projectId = ? AND isActive = 1 AND role IN ({','.join('?' * len(STAFF_ROLES))})
+        """, (project_id, *STAFF_ROLES))}
+
+    def is_student(self, user_email):
+        """Active group member who is not an active teacher / observer viewer"""
+        return user_email in self.roles and user_email not in self.staff
+
+    def can_be_voted(self, user_email):
+        """Author check of getRankableComments: active leader or member"""
+        return not self.roles.get(user_email, set()).isdisjoint(VOTABLE_ROLES)
+
+    def load_accounts(self, emails):
+        """Record which of `emails` have a users row (chunked IN queries, cached)"""
+        missing = [email for email in set(emails) if email not in self._accounts]
+        for start in range(0, len(missing), MAX_SQL_PARAMS):
+            chunk = missing[start:start + MAX_SQL_PARAMS]
+            found = {row[0] for row in self.conn.execute(
+                f"SELECT userEmail FROM users WHERE userEmail IN ({','.join('?' * len(chunk))})", chunk
+            )}
+            for email in chunk:
+                self._accounts[email] = email in found
+
+    def has_account(self, user_email):
+        return self._accounts.get(user_email, False)
+
+
+class CommentStageIndex:
+    """Per-comment eligibility indexes for one stage
+
+    - helpful: {commentId: number of users whose latest reaction is 'helpful'}
+    - reaction_users / reply_users: {commentId: [userEmail]}
+    - rankable: commentIds getRankableComments would return (newest first)
+    """
+
+    def __init__(self, conn, membership, stage_id):
+        self.stage_id = stage_id
+        self.membership = membership
+
+        self.comments = {row['commentId']: row for row in conn.execute("""
+            SELECT commentId, authorEmail, mentionedGroups, mentionedUsers,
+                   isReply, replyLevel, createdTime
+            FROM comments
+            WHERE projectId = ? AND stageId = ?
+            ORDER BY createdTime DESC
+        """, (membership.project_id, stage_id))}
+
+        self.helpful = dict(conn.execute("""
+            WITH latest_reactions AS (
+                SELECT r.targetId, r.reactionType,
+                       ROW_NUMBER() OVER (PARTITION BY r.targetId, r.userEmail ORDER BY r.createdAt DESC) AS rn
+                FROM reactions r
+                JOIN comments c ON c.commentId = r.targetId
+                WHERE c.stageId = ? AND r.targetType = 'comment'
+            )
+            SELECT targetId, COUNT(*)
+            FROM latest_reactions
+            WHERE rn = 1 AND reactionType = 'helpful'
+            GROUP BY targetId
+        """, (stage_id,)))
+
+        self.mentions = {
+            comment_id: (parse_mentions(row['mentionedUsers']), parse_mentions(row['mentionedGroups']))
+            for comment_id, row in self.comments.items()
+        }
+        membership.load_accounts(
+            email for users, _ in self.mentions.values() if users for email in users
+        )
+
+        self.reaction_users = {}
+        self.reply_users = {}
+        self.rankable = []
+        for comment_id, row in self.comments.items():
+            self._index_comment(comment_id, row)
+
+    def _index_comment(self, comment_id, row):
+        membership = self.membership
+        author = row['authorEmail']
+        users, groups = self.mentions[comment_id]
+
+        # batchCalculateReactionUsers: mentioned students plus student members of
+        # mentioned groups, never the author
+        reaction_users = {}
+        reply_users = {}
+        for email in users or ():
+            if email != author and membership.is_student(email):
+                reaction_users[email] = None
+            if membership.has_account(email):
+                reply_users[email] = None
+        # batchCalculateReplyUsers: every active member of mentioned groups with a users row
+        for group_id in groups or ():
+            for email, has_account in membership.group_members.get(group_id, ()):
+                if email != author and membership.is_student(email):
+                    reaction_users[email] = None
+                if has_account:
+                    reply_users[email] = None
+        self.reaction_users[comment_id] = list(reaction_users)
+        self.reply_users[comment_id] = list(reply_users)
+
+        # getRankableComments: top-level, helpful, leader/member author, valid non-empty mentions
+        top_level = not row['isReply'] and not row['replyLevel']
+        if (top_level and comment_id in self.helpful and membership.can_be_voted(author)
+                and users is not None and groups is not None and (users or groups)):
+            self.rankable.append(comment_id)
+
+    def unique_authors(self):
+        """Distinct eligible authors as counted by settlement.ts for the percentile top-N
+
+        That query is looser than getRankableComments: isReply = 0 only, any
+        non-NULL mentions column, and any active role.
+        """
+        return len({
+            row['authorEmail'] for comment_id, row in self.comments.items()
+            if row['isReply'] == 0
+            and (row['mentionedGroups'] is not None or row['mentionedUsers'] is not None)
+            and row['authorEmail'] in self.membership.roles
+            and comment_id in self.helpful
+        })
+
+
+def simulate_comment_stage(conn, membership, stage_id, comment_pool, config, teacher_ballots=None):
+    """Score one stage's comment pool on its CommentStageIndex
+
+    `teacher_ballots` are preloaded {teacherEmail: {commentId: rank}}; they
+    are queried for this stage when omitted. Returns a dict with the index,
+    ballot counts, topN and result_to_dicts records; `records` is None when
+    the pool is empty (settlement.ts skips it).
+    """
+    index = CommentStageIndex(conn, membership, stage_id)
+    result = {
+        'index': index,
+        'uniqueAuthors': index.unique_authors(),
+        'teacherBallots': 0,
+        'studentBallots': 0,
+        'topN': None,
+        'records': None,
+    }
+    if comment_pool <= 0:
+        return result
+
+    if teacher_ballots is None:
+        teacher_ballots = aggregate_teacher_rankings(conn.execute("""
+            SELECT teacherEmail, commentId, rank, createdTime
+            FROM teachercommentrankings
+            WHERE projectId = ? AND stageId = ?
+            ORDER BY teacherEmail ASC, createdTime DESC
+        """, (membership.project_id, stage_id)))
+
+    student_ballots = [parse_ranking_data(row[0]) for row in conn.execute("""
+        WITH LatestCommentRankings AS (
+            SELECT rankingData, authorEmail,
+                   ROW_NUMBER() OVER (PARTITION BY authorEmail ORDER BY createdTime DESC) AS rn
+            FROM commentrankingproposals
+            WHERE stageId = ?
+        )
+        SELECT lcr.rankingData
+        FROM LatestCommentRankings lcr
+        JOIN usergroups ug ON ug.userEmail = lcr.authorEmail AND ug.projectId = ?
+        WHERE lcr.rn = 1 AND ug.isActive = 1
+    """, (stage_id, membership.project_id))]
+
+    top_n = calculate_comment_reward_limit(
+        result['uniqueAuthors'], config['commentRewardPercentile'], config['maxCommentSelections']
+    )
+    result.update({
+        'teacherBallots': len(teacher_ballots),
+        'studentBallots': len(student_ballots),
+        'topN': top_n,
+        'records': score_ballots(teacher_ballots.values(), student_ballots, comment_pool, config, top_n),
+    })
+    return result
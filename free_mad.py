@@ -0,0 +1,496 @@
+#!/usr/bin/env python3
+"""
+Free-MAD Aggregation
+====================
+Port of scoringSystem-cf/packages/backend/src/utils/free-mad.ts
+(calculateBordaScores, calculateRankingSimilarity, computeFreeMadRanking,
+DEFAULT_FREE_MAD_WEIGHTS) for replaying the multi-agent debate results stored
+in `aiservicecalls` and tuning the weights offline.
+
+calculateRankingSimilarity compares every item pair (O(n²)) and runs once
+per agent pair per debate. Here the discordant-pair count is a merge-sort
+inversion count over ranking B's positions in ranking A's order (O(n log n)).
+`similarity_matrix` stacks every agent pair of a debate into one array and
+counts all of them in a single vectorized merge sort.
+
+Every Free-MAD score is linear in the four weights, so
+`free_mad_components` splits a debate into one score vector per weight and
+`sweep_weights` scores a whole weight grid with one matrix product. The
+product adds the terms in a different order than the JS, so near-ties can
+differ in the last bits; swept scores are rounded to SCORE_DECIMALS before
+ranking. A sweep at DEFAULT_FREE_MAD_WEIGHTS is checked against the
+unrounded compute_free_mad_ranking output on the stored debates and on
+--check random ones: every score within SWEEP_TOLERANCE, and the ranking
+equal up to swaps of items whose exact scores are within SWEEP_TOLERANCE.
+
+Usage:
+    python free_mad.py --db path/to/d1.sqlite                   # replay stored debates
+    python free_mad.py --db path/to/d1.sqlite --sweep 10,20,30  # agreement per weight set
+    python free_mad.py --db path/to/d1.sqlite --check 5000       # more random debates for the sweep check
+
+Requires: numpy
+"""
+
+import argparse
+import itertools
+import json
+import sys
+
+import numpy as np
+
+DEFAULT_FREE_MAD_WEIGHTS = {
+    'W_INITIAL': 20,   # Round 1 Borda base score
+    'W_PERSIST': 25,   # Bonus for persisting
+    'W_CHANGE': 30,    # Penalty for changing
+    'W_ADOPTED': 20,   # Bonus for being adopted
+}
+
+WEIGHT_KEYS = ('W_INITIAL', 'W_PERSIST', 'W_CHANGE', 'W_ADOPTED')
+
+# A changed Round 2 ranking this similar to another agent's Round 1 counts as adopting it
+ADOPTION_SIMILARITY = 0.8
+
+# Swept scores are ranked after rounding to this many decimals (summation-order noise is ~1e-13)
+SCORE_DECIMALS = 9
+SWEEP_TOLERANCE = 1e-9
+
+
+def calculate_borda_scores(ranking):
+    """Port of calculateBordaScores: first place gets n-1 points, last place 0"""
+    n = len(ranking)
+    return {item_id: n - 1 - i for i, item_id in enumerate(ranking)}
+
+
+def count_discordant(sequence):
+    """Pairs i < j with sequence[i] >= sequence[j], by bottom-up merge sort
+
+    Equal values count as discordant, matching the `else` branch of the JS
+    pair loop (duplicate ids share one position in the other ranking).
+    """
+    values = list(sequence)
+    n = len(values)
+    buffer = [0] * n
+    discordant = 0
+    width = 1
+    while width < n:
+        for lo in range(0, n, 2 * width):
+            mid = min(lo + width, n)
+            hi = min(lo + 2 * width, n)
+            i, j, k = lo, mid, lo
+            while i < mid and j < hi:
+                if values[j] <= values[i]:
+                    buffer[k] = values[j]
+                    discordant += mid - i
+                    j += 1
+                else:
+                    buffer[k] = values[i]
+                    i += 1
+                k += 1
+            buffer[k:k + mid - i] = values[i:mid]
+            k += mid - i
+            buffer[k:k + hi - j] = values[j:hi]
+            values[lo:hi] = buffer[lo:hi]
+        width *= 2
+    return discordant
+
+
+def count_discordant_rows(sequences):
+    """count_discordant of every row of a 2-D array of distinct values, as one vectorized merge sort
+
+    Rows are padded to a power of two with increasing values above every real
+    one (padding adds no inversions). At each width the two sorted halves of
+    every block are merged by a stable sort; a right-half element's merged
+    position minus its index is the number of left-half elements below it,
+    and the rest of the left half is discordant with it.
+    """
+    values = np.asarray(sequences, dtype=np.int64)
+    rows, n = values.shape
+    if rows == 0 or n < 2:
+        return np.zeros(rows, dtype=np.int64)
+    size = 1 << (n - 1).bit_length()
+    merged = np.empty((rows, size), dtype=np.int64)
+    merged[:, :n] = values
+    merged[:, n:] = values.max() + 1 + np.arange(size - n)
+
+    discordant = np.zeros(rows, dtype=np.int64)
+    width = 1
+    while width < size:
+        blocks = merged.reshape(rows, size // (2 * width), 2 * width)
+        order = np.argsort(blocks, axis=-1, kind='stable')
+        position = np.argsort(order, axis=-1)
+        below = position[..., width:] - np.arange(width)
+        discordant += (width - below).sum(axis=(1, 2))
+        merged = np.take_along_axis(blocks, order, axis=-1).reshape(rows, size)
+        width *= 2
+    return discordant
+
+
+def _positions(ranking):
+    # Later duplicates overwrite earlier ones, like `posB[rankingB[i]] = i`
+    return {item_id: i for i, item_id in enumerate(ranking)}
+
+
+def calculate_ranking_similarity(ranking_a, ranking_b, positions_b=None):
+    """Port of calculateRankingSimilarity: (Kendall tau + 1) / 2 in [0, 1]"""
+    if not ranking_a or not ranking_b:
+        return 0
+    if len(ranking_a) != len(ranking_b):
+        # Different lengths: compare only the common items
+        set_a, set_b = set(ranking_a), set(ranking_b)
+        ranking_a = [item_id for item_id in ranking_a if item_id in set_b]
+        if len(ranking_a) < 2:
+            return 0
+        # The JS indexes only the first n entries of the filtered B
+        ranking_b = [item_id for item_id in ranking_b if item_id in set_a][:len(ranking_a)]
+        positions_b = _positions(ranking_b)
+    if len(ranking_a) < 2:
+        return 1
+
+    positions_b = positions_b if positions_b is not None else _positions(ranking_b)
+    sequence = [positions_b[item_id] for item_id in ranking_a if item_id in positions_b]
+    total_pairs = len(sequence) * (len(sequence) - 1) // 2
+    if total_pairs == 0:
+        return 1
+    discordant = count_discordant(sequence)
+    tau = (total_pairs - 2 * discordant) / total_pairs
+    return (tau + 1) / 2
+
+
+def similarity_matrix(rankings_a, rankings_b):
+    """All-pairs similarity: result[i, j] = calculate_ranking_similarity(rankings_a[i], rankings_b[j])
+
+    When every ranking is a permutation of the same n ≥ 2 items (the usual
+    debate), pair (i, j) is B_j's positions in A_i's order; all pairs are
+    stacked into one |A|·|B| × n array and counted by count_discordant_rows.
+    Anything else (different lengths or item sets, duplicate ids) goes
+    through calculate_ranking_similarity pair by pair.
+    """
+    result = np.zeros((len(rankings_a), len(rankings_b)))
+    if not rankings_a or not rankings_b:
+        return result
+
+    items = list(rankings_a[0])
+    n = len(items)
+    item_set = set(items)
+    if n < 2 or len(item_set) != n or any(
+            len(ranking) != n or set(ranking) != item_set for ranking in (*rankings_a, *rankings_b)):
+        positions = [_positions(ranking) for ranking in rankings_b]
+        for i, ranking_a in enumerate(rankings_a):
+            for j, ranking_b in enumerate(rankings_b):
+                result[i, j] = calculate_ranking_similarity(ranking_a, ranking_b, positions[j])
+        return result
+
+    columns = {item_id: column for column, item_id in enumerate(items)}
+    order_a = np.array([[columns[item_id] for item_id in ranking] for ranking in rankings_a])
+    positions_b = np.empty((len(rankings_b), n), dtype=np.int64)
+    for j, ranking in enumerate(rankings_b):
+        positions_b[j, [columns[item_id] for item_id in ranking]] = np.arange(n)
+    sequences = positions_b[:, order_a].transpose(1, 0, 2).reshape(-1, n)
+
+    total_pairs = n * (n - 1) // 2
+    discordant = count_discordant_rows(sequences).reshape(result.shape)
+    tau = (total_pairs - 2 * discordant) / total_pairs
+    return (tau + 1) / 2
+
+
+def free_mad_components(round1_results, round2_results, item_ids):
+    """Split computeFreeMadRanking into one per-item score vector per weight
+
+    Returns a 4 × n array C with scores = w · C for w = (W_INITIAL, W_PERSIST,
+    W_CHANGE, W_ADOPTED). Adoption is decided by similarity alone, so it does
+    not depend on the weights.
+    """
+    item_ids = list(item_ids)
+    columns = {}
+    for column, item_id in enumerate(item_ids):
+        columns.setdefault(item_id, column)
+    n = len(item_ids)
+    components = np.zeros((4, n))
+    initial, persist, change, adopted = components
+
+    # Step 1: Round 1 Borda base scores
+    for r1 in round1_results:
+        for i, item_id in enumerate(r1['ranking']):
+            if item_id in columns:
+                initial[columns[item_id]] += n - i
+
+    # Step 2: Round 2 position tracking
+    round1_by_provider = {}
+    for r1 in round1_results:
+        round1_by_provider.setdefault(r1['providerId'], r1)
+    for r2 in round2_results:
+        r1 = round1_by_provider.get(r2['providerId'])
+        if r1 is None:
+            continue
+        if not r2.get('changed'):
+            for i, item_id in enumerate(r2['ranking']):
+                if item_id in columns:
+                    persist[columns[item_id]] += (n - i) / n
+        else:
+            for item_id in r1['ranking']:
+                if item_id in columns:
+                    change[columns[item_id]] -= 1 / n
+            for i, item_id in enumerate(r2['ranking']):
+                if item_id in columns:
+                    initial[columns[item_id]] += (n - i) * 0.5
+
+    # Step 3: Adoption bonus (one batched similarity call for every agent pair)
+    changed = [r2 for r2 in round2_results if r2.get('changed')]
+    if changed and round1_results:
+        similarity = similarity_matrix([r1['ranking'] for r1 in round1_results],
+                                       [r2['ranking'] for r2 in changed])
+        for r1, row in zip(round1_results, similarity):
+            adoption_count = sum(
+                1 for r2, value in zip(changed, row)
+                if r2['providerId'] != r1['providerId'] and value > ADOPTION_SIMILARITY
+            )
+            if adoption_count:
+                for i, item_id in enumerate(r1['ranking']):
+                    if item_id in columns:
+                        adopted[columns[item_id]] += adoption_count * ((n - i) / n)
+
+    return components
+
+
+def compute_free_mad_ranking(round1_results, round2_results, item_ids, weights=None):
+    """Port of computeFreeMadRanking: {'ranking', 'reason', 'scores', 'debateDetails'}
+
+    Scores accumulate in the same order as the JS implementation, so ties
+    resolve identically.
+    """
+    weights = weights or DEFAULT_FREE_MAD_WEIGHTS
+    item_ids = list(item_ids)
+    scores = {item_id: 0 for item_id in item_ids}
+    n = len(item_ids)
+
+    for r1 in round1_results:
+        for i, item_id in enumerate(r1['ranking']):
+            if item_id in scores:
+                scores[item_id] += (n - i) * weights['W_INITIAL']
+
+    for r2 in round2_results:
+        r1 = next((r for r in round1_results if r['providerId'] == r2['providerId']), None)
+        if r1 is None:
+            continue
+        if not r2.get('changed'):
+            for i, item_id in enumerate(r2['ranking']):
+                if item_id in scores:
+                    scores[item_id] += weights['W_PERSIST'] * ((n - i) / n)
+        else:
+            for item_id in r1['ranking']:
+                if item_id in scores:
+                    scores[item_id] -= weights['W_CHANGE'] / n
+            for i, item_id in enumerate(r2['ranking']):
+                if item_id in scores:
+                    scores[item_id] += (n - i) * weights['W_INITIAL'] * 0.5
+
+    changed = [r2 for r2 in round2_results if r2.get('changed')]
+    similarity = similarity_matrix([r1['ranking'] for r1 in round1_results],
+                                   [r2['ranking'] for r2 in changed])
+    for r1, row in zip(round1_results, similarity):
+        adoption_count = sum(
+            1 for r2, value in zip(changed, row)
+            if r2['providerId'] != r1['providerId'] and value > ADOPTION_SIMILARITY
+        )
+        if adoption_count > 0:
+            for i, item_id in enumerate(r1['ranking']):
+                if item_id in scores:
+                    scores[item_id] += weights['W_ADOPTED'] * adoption_count * ((n - i) / n)
+
+    ranking = sorted(item_ids, key=lambda item_id: -scores[item_id])
+
+    debate_details = []
+    for r1 in round1_results:
+        r2 = next((r for r in round2_results if r['providerId'] == r1['providerId']), None)
+        debate_details.append({
+            'providerId': r1['providerId'],
+            'providerName': r1.get('providerName'),
+            'round1Ranking': r1['ranking'],
+            'round1Reason': r1.get('reason'),
+            'round2Ranking': (r2 or {}).get('ranking') or r1['ranking'],
+            'round2Reason': (r2 or {}).get('reason') or r1.get('reason'),
+            'changed': bool((r2 or {}).get('changed')),
+            'critique': (r2 or {}).get('critique'),
+        })
+
+    persisted = [r['providerName'] for r in round2_results if not r.get('changed')]
+    changed_names = [r['providerName'] for r in round2_results if r.get('changed')]
+    reason = f"經過 {len(round1_results)} 個 AI 的兩輪辯論："
+    if persisted:
+        reason += f"{'、'.join(persisted)} 堅持原本立場；"
+    if changed_names:
+        reason += f"{'、'.join(changed_names)} 調整了排名；"
+    reason += "依據 Free-MAD 權重計算出最終排名。"
+
+    return {'ranking': ranking, 'reason': reason, 'scores': scores, 'debateDetails': debate_details}
+
+
+def sweep_weights(components, weight_grid):
+    """Score one debate under many weight sets: K × 4 weights → K × n scores"""
+    return np.asarray(weight_grid, dtype=float) @ components
+
+
+def rankings_from_scores(scores, item_ids):
+    """Stable descending order of each score row rounded to SCORE_DECIMALS (ties keep item_ids order)"""
+    order = np.argsort(-np.round(np.asarray(scores, dtype=float), SCORE_DECIMALS), axis=-1, kind='stable')
+    return [[item_ids[i] for i in row] for row in np.atleast_2d(order)]
+
+
+def reference_ranking(scores, ranking, item_ids):
+    """A stored or exact result ranked like a sweep row (falls back to `ranking` without full scores)"""
+    if not item_ids or any(item_id not in scores for item_id in item_ids):
+        return list(ranking)
+    return rankings_from_scores([scores[item_id] for item_id in item_ids], item_ids)[0]
+
+
+def random_debate(rng, providers, items):
+    """(round1, round2, itemIds) with persisting, adopting (one swap from another agent) and changed agents"""
+    item_ids = [f"item{i}" for i in range(items)]
+    round1 = [{'providerId': f"p{k}", 'providerName': f"Agent {k}", 'ranking': list(rng.permutation(item_ids))}
+              for k in range(providers)]
+    round2 = []
+    for r1 in round1:
+        draw = rng.random()
+        if draw < 0.4:
+            round2.append({**r1, 'changed': False})
+            continue
+        if draw < 0.7:
+            ranking = list(round1[int(rng.integers(providers))]['ranking'])
+            i = int(rng.integers(max(1, items - 1)))
+            ranking[i:i + 2] = ranking[i:i + 2][::-1]
+        else:
+            ranking = list(rng.permutation(item_ids))
+        round2.append({**r1, 'ranking': ranking, 'changed': True})
+    return round1, round2, item_ids
+
+
+def check_default_sweep(debates):
+    """Debates (round1, round2, itemIds) whose sweep at DEFAULT_FREE_MAD_WEIGHTS differs from compute_free_mad_ranking
+
+    Compared with the unrounded port output: each swept score must be within
+    SWEEP_TOLERANCE of the exact one, and position by position the swept and
+    exact rankings may only hold items whose exact scores are that close.
+    """
+    default = [[DEFAULT_FREE_MAD_WEIGHTS[key] for key in WEIGHT_KEYS]]
+    failed = []
+    for round1, round2, item_ids in debates:
+        swept_scores = sweep_weights(free_mad_components(round1, round2, item_ids), default)
+        swept = rankings_from_scores(swept_scores, item_ids)[0]
+        exact = compute_free_mad_ranking(round1, round2, item_ids)
+        exact_scores = np.array([exact['scores'][item_id] for item_id in item_ids], dtype=float)
+        scores_match = np.allclose(swept_scores[0], exact_scores, rtol=0, atol=SWEEP_TOLERANCE)
+        ranking_match = len(swept) == len(exact['ranking']) and all(
+            abs(exact['scores'][a] - exact['scores'][b]) <= SWEEP_TOLERANCE
+            for a, b in zip(swept, exact['ranking']))
+        if not (scores_match and ranking_match):
+            failed.append((round1, round2, item_ids))
+    return failed
+
+
+def load_debates(conn):
+    """Stored multi-agent debates as (callId, round1, round2, itemIds, storedRanking, storedScores)
+
+    debateDetails (saved in thinkingProcess) lists every Round 1 provider in
+    order with its Round 2 ranking; the consumer falls back to the Round 1
+    ranking with changed=false when Round 2 fails, which is what the details
+    record, so both rounds can be rebuilt from it.
+    """
+    debates = []
+    for row in conn.execute("""
+        SELECT callId, result, thinkingProcess, btStrengthParams
+        FROM aiservicecalls
+        WHERE serviceType = 'ranking_multi_agent' AND parentCallId IS NULL
+          AND status = 'success' AND thinkingProcess IS NOT NULL
+        ORDER BY createdAt
+    """):
+        try:
+            details = json.loads(row['thinkingProcess'])
+            stored_ranking = json.loads(row['result']) if row['result'] else []
+            stored_scores = json.loads(row['btStrengthParams']) if row['btStrengthParams'] else {}
+        except ValueError:
+            continue
+        if not isinstance(details, list):
+            continue
+        round1 = [{'providerId': d['providerId'], 'providerName': d.get('providerName'),
+                   'ranking': d.get('round1Ranking') or [], 'reason': d.get('round1Reason')}
+                  for d in details]
+        round2 = [{'providerId': d['providerId'], 'providerName': d.get('providerName'),
+                   'ranking': d.get('round2Ranking') or [], 'changed': bool(d.get('changed')),
+                   'reason': d.get('round2Reason'), 'critique': d.get('critique')}
+                  for d in details]
+        item_ids = list(stored_scores) or list(stored_ranking)
+        debates.append((row['callId'], round1, round2, item_ids, stored_ranking, stored_scores))
+    return debates
+
+
+def main():
+    """Main entry point"""
+    from test_settlement import open_connection, resolve_db_path
+
+    parser = argparse.ArgumentParser(description="Replay stored Free-MAD multi-agent debates")
+    parser.add_argument('--db', default=None, help='SQLite database path (default: as test_settlement.py)')
+    parser.add_argument('--sweep', default=None, metavar='VALUES',
+                        help='comma-separated values; scores every W_* combination of them')
+    parser.add_argument('--check', type=int, default=800, metavar='COUNT',
+                        help='random debates added to the default-weight sweep check')
+    parser.add_argument('--seed', type=int, default=0, help='seed for the --check debates')
+    args = parser.parse_args()
+
+    db_path = resolve_db_path(args.db)
+    print("="*80)
+    print("🗳️  FREE-MAD REPLAY")
+    print("="*80)
+    print(f"Database: {db_path}")
+    if not db_path.exists():
+        print(f"\n❌ Database file not found: {db_path}")
+        sys.exit(1)
+
+    conn = open_connection(db_path, read_only=True)
+    try:
+        debates = load_debates(conn)
+    finally:
+        conn.close()
+
+    mismatched = 0
+    for call_id, round1, round2, item_ids, stored_ranking, stored_scores in debates:
+        result = compute_free_mad_ranking(round1, round2, item_ids)
+        scores_match = all(abs(result['scores'][item_id] - value) <= 1e-9
+                           for item_id, value in stored_scores.items() if item_id in result['scores'])
+        if result['ranking'] != stored_ranking or not scores_match:
+            mismatched += 1
+            print(f"   ❌ {call_id}: ranking match {result['ranking'] == stored_ranking}, "
+                  f"scores match {scores_match}")
+    print(f"\n📊 Replayed {len(debates)} debates, {mismatched} differ from stored results")
+
+    rng = np.random.default_rng(args.seed)
+    checked = [(round1, round2, item_ids) for _, round1, round2, item_ids, _, _ in debates]
+    checked += [random_debate(rng, int(rng.integers(2, 5)), int(rng.integers(2, 12))) for _ in range(args.check)]
+    sweep_failures = check_default_sweep(checked)
+    if sweep_failures:
+        mismatched += len(sweep_failures)
+        print(f"❌ Sweep at default weights ranks {len(sweep_failures)} of {len(checked)} debates "
+              f"unlike compute_free_mad_ranking; first: {sweep_failures[0][2]}")
+    else:
+        print(f"✅ Sweep at default weights reproduces compute_free_mad_ranking on {len(debates)} stored "
+              f"+ {args.check} random debates")
+
+    if args.sweep and debates:
+        values = [float(value) for value in args.sweep.split(',') if value]
+        grid = np.array(list(itertools.product(values, repeat=len(WEIGHT_KEYS))))
+        agreement = np.zeros(len(grid))
+        for _, round1, round2, item_ids, stored_ranking, stored_scores in debates:
+            components = free_mad_components(round1, round2, item_ids)
+            reference = reference_ranking(stored_scores, stored_ranking, item_ids)
+            for k, ranking in enumerate(rankings_from_scores(sweep_weights(components, grid), item_ids)):
+                agreement[k] += ranking == reference
+        print(f"\n🎛️  Weight sweep: {len(grid)} weight sets × {len(debates)} debates "
+              "(share of debates whose final ranking is unchanged)")
+        for k in np.argsort(-agreement, kind='stable')[:10]:
+            weights = ', '.join(f"{key}={value:g}" for key, value in zip(WEIGHT_KEYS, grid[k]))
+            print(f"   {agreement[k] / len(debates):6.1%}  {weights}")
+
+    sys.exit(0 if mismatched == 0 else 1)
+
+
+if __name__ == '__main__':
+    main()
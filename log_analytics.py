@@ -0,0 +1,350 @@
+#!/usr/bin/env python3
+"""
+Streaming Log Analytics
+=======================
+Per-functionName/action counts, error rates and time buckets for sys_logs
+and eventlogs (entityType/eventType there) over a createdAt / timestamp
+range, in one pass and without exporting the tables.
+
+The range is walked in fixed windows. Each window is one grouped query over
+an index range: with no filters the scan is pinned (INDEXED BY) to the index
+that leads with the time column (idx_sys_logs_created, idx_eventlogs_timestamp),
+so ANALYZE statistics cannot move the GROUP BY onto a full scan of
+idx_sys_logs_function_action; --function / --action / --level / --project /
+--user let SQLite pick the matching composite index (idx_sys_logs_function_action,
+idx_sys_logs_level, idx_sys_logs_project, ...), all of which end in
+createdAt. Every row is read once, and memory is bounded by the number of
+distinct keys and buckets, not rows.
+
+Errors are sys_logs rows at level error / critical and eventlogs rows whose
+eventType contains 'fail' or 'error'.
+
+After every window the running totals and the next window start are written
+to the checkpoint file, so an interrupted run (or a later run with a larger
+--end) resumes at the first unread window. A checkpoint whose table, start,
+bucket or filters differ from the current run is ignored.
+
+Usage:
+    python log_analytics.py --db /tmp/d1.sqlite [--table sys_logs] [--start 2025-01-01] [--end 2025-02-01]
+    python log_analytics.py --db /tmp/d1.sqlite --bucket day --level error --checkpoint logs.json
+    python log_analytics.py --db /tmp/d1.sqlite --function submission_created --output logs_report.json
+"""
+
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import time
+from collections import namedtuple
+from datetime import datetime, timezone
+from pathlib import Path
+
+CHECKPOINT_VERSION = 1
+
+HOUR_MS = 3600 * 1000
+BUCKET_MS = {'minute': 60 * 1000, 'hour': HOUR_MS, 'day': 24 * HOUR_MS}
+DEFAULT_WINDOW_HOURS = 24
+DEFAULT_TOP = 20
+MAX_PRINTED_BUCKETS = 48
+
+# table: time column, the two key columns, level column (None: no levels), error predicate,
+# and the column each CLI filter applies to
+LogSource = namedtuple('LogSource', ['table', 'time_column', 'key_columns', 'level_column', 'error_sql', 'filters'])
+
+SOURCES = {
+    'sys_logs': LogSource(
+        'sys_logs', 'createdAt', ('functionName', 'action'), 'level',
+        "LOWER(level) IN ('error', 'critical')",
+        {'function': 'functionName', 'action': 'action', 'level': 'level', 'project': 'projectId', 'user': 'userId'},
+    ),
+    'eventlogs': LogSource(
+        'eventlogs', 'timestamp', ('entityType', 'eventType'), None,
+        "eventType LIKE '%fail%' OR eventType LIKE '%error%'",
+        {'action': 'eventType', 'project': 'projectId', 'user': 'userId'},
+    ),
+}
+
+
+class LogAggregate:
+    """Running per-key, per-bucket and per-level totals for one table and range"""
+
+    def __init__(self, source, start, end, bucket_ms, filters):
+        self.source = source
+        self.start = start
+        self.end = end
+        self.bucket_ms = bucket_ms
+        self.filters = filters
+        self.next_start = start
+        self.rows = 0
+        self.errors = 0
+        self.keys = {}      # (key, key) → [rows, errors]
+        self.buckets = {}   # bucket start ms → [rows, errors]
+        self.levels = {}    # level → rows
+
+    def fold(self, key, bucket, level, rows, errors):
+        entry = self.keys.setdefault(key, [0, 0])
+        entry[0] += rows
+        entry[1] += errors
+        entry = self.buckets.setdefault(bucket, [0, 0])
+        entry[0] += rows
+        entry[1] += errors
+        if self.source.level_column:
+            self.levels[level] = self.levels.get(level, 0) + rows
+        self.rows += rows
+        self.errors += errors
+
+    def identity(self):
+        """What a checkpoint must match to be resumed (end may grow)"""
+        return {'table': self.source.table, 'start': self.start, 'bucketMs': self.bucket_ms,
+                'filters': self.filters}
+
+    def to_checkpoint(self):
+        return {
+            **self.identity(),
+            'nextStart': self.next_start,
+            'rows': self.rows,
+            'errors': self.errors,
+            'keys': [[*key, *entry] for key, entry in self.keys.items()],
+            'buckets': {str(bucket): entry for bucket, entry in self.buckets.items()},
+            'levels': [[level, rows] for level, rows in self.levels.items()],
+        }
+
+    def restore(self, state):
+        """Take over a checkpointed state; returns False if it belongs to a different run"""
+        if {key: state.get(key) for key in self.identity()} != self.identity():
+            return False
+        self.next_start = state['nextStart']
+        self.rows, self.errors = state['rows'], state['errors']
+        self.keys = {(first, second): [rows, errors] for first, second, rows, errors in state['keys']}
+        self.buckets = {int(bucket): entry for bucket, entry in state['buckets'].items()}
+        self.levels = {level: rows for level, rows in state['levels']}
+        return True
+
+
+def time_index(conn, source):
+    """Name of a full (non-partial) index whose first column is the time column, or None"""
+    row = conn.execute("""
+        SELECT il.name FROM pragma_index_list(?) il
+        JOIN pragma_index_info(il.name) ii
+        WHERE ii.seqno = 0 AND ii.name = ? AND il.partial = 0
+        ORDER BY il.name LIMIT 1
+    """, (source.table, source.time_column)).fetchone()
+    return row[0] if row else None
+
+
+def filter_clause(source, filters):
+    """(' AND column = ?' ..., params) for the filters that apply to `source`"""
+    clauses, params = [], []
+    for name, value in filters.items():
+        clauses.append(f" AND {source.filters[name]} = ?")
+        params.append(value)
+    return ''.join(clauses), params
+
+
+def window_query(conn, source, filters):
+    """Grouped per-window statement; binds bucket_ms, bucket_ms, window start, window end, filters"""
+    time_column = source.time_column
+    index = time_index(conn, source) if not filters else None
+    level = source.level_column or 'NULL'
+    where, _ = filter_clause(source, filters)
+    return f"""
+        SELECT {source.key_columns[0]}, {source.key_columns[1]},
+               ({time_column} / ?) * ?, {level},
+               COUNT(*), SUM(CASE WHEN {source.error_sql} THEN 1 ELSE 0 END)
+        FROM {source.table} {f'INDEXED BY {index}' if index else ''}
+        WHERE {time_column} >= ? AND {time_column} < ?{where}
+        GROUP BY 1, 2, 3, 4
+    """
+
+
+def time_range(conn, source, filters):
+    """(min, max + 1) of the time column under `filters`, or None for an empty table"""
+    where, params = filter_clause(source, filters)
+    low, high = conn.execute(f"""
+        SELECT MIN({source.time_column}), MAX({source.time_column}) FROM {source.table} WHERE 1 = 1{where}
+    """, params).fetchone()
+    return None if low is None else (low, high + 1)
+
+
+def stream_aggregate(conn, aggregate, window_ms, on_window=None):
+    """Fold windows [next_start, end) into `aggregate`, calling on_window(aggregate) after each"""
+    source = aggregate.source
+    sql = window_query(conn, source, aggregate.filters)
+    _, filter_params = filter_clause(source, aggregate.filters)
+    bucket_ms = aggregate.bucket_ms
+    while aggregate.next_start < aggregate.end:
+        window_end = min(aggregate.next_start + window_ms, aggregate.end)
+        for first, second, bucket, level, rows, errors in conn.execute(
+                sql, (bucket_ms, bucket_ms, aggregate.next_start, window_end, *filter_params)):
+            aggregate.fold((first, second), bucket, level, rows, errors)
+        aggregate.next_start = window_end
+        if on_window:
+            on_window(aggregate)
+    return aggregate
+
+
+def load_checkpoint(path):
+    """{table: state} from a checkpoint file ({} when missing or from another version)"""
+    if not path or not Path(path).exists():
+        return {}
+    data = json.loads(Path(path).read_text(encoding='utf-8'))
+    return data.get('tables', {}) if data.get('version') == CHECKPOINT_VERSION else {}
+
+
+def save_checkpoint(path, aggregates):
+    """Atomically write every table's state"""
+    data = {
+        'version': CHECKPOINT_VERSION,
+        'tables': {aggregate.source.table: aggregate.to_checkpoint() for aggregate in aggregates},
+    }
+    tmp_path = Path(f"{path}.tmp")
+    tmp_path.write_text(json.dumps(data, separators=(',', ':')), encoding='utf-8')
+    os.replace(tmp_path, path)
+
+
+def parse_time(value):
+    """Epoch milliseconds, or an ISO date / datetime (UTC unless it carries an offset)"""
+    if value is None:
+        return None
+    if value.lstrip('-').isdigit():
+        return int(value)
+    moment = datetime.fromisoformat(value)
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return int(moment.timestamp() * 1000)
+
+
+def format_time(ms):
+    return datetime.fromtimestamp(ms / 1000, tz=timezone.utc).strftime('%Y-%m-%d %H:%M')
+
+
+def _rate(entry):
+    return entry[1] / entry[0] if entry[0] else 0.0
+
+
+def print_aggregate(aggregate, top=DEFAULT_TOP):
+    source = aggregate.source
+    first, second = source.key_columns
+    print(f"\n   {'rows':>12} {'errors':>9} {'rate':>7}  {first} / {second}")
+    ranked = sorted(aggregate.keys.items(), key=lambda item: -item[1][0])
+    for (key_first, key_second), entry in ranked[:top]:
+        print(f"   {entry[0]:>12,} {entry[1]:>9,} {_rate(entry):>7.2%}  {key_first} / {key_second}")
+    if len(ranked) > top:
+        rest = [entry for _, entry in ranked[top:]]
+        print(f"   {sum(entry[0] for entry in rest):>12,} {sum(entry[1] for entry in rest):>9,}"
+              f" {'':>7}  … {len(rest)} more")
+
+    if aggregate.levels:
+        print("\n   Levels: " + ', '.join(
+            f"{level} {rows:,} ({rows / aggregate.rows:.1%})"
+            for level, rows in sorted(aggregate.levels.items(), key=lambda item: -item[1])))
+
+    if aggregate.buckets:
+        buckets = sorted(aggregate.buckets.items())
+        peak = max(entry[0] for _, entry in buckets)
+        worst_bucket, worst = max(buckets, key=lambda item: (_rate(item[1]), item[1][0]))
+        print(f"\n   {len(buckets):,} buckets; busiest {peak:,} rows, highest error rate "
+              f"{_rate(worst):.2%} at {format_time(worst_bucket)}")
+        if len(buckets) > MAX_PRINTED_BUCKETS:
+            print(f"   (last {MAX_PRINTED_BUCKETS} shown; --output has all of them)")
+        for bucket, entry in buckets[-MAX_PRINTED_BUCKETS:]:
+            bar = '█' * max(1, round(30 * entry[0] / peak)) if entry[0] else ''
+            print(f"   {format_time(bucket)} {entry[0]:>10,} {entry[1]:>7,} {_rate(entry):>7.2%}  {bar}")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Stream sys_logs / eventlogs over a time range: per-key counts, error rates, time buckets",
+    )
+    parser.add_argument('--db', required=True, help='SQLite database (opened read-only)')
+    parser.add_argument('--table', choices=(*SOURCES, 'all'), default='all', help='Log table(s) to analyze (default: all)')
+    parser.add_argument('--start', default=None, help='Range start: epoch ms or ISO date (default: oldest row)')
+    parser.add_argument('--end', default=None, help='Range end, exclusive (default: newest row + 1 ms)')
+    parser.add_argument('--bucket', choices=BUCKET_MS, default='hour', help='Time bucket size (default: hour)')
+    parser.add_argument('--window-hours', type=float, default=DEFAULT_WINDOW_HOURS,
+                        help=f'Time span read per grouped query, and checkpoint granularity '
+                             f'(default: {DEFAULT_WINDOW_HOURS})')
+    parser.add_argument('--checkpoint', default=None, metavar='PATH',
+                        help='Resume from / save progress to this JSON file after every window')
+    parser.add_argument('--output', default=None, metavar='PATH', help='Write the full aggregates as JSON')
+    parser.add_argument('--top', type=int, default=DEFAULT_TOP, help=f'Keys shown per table (default: {DEFAULT_TOP})')
+    for name in ('function', 'action', 'level', 'project', 'user'):
+        parser.add_argument(f'--{name}', default=None,
+                            help=f"Only rows with this {SOURCES['sys_logs'].filters[name]}"
+                                 + (" (eventType for eventlogs)" if name == 'action' else ""))
+    args = parser.parse_args()
+
+    filters = {name: getattr(args, name) for name in ('function', 'action', 'level', 'project', 'user')
+               if getattr(args, name) is not None}
+    window_ms = max(1, int(args.window_hours * HOUR_MS))
+    tables = list(SOURCES) if args.table == 'all' else [args.table]
+
+    print("=" * 80)
+    print("📈 Log Analytics")
+    print("=" * 80)
+
+    if not Path(args.db).exists():
+        print(f"❌ Database file not found: {args.db}")
+        return 1
+    conn = sqlite3.connect(f"file:{args.db}?mode=ro", uri=True)
+    saved = load_checkpoint(args.checkpoint)
+
+    aggregates = []
+    try:
+        for table in tables:
+            source = SOURCES[table]
+            unsupported = [name for name in filters if name not in source.filters]
+            if unsupported:
+                print(f"\n⏭️  {table}: skipped (no column for --{', --'.join(unsupported)})")
+                continue
+            table_filters = dict(filters)
+
+            bounds = time_range(conn, source, table_filters)
+            if bounds is None:
+                print(f"\n⏭️  {table}: no rows")
+                continue
+            start = parse_time(args.start) if args.start else bounds[0]
+            end = parse_time(args.end) if args.end else bounds[1]
+
+            aggregate = LogAggregate(source, start, end, BUCKET_MS[args.bucket], table_filters)
+            resumed = table in saved and aggregate.restore(saved[table])
+            aggregates.append(aggregate)
+
+            index = time_index(conn, source) if not table_filters else 'chosen by SQLite for the filters'
+            print(f"\n📜 {table}: {format_time(start)} → {format_time(end)} UTC, per {args.bucket}, "
+                  f"index {index or 'none on the time column'}")
+            if resumed:
+                print(f"   ↪️  Resuming at {format_time(aggregate.next_start)} "
+                      f"({aggregate.rows:,} rows already folded in)")
+
+            rows_before = aggregate.rows
+            started = time.perf_counter()
+            on_window = (lambda _: save_checkpoint(args.checkpoint, aggregates)) if args.checkpoint else None
+            stream_aggregate(conn, aggregate, window_ms, on_window)
+            elapsed = time.perf_counter() - started
+            read = aggregate.rows - rows_before
+            print(f"   ✅ {read:,} rows in {elapsed:.1f}s ({read / elapsed if elapsed else 0:,.0f} rows/s); "
+                  f"{aggregate.rows:,} total, {aggregate.errors:,} errors ({_rate([aggregate.rows, aggregate.errors]):.2%})")
+            print_aggregate(aggregate, args.top)
+    except KeyboardInterrupt:
+        print("\n⚠️  Interrupted" + (f"; rerun with --checkpoint {args.checkpoint} to resume"
+                                     if args.checkpoint else ""))
+        return 130
+    finally:
+        conn.close()
+
+    if args.output:
+        document = {
+            'createdAt': datetime.now().isoformat(timespec='seconds'),
+            'database': str(args.db),
+            'tables': {aggregate.source.table: {**aggregate.to_checkpoint(), 'end': aggregate.end}
+                       for aggregate in aggregates},
+        }
+        Path(args.output).write_text(json.dumps(document, indent=2), encoding='utf-8')
+        print(f"\n💾 Aggregates written to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,439 @@
+#!/usr/bin/env python3
+"""
+Migration Profiler
+==================
+Applies every database/migrations/*.sql file, in file-name order, to a copy
+of a scaled database (a D1 export or a synthetic_dataset.py file) and
+reports per file: wall time, pages written, the longest single write
+transaction and the slowest statement, against D1's per-query time limit.
+
+Statements run one by one the way `wrangler d1 execute` sends them: each in
+its own transaction unless the file wraps them in BEGIN ... COMMIT. The copy
+runs in WAL mode with auto-checkpointing off, so the frames a transaction
+appends to the -wal file are the pages it wrote.
+
+A scaled database built from schema.sql already contains what most
+migrations add. Before a file runs, the indexes it creates are dropped from
+the copy so their build is measured against the real row counts; columns are
+kept (so the data the new indexes cover stays in place), and an ADD COLUMN
+the table already has is reported as already applied, like schema_audit
+does. ADD COLUMN only rewrites the schema in SQLite, never the rows, so
+nothing material is lost by skipping it. Indexes a file drops without
+recreating them (003's table rebuild) are reported as warnings.
+
+For sys_logs_optimization.sql and notifications_optimization.sql the queries
+their indexes serve (TARGET_QUERIES) are timed warm and cold with
+query_latency.measure_query before and after the file runs.
+
+Usage:
+    python migration_profile.py --db /tmp/d1.sqlite [--output migrations.json]
+    python migration_profile.py --db /tmp/d1.sqlite --latency-runs 20 --workdir /var/tmp
+"""
+
+import argparse
+import json
+import os
+import re
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+from query_latency import MODES, measure_query
+from query_plan_audit import AuditedQuery, representative_context
+from schema_audit import ALREADY_APPLIED, SCHEMA_DIR, split_statements
+
+MIGRATIONS_DIR = SCHEMA_DIR / "migrations"
+
+# D1 stops a single query after 30 s; anything past the warning share of it is flagged
+D1_QUERY_LIMIT_MS = 30000
+LIMIT_WARNING_RATIO = 0.5
+
+DEFAULT_LATENCY_RUNS = 10
+
+READ_KEYWORDS = ('SELECT', 'PRAGMA', 'EXPLAIN', 'WITH')
+
+WAL_HEADER_BYTES = 32
+WAL_FRAME_HEADER_BYTES = 24
+
+_CREATE_INDEX = re.compile(
+    r'CREATE\s+(?:UNIQUE\s+)?INDEX\s+(?:IF\s+NOT\s+EXISTS\s+)?["`\[]?(\w+)', re.IGNORECASE)
+
+_NOTIFICATION_LOOKUP = "SELECT * FROM notifications WHERE {} = ?"
+
+# Reads the indexes of each optimization migration were added for
+TARGET_QUERIES = {
+    'notifications_optimization.sql': [
+        AuditedQuery('notifications.projectfeed', 'notifications/manage.ts:68', """
+            SELECT
+              n.*,
+              p.projectName
+            FROM notifications n
+            LEFT JOIN projects p ON n.projectId = p.projectId
+            WHERE n.targetUserEmail = ? AND n.isDeleted = 0 AND n.projectId = ? ORDER BY n.createdTime DESC LIMIT ? OFFSET 0
+        """, ('userEmail', 'projectId', 'limit')),
+        AuditedQuery('notifications.stageuser', 'migrations/notifications_optimization.sql:32', """
+            SELECT * FROM notifications WHERE stageId = ? AND targetUserEmail = ? ORDER BY createdTime DESC
+        """, ('stageId', 'userEmail')),
+        AuditedQuery('notifications.submission', 'migrations/notifications_optimization.sql:17',
+                     _NOTIFICATION_LOOKUP.format('submissionId'), ('submissionId',)),
+        AuditedQuery('notifications.group', 'migrations/notifications_optimization.sql:20',
+                     _NOTIFICATION_LOOKUP.format('groupId'), ('groupId',)),
+        AuditedQuery('notifications.transaction', 'migrations/notifications_optimization.sql:23',
+                     _NOTIFICATION_LOOKUP.format('transactionId'), ('transactionId',)),
+        AuditedQuery('notifications.settlement', 'migrations/notifications_optimization.sql:26',
+                     _NOTIFICATION_LOOKUP.format('settlementId'), ('settlementId',)),
+    ],
+    'sys_logs_optimization.sql': [
+        AuditedQuery('sys_logs.project', 'admin/system.ts:176', """
+            SELECT
+              sl.*,
+              COALESCE(u.displayName, sl.entityId) as displayName,
+              p.projectName
+            FROM sys_logs sl
+            LEFT JOIN users u ON sl.userId = u.userId
+            LEFT JOIN projects p ON sl.projectId = p.projectId
+            WHERE 1=1
+             AND sl.projectId = ? ORDER BY sl.createdAt DESC LIMIT ? OFFSET 0
+        """, ('projectId', 'limit')),
+        AuditedQuery('sys_logs.projectentity', 'admin/system.ts:176', """
+            SELECT
+              sl.*,
+              COALESCE(u.displayName, sl.entityId) as displayName,
+              p.projectName
+            FROM sys_logs sl
+            LEFT JOIN users u ON sl.userId = u.userId
+            LEFT JOIN projects p ON sl.projectId = p.projectId
+            WHERE 1=1
+             AND sl.entityType = ? AND sl.projectId = ? ORDER BY sl.createdAt DESC LIMIT ? OFFSET 0
+        """, ('logEntityType', 'projectId', 'limit')),
+        AuditedQuery('sys_logs.entity', 'migrations/sys_logs_optimization.sql:19', """
+            SELECT * FROM sys_logs WHERE entityType = ? AND entityId = ? ORDER BY createdAt DESC
+        """, ('logEntityType', 'logEntityId')),
+    ],
+}
+
+
+def target_context(conn):
+    """representative_context plus the submission, transaction and logged entity TARGET_QUERIES bind"""
+    context = representative_context(conn)
+
+    def scalar(sql, *params):
+        row = conn.execute(sql, params).fetchone()
+        return row[0] if row and row[0] is not None else ''
+
+    entity = conn.execute("""
+        SELECT entityType, entityId FROM sys_logs
+        WHERE projectId = ? AND entityType = 'submission' LIMIT 1
+    """, (context['projectId'],)).fetchone()
+    context.update(
+        submissionId=scalar("SELECT submissionId FROM submissions WHERE stageId = ? LIMIT 1", context['stageId']),
+        transactionId=scalar("SELECT transactionId FROM transactions WHERE projectId = ? LIMIT 1",
+                             context['projectId']),
+        logEntityType=entity[0] if entity else 'submission',
+        logEntityId=entity[1] if entity else '',
+    )
+    return context
+
+
+def copy_database(source, target):
+    """Online-backup `source` into `target` and switch the copy to WAL without auto-checkpoints"""
+    src = sqlite3.connect(f"file:{source}?mode=ro", uri=True)
+    conn = sqlite3.connect(target, isolation_level=None)
+    try:
+        src.backup(conn)
+    finally:
+        src.close()
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA wal_autocheckpoint = 0")
+    return conn
+
+
+class WalMeter:
+    """Pages written so far, read from the size of the -wal file"""
+
+    def __init__(self, conn, path):
+        self.conn = conn
+        self.wal_path = f"{path}-wal"
+        self.frame_bytes = conn.execute("PRAGMA page_size").fetchone()[0] + WAL_FRAME_HEADER_BYTES
+
+    def frames(self):
+        try:
+            size = os.path.getsize(self.wal_path)
+        except FileNotFoundError:
+            return 0
+        return max(0, size - WAL_HEADER_BYTES) // self.frame_bytes
+
+    def checkpoint(self):
+        """Fold the WAL into the database file and truncate it, so counting restarts at 0"""
+        self.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchall()
+
+
+def index_names(conn):
+    return {row[0] for row in conn.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'index' AND sql IS NOT NULL")}
+
+
+def rewind(conn, statements):
+    """Drop the indexes `statements` create; returns the names that existed"""
+    existing = index_names(conn)
+    dropped = []
+    for statement in statements:
+        match = _CREATE_INDEX.search(statement)
+        if match and match.group(1) in existing:
+            conn.execute(f'DROP INDEX IF EXISTS "{match.group(1)}"')
+            dropped.append(match.group(1))
+    return dropped
+
+
+def _first_line(statement):
+    return next((line.strip() for line in statement.splitlines()
+                 if line.strip() and not line.lstrip().startswith('--')), statement.strip())
+
+
+def apply_migration(conn, meter, statements):
+    """Run one migration statement by statement
+
+    Returns {'statements': [...], 'transactions': [...], 'ms', 'pages', 'error'}.
+    Each statement entry has its line, keyword, ms, pages and status ('ok',
+    'already applied' or 'error'); each write transaction (one autocommit
+    write, or BEGIN ... COMMIT) has its ms, pages and statement count. The
+    first unexpected error stops the file and rolls back an open transaction.
+    """
+    entries, transactions = [], []
+    open_txn, error = None, None
+    file_started, file_frames = time.perf_counter(), meter.frames()
+
+    for statement in statements:
+        keyword = _first_line(statement).split(None, 1)[0].rstrip(';').upper()
+        started, frames = time.perf_counter(), meter.frames()
+        if keyword == 'BEGIN':
+            open_txn = {'started': started, 'frames': frames, 'statements': 0}
+        status = 'ok'
+        try:
+            conn.execute(statement).fetchall()
+        except sqlite3.OperationalError as e:
+            if not any(marker in str(e) for marker in ALREADY_APPLIED):
+                status, error = 'error', f"{_first_line(statement)}: {e}"
+            else:
+                status = 'already applied'
+        finished = time.perf_counter()
+        entries.append({
+            'statement': _first_line(statement),
+            'keyword': keyword,
+            'ms': (finished - started) * 1000,
+            'pages': meter.frames() - frames,
+            'status': status,
+        })
+        if error:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            break
+
+        if keyword in ('BEGIN', 'COMMIT', 'END'):
+            if keyword != 'BEGIN' and open_txn is not None:
+                transactions.append({
+                    'statement': f"BEGIN ... COMMIT ({open_txn['statements']} statements)",
+                    'statements': open_txn['statements'],
+                    'ms': (finished - open_txn['started']) * 1000,
+                    'pages': meter.frames() - open_txn['frames'],
+                })
+                open_txn = None
+        elif open_txn is not None:
+            open_txn['statements'] += 1
+        elif keyword not in READ_KEYWORDS and status == 'ok':
+            transactions.append({
+                'statement': entries[-1]['statement'],
+                'statements': 1,
+                'ms': entries[-1]['ms'],
+                'pages': entries[-1]['pages'],
+            })
+
+    return {
+        'statements': entries,
+        'transactions': transactions,
+        'ms': (time.perf_counter() - file_started) * 1000,
+        'pages': meter.frames() - file_frames,
+        'error': error,
+    }
+
+
+def measure_targets(conn, queries, context, runs, reopen):
+    """{query name: {'rows', 'plan', 'warm', 'cold'}} for `queries`"""
+    results = {}
+    for query in queries:
+        result = measure_query(conn, query, context, runs, reopen)
+        results[query.name] = {
+            'source': query.source,
+            'rows': result['rows'],
+            **{mode: result[mode] for mode in MODES},
+        }
+    return results
+
+
+def profile_migrations(conn, path, migrations_dir=MIGRATIONS_DIR, runs=DEFAULT_LATENCY_RUNS,
+                       targets=TARGET_QUERIES, on_file=None):
+    """Rewind, apply and measure each migration on the copy at `path`; returns the per-file results"""
+    meter = WalMeter(conn, path)
+    context = target_context(conn)
+    reopen = lambda: sqlite3.connect(path)  # noqa: E731
+
+    profiles = []
+    for migration in sorted(Path(migrations_dir).glob('*.sql')):
+        statements = split_statements(migration.read_text(encoding='utf-8'))
+        rewound = rewind(conn, statements)
+        meter.checkpoint()
+
+        queries = targets.get(migration.name, [])
+        before = measure_targets(conn, queries, context, runs, reopen)
+        indexes_before = index_names(conn)
+        result = apply_migration(conn, meter, statements)
+        after = measure_targets(conn, queries, context, runs, reopen) if not result['error'] else {}
+
+        writes = result['transactions']
+        profile = {
+            'file': migration.name,
+            'ms': result['ms'],
+            'pages': result['pages'],
+            'longestTransaction': max(writes, key=lambda txn: txn['ms']) if writes else None,
+            'slowestStatement': max(result['statements'], key=lambda entry: entry['ms'], default=None),
+            'rewoundIndexes': rewound,
+            'lostIndexes': sorted(indexes_before - index_names(conn)),
+            'statements': result['statements'],
+            'transactions': writes,
+            'error': result['error'],
+            'latency': {name: {'before': before[name], 'after': after.get(name)} for name in before},
+        }
+        profiles.append(profile)
+        meter.checkpoint()
+        if on_file:
+            on_file(profile)
+    return context, profiles
+
+
+def limit_findings(profile, limit_ms=D1_QUERY_LIMIT_MS, warning_ratio=LIMIT_WARNING_RATIO):
+    """(severity, message) for statements and transactions at or near the D1 query limit"""
+    findings = []
+    if profile['error']:
+        findings.append(('issue', f"{profile['file']}: {profile['error']}"))
+    for kind, entries in (('statement', profile['statements']), ('transaction', profile['transactions'])):
+        for entry in entries:
+            if entry['ms'] >= limit_ms:
+                findings.append(('issue', f"{profile['file']}: {kind} took {entry['ms'] / 1000:.1f}s "
+                                          f"(D1 limit {limit_ms / 1000:g}s): {entry['statement']}"))
+            elif entry['ms'] >= limit_ms * warning_ratio:
+                findings.append(('warning', f"{profile['file']}: {kind} took {entry['ms'] / 1000:.1f}s, "
+                                            f"{entry['ms'] / limit_ms:.0%} of the D1 limit: {entry['statement']}"))
+    for name in profile['lostIndexes']:
+        findings.append(('warning', f"{profile['file']}: drops index {name} without recreating it"))
+    return findings
+
+
+def print_profile(profile):
+    longest = profile['longestTransaction']
+    print(f"\n📄 {profile['file']}")
+    print(f"   ⏱️  {profile['ms']:,.1f} ms wall, {profile['pages']:,} pages written, longest write transaction "
+          + (f"{longest['ms']:,.1f} ms ({longest['pages']:,} pages, {longest['statement']})" if longest else "none"))
+    if profile['rewoundIndexes']:
+        print(f"   ↩️  Dropped first so the build is measured: {', '.join(profile['rewoundIndexes'])}")
+    print(f"   {'ms':>10} {'pages':>8}  {'status':<16} statement")
+    for entry in profile['statements']:
+        if entry['keyword'] in READ_KEYWORDS and entry['status'] == 'ok' and entry['ms'] < 1:
+            continue
+        print(f"   {entry['ms']:>10,.1f} {entry['pages']:>8,}  {entry['status']:<16} {entry['statement'][:60]}")
+
+    if profile['latency']:
+        print(f"   ⚡ Target queries, p50 ms before → after:")
+        for name, sides in profile['latency'].items():
+            before, after = sides['before'], sides['after']
+            if after is None:
+                print(f"      {name:<28} not measured after (migration failed)")
+                continue
+            cells = []
+            for mode in MODES:
+                old, new = before[mode]['p50'], after[mode]['p50']
+                cells.append(f"{mode} {old:8.3f} → {new:8.3f} ({old / new if new else float('inf'):5.1f}×)")
+            print(f"      {name:<28} {'   '.join(cells)}   {after['rows']} rows")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Time database/migrations/*.sql on a copy of a scaled database",
+    )
+    parser.add_argument('--db', required=True, help='Scaled SQLite database to copy (left untouched)')
+    parser.add_argument('--migrations', default=str(MIGRATIONS_DIR), help='Migration directory (default: database/migrations)')
+    parser.add_argument('--workdir', default=None, help='Directory for the working copy (default: system temp)')
+    parser.add_argument('--latency-runs', type=int, default=DEFAULT_LATENCY_RUNS,
+                        help=f'Warm and cold runs per target query, before and after (default: {DEFAULT_LATENCY_RUNS})')
+    parser.add_argument('--limit-ms', type=float, default=D1_QUERY_LIMIT_MS,
+                        help=f'Per-query time limit to compare statements and transactions against '
+                             f'(default: {D1_QUERY_LIMIT_MS:g})')
+    parser.add_argument('--output', help='Write the profile as JSON')
+    args = parser.parse_args()
+
+    if not Path(args.db).exists():
+        parser.error(f"{args.db} not found")
+
+    print("=" * 80)
+    print("🗄️  Migration Profile")
+    print("=" * 80)
+
+    with tempfile.TemporaryDirectory(dir=args.workdir) as workdir:
+        path = str(Path(workdir) / 'migration_copy.sqlite')
+        started = time.perf_counter()
+        conn = copy_database(args.db, path)
+        try:
+            size_mib = Path(path).stat().st_size / 2**20
+            print(f"📁 {args.db} → working copy ({size_mib:,.0f} MiB, {time.perf_counter() - started:.1f}s)")
+            context, profiles = profile_migrations(conn, path, args.migrations, args.latency_runs,
+                                                   on_file=print_profile)
+        finally:
+            conn.close()
+
+    findings = [finding for profile in profiles for finding in limit_findings(profile, args.limit_ms)]
+    issues = [message for severity, message in findings if severity == 'issue']
+    warnings = [message for severity, message in findings if severity == 'warning']
+
+    print("\n" + "=" * 80)
+    print("📊 SUMMARY")
+    print("=" * 80)
+    print(f"   {'file':<40} {'wall ms':>10} {'pages':>9} {'longest txn ms':>15}")
+    for profile in profiles:
+        longest = profile['longestTransaction']
+        print(f"   {profile['file']:<40} {profile['ms']:>10,.1f} {profile['pages']:>9,} "
+              f"{longest['ms'] if longest else 0:>15,.1f}")
+    if warnings:
+        print(f"\n⚠️  Warnings ({len(warnings)}):")
+        for warning in warnings:
+            print(f"   - {warning}")
+    if issues:
+        print(f"\n❌ Issues ({len(issues)}):")
+        for issue in issues:
+            print(f"   - {issue}")
+    else:
+        print(f"\n✅ Every migration applied; no statement or transaction reached the "
+              f"{args.limit_ms / 1000:g}s limit")
+
+    if args.output:
+        document = {
+            'createdAt': datetime.now().isoformat(timespec='seconds'),
+            'python': sys.version.split()[0],
+            'sqlite': sqlite3.sqlite_version,
+            'database': str(args.db),
+            'latencyRuns': args.latency_runs,
+            'limitMs': args.limit_ms,
+            'context': {key: context[key] for key in ('projectId', 'stageId', 'userEmail')},
+            'migrations': profiles,
+            'issues': issues,
+            'warnings': warnings,
+        }
+        Path(args.output).write_text(json.dumps(document, indent=2, default=str), encoding='utf-8')
+        print(f"💾 Profile written to {args.output}")
+
+    return 1 if issues else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
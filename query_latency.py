@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+"""
+Query Latency Harness
+=====================
+Runs every registered read query N times warm and N times cold and reports
+p50 / p95 / p99 latency plus the rows returned, so we can see how the
+settlement hot-path reads (`rankings`, `transactions`) degrade as the tables
+grow.
+
+The registry is SQL_CHECKS (the statements test_sql_queries checks) followed
+by every read in query_plan_audit.REGISTRY, bound with the same
+representative context. Writes are skipped.
+
+Warm runs reuse one connection after an untimed priming execution. Each cold
+run starts from an empty SQLite page cache: on a fresh connection when a
+`reopen` callable is given (the tester opens it with its DatabaseOptions),
+otherwise after PRAGMA shrink_memory on the current one (--in-memory, where a
+new connection would be empty). A fresh connection loads the schema with an
+untimed statement first, so both paths time planning and data-page reads,
+not the connect or schema parse. The OS page cache stays warm either way,
+and an --in-memory copy has no page cache to drop, so its cold numbers stay
+close to warm.
+
+Results are stored as JSON together with the row counts of the hot tables.
+Comparing against a stored baseline flags any query/mode whose p50 is slower
+than baseline × threshold and at least MIN_REGRESSION_MS slower. The gate is
+the median because with a few dozen runs p95/p99 are close to the maximum
+and move with scheduler noise; they are stored and printed for reading.
+
+Usage:
+    python test_settlement.py --latency [--latency-runs 30] [--latency-output latency.json]
+    python test_settlement.py --latency --latency-baseline latency.json [--latency-threshold 1.25]
+"""
+
+import sqlite3
+import statistics
+import sys
+import time
+from datetime import datetime
+
+from query_plan_audit import REGISTRY, WRITE_KEYWORDS, AuditedQuery, bind, representative_context
+
+DEFAULT_LATENCY_RUNS = 20
+
+# p50 slower than baseline × threshold (and by at least MIN_REGRESSION_MS) is a regression
+DEFAULT_REGRESSION_THRESHOLD = 1.25
+MIN_REGRESSION_MS = 0.1
+REGRESSION_STAT = 'p50'
+
+PERCENTILES = (50, 95, 99)
+MODES = ('warm', 'cold')
+
+# Tables whose size is stored with every result (the settlement hot path)
+HOT_TABLES = ('rankings', 'transactions')
+
+SQL_CHECKS = [
+    AuditedQuery('sql.votes', 'scoring/settlement.ts:112', """
+        SELECT u.userEmail as proposerEmail, rp.rankingData
+        FROM rankings rp
+        JOIN users u ON rp.proposerUserId = u.userId
+        WHERE rp.stageId = ? AND rp.status = 'submitted'
+    """, ('stageId',)),
+    AuditedQuery('sql.settlementhistory', 'test_settlement.py', """
+        SELECT * FROM settlementhistory LIMIT 1
+    """, ()),
+    AuditedQuery('sql.stagesettlements', 'test_settlement.py', """
+        SELECT * FROM stagesettlements LIMIT 1
+    """, ()),
+]
+
+LATENCY_REGISTRY = SQL_CHECKS + [
+    query for query in REGISTRY if query.sql.lstrip().split(None, 1)[0].upper() not in WRITE_KEYWORDS
+]
+
+
+def percentile_summary(samples):
+    """p50/p95/p99 (inclusive interpolation), min and max of millisecond samples"""
+    if len(samples) > 1:
+        cuts = statistics.quantiles(samples, n=100, method='inclusive')
+        summary = {f'p{p}': cuts[p - 1] for p in PERCENTILES}
+    else:
+        summary = {f'p{p}': samples[0] for p in PERCENTILES}
+    summary.update(min=min(samples), max=max(samples), runs=len(samples))
+    return summary
+
+
+def _timed(conn, sql, params):
+    started = time.perf_counter()
+    rows = conn.execute(sql, params).fetchall()
+    return (time.perf_counter() - started) * 1000, rows
+
+
+def measure_query(conn, query, context, runs=DEFAULT_LATENCY_RUNS, reopen=None):
+    """Time one read `runs` times warm and `runs` times cold
+
+    Returns {'name', 'source', 'rows', 'sample', 'warm': summary, 'cold': summary};
+    `sample` holds the rows of the priming execution.
+    """
+    sql, params = bind(query, context)
+    _, sample = _timed(conn, sql, params)
+    warm = [_timed(conn, sql, params)[0] for _ in range(runs)]
+
+    cold = []
+    for _ in range(runs):
+        if reopen is not None:
+            fresh = reopen()
+            try:
+                fresh.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()
+                cold.append(_timed(fresh, sql, params)[0])
+            finally:
+                fresh.close()
+        else:
+            conn.execute("PRAGMA shrink_memory")
+            cold.append(_timed(conn, sql, params)[0])
+
+    return {
+        'name': query.name,
+        'source': query.source,
+        'rows': len(sample),
+        'sample': sample,
+        'warm': percentile_summary(warm),
+        'cold': percentile_summary(cold),
+    }
+
+
+def measure_registry(conn, registry=LATENCY_REGISTRY, runs=DEFAULT_LATENCY_RUNS, reopen=None, context=None):
+    """Measure every registry entry; returns (context, results)"""
+    context = context or representative_context(conn)
+    return context, [measure_query(conn, query, context, runs, reopen) for query in registry]
+
+
+def table_sizes(conn, tables=HOT_TABLES):
+    """{table: row count}; tables the database lacks are left out"""
+    sizes = {}
+    for table in tables:
+        try:
+            sizes[table] = conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+        except sqlite3.OperationalError:
+            continue
+    return sizes
+
+
+def latency_document(context, results, sizes, runs):
+    """JSON-serializable result (a future baseline)"""
+    return {
+        'createdAt': datetime.now().isoformat(timespec='seconds'),
+        'python': sys.version.split()[0],
+        'sqlite': sqlite3.sqlite_version,
+        'runs': runs,
+        'tableRows': sizes,
+        'context': {key: context[key] for key in ('projectId', 'stageId')},
+        'queries': {
+            result['name']: {
+                'source': result['source'],
+                'rows': result['rows'],
+                **{mode: result[mode] for mode in MODES},
+            }
+            for result in results
+        },
+    }
+
+
+def compare_to_baseline(document, baseline, threshold=DEFAULT_REGRESSION_THRESHOLD):
+    """Return (name, mode, baseline, current) REGRESSION_STAT values slower than baseline × threshold"""
+    previous = baseline.get('queries', {})
+    regressions = []
+    for name, entry in document['queries'].items():
+        for mode in MODES:
+            before = previous.get(name, {}).get(mode, {}).get(REGRESSION_STAT)
+            after = entry[mode][REGRESSION_STAT]
+            if before and after > before * threshold and after - before >= MIN_REGRESSION_MS:
+                regressions.append((name, mode, before, after))
+    return regressions
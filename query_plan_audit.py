@@ -0,0 +1,644 @@
+#!/usr/bin/env python3
+"""
+Query Plan Auditor
+==================
+Runs the backend's real SQL through EXPLAIN QUERY PLAN against a loaded D1
+export and flags the plan shapes that blow the Workers CPU budget as tables
+grow:
+
+- full table scans (SCAN <table> with no index)          → issue
+- automatic indexes built per execution                  → issue on a table,
+                                                           warning on a subquery
+- full index scans (SCAN <table> USING [COVERING] INDEX) → warning
+- temp B-trees (ORDER BY / GROUP BY / DISTINCT sorts)    → warning
+
+Scans of CTEs and FROM-subqueries are not flagged themselves; the plan lines
+that fill them are. Aliases (`tsr`, `rp`, `pvc`, ...) are resolved through
+the query text and the view definitions, so a scan inside
+rankingproposals_with_status is reported against its base table.
+
+REGISTRY holds the statements verbatim from handlers/scoring/settlement.ts,
+handlers/wallets/leaderboard.ts and the voting handlers (rankings/*.ts,
+comments/voting.ts). Parameters are bound from one representative context
+(the busiest stage, one of its members, teacher, group, proposal, comment and
+settlement) read from the database; `{name}` marks an IN (...) list. Reads are
+also executed and timed; writes are only planned.
+
+Usage:
+    python test_settlement.py --query-plans [--query-runs 5]
+"""
+
+import re
+import statistics
+import time
+from collections import namedtuple
+from textwrap import dedent
+
+# name: short id, source: handler file:line, sql: verbatim statement, params: context keys in bind order
+AuditedQuery = namedtuple('AuditedQuery', ['name', 'source', 'sql', 'params'])
+
+HANDLERS = 'scoringSystem-cf/packages/backend/src/handlers'
+
+DEFAULT_RUNS = 5
+
+# Statements get planned only (EXPLAIN QUERY PLAN never executes them)
+WRITE_KEYWORDS = ('INSERT', 'UPDATE', 'DELETE', 'REPLACE')
+
+SQL_KEYWORDS = {
+    'WHERE', 'ON', 'JOIN', 'LEFT', 'INNER', 'CROSS', 'NATURAL', 'OUTER', 'GROUP', 'ORDER',
+    'LIMIT', 'USING', 'SET', 'UNION', 'AND', 'OR', 'AS', 'WINDOW', 'HAVING',
+}
+
+_HELPFUL_AUTHORS = """
+    SELECT COUNT(DISTINCT c.authorEmail) as count
+    FROM comments c
+    WHERE c.stageId = ? AND c.isReply = 0
+    AND (c.mentionedGroups IS NOT NULL OR c.mentionedUsers IS NOT NULL)
+    AND EXISTS (
+      SELECT 1 FROM usergroups ug
+      WHERE ug.userEmail = c.authorEmail
+      AND ug.projectId = c.projectId
+      AND ug.isActive = 1
+    )
+    AND EXISTS (
+      SELECT 1 FROM (
+        SELECT targetId, reactionType,
+               ROW_NUMBER() OVER (PARTITION BY targetId, userEmail ORDER BY createdAt DESC) as rn
+        FROM reactions
+        WHERE targetType = 'comment'
+      ) r
+      WHERE r.targetId = c.commentId AND r.reactionType = 'helpful' AND r.rn = 1
+    )
+"""
+
+_LATEST_APPROVED_SUBMISSIONS = """
+    WITH LatestApprovedSubmissions AS (
+      SELECT
+        s.groupId,
+        s.submissionId,
+        s.participationProposal,
+        g.groupName,
+        ROW_NUMBER() OVER (
+          PARTITION BY s.groupId
+          ORDER BY s.submitTime DESC
+        ) as rn
+      FROM submissions_with_status s
+      JOIN groups g ON s.groupId = g.groupId
+      WHERE s.stageId = ?
+        AND s.approvedTime IS NOT NULL
+        AND s.groupId IN ({groupIds})
+    )
+    SELECT groupId, submissionId, participationProposal, groupName
+    FROM LatestApprovedSubmissions
+    WHERE rn = 1
+"""
+
+REGISTRY = [
+    # --- handlers/scoring/settlement.ts -----------------------------------
+    AuditedQuery('settlement.stage', 'scoring/settlement.ts:361', """
+        SELECT
+          stageId, stageName, status, reportRewardPool, commentRewardPool,
+          startTime, endTime, stageOrder
+        FROM stages_with_status
+        WHERE stageId = ? AND projectId = ?
+    """, ('stageId', 'projectId')),
+    AuditedQuery('settlement.teacher_vote_count', 'scoring/settlement.ts:398', """
+        SELECT COUNT(*) as count
+        FROM teachersubmissionrankings
+        WHERE projectId = ? AND stageId = ?
+    """, ('projectId', 'stageId')),
+    AuditedQuery('settlement.student_proposal_count', 'scoring/settlement.ts:404', """
+        SELECT COUNT(DISTINCT rp.groupId) as count
+        FROM rankingproposals_with_status rp
+        WHERE rp.stageId = ? AND rp.projectId = ?
+          AND rp.status = 'pending' AND rp.votingResult = 'agree'
+    """, ('stageId', 'projectId')),
+    AuditedQuery('settlement.lock_stage', 'scoring/settlement.ts:422', """
+        UPDATE stages
+        SET settlingTime = ?
+        WHERE stageId = ? AND settlingTime IS NULL
+    """, ('now', 'stageId')),
+    AuditedQuery('settlement.teacher_rankings', 'scoring/settlement.ts:459', """
+        SELECT
+          tsr.teacherEmail,
+          tsr.submissionId,
+          tsr.groupId,
+          tsr.rank,
+          tsr.createdTime
+        FROM teachersubmissionrankings tsr
+        WHERE tsr.projectId = ? AND tsr.stageId = ?
+        ORDER BY tsr.teacherEmail ASC, tsr.createdTime DESC
+    """, ('projectId', 'stageId')),
+    AuditedQuery('settlement.student_proposals', 'scoring/settlement.ts:483', """
+        WITH LatestSettledProposals AS (
+          SELECT
+            proposalId,
+            groupId,
+            rankingData,
+            createdTime,
+            votingResult,
+            status,
+            ROW_NUMBER() OVER (
+              PARTITION BY groupId
+              ORDER BY createdTime DESC
+            ) as rn
+          FROM rankingproposals_with_status
+          WHERE projectId = ?
+            AND stageId = ?
+            AND status = 'pending'
+            AND votingResult = 'agree'
+        )
+        SELECT
+          rankingData,
+          groupId
+        FROM LatestSettledProposals
+        WHERE rn = 1
+        ORDER BY groupId
+    """, ('projectId', 'stageId')),
+    AuditedQuery('settlement.teacher_comment_rankings', 'scoring/settlement.ts:579', """
+        SELECT
+          tcr.teacherEmail,
+          tcr.commentId,
+          tcr.rank,
+          tcr.createdTime
+        FROM teachercommentrankings tcr
+        WHERE tcr.projectId = ? AND tcr.stageId = ?
+        ORDER BY tcr.teacherEmail ASC, tcr.createdTime DESC
+    """, ('projectId', 'stageId')),
+    AuditedQuery('settlement.student_comment_votes', 'scoring/settlement.ts:599', """
+        WITH LatestCommentRankings AS (
+          SELECT
+            crp.proposalId,
+            crp.rankingData,
+            crp.authorEmail,
+            ROW_NUMBER() OVER (PARTITION BY crp.authorEmail ORDER BY crp.createdTime DESC) as rn
+          FROM commentrankingproposals crp
+          WHERE crp.stageId = ?
+        )
+        SELECT
+          lcr.rankingData,
+          lcr.authorEmail,
+          ug.groupId
+        FROM LatestCommentRankings lcr
+        JOIN usergroups ug ON ug.userEmail = lcr.authorEmail AND ug.projectId = ?
+        WHERE lcr.rn = 1 AND ug.isActive = 1
+    """, ('stageId', 'projectId')),
+    AuditedQuery('settlement.unique_comment_authors',
+                 'scoring/settlement.ts:627, rankings/teacherVote.ts:51, comments/voting.ts:154',
+                 _HELPFUL_AUTHORS, ('stageId',)),
+    AuditedQuery('settlement.stage_settled', 'scoring/settlement.ts:755', """
+        UPDATE stages
+        SET settlingTime = NULL,
+            settledTime = ?,
+            finalRankings = ?,
+            scoringResults = ?
+        WHERE stageId = ?
+    """, ('now', 'empty', 'empty', 'stageId')),
+    AuditedQuery('settlement.mark_active', 'scoring/settlement.ts:770', """
+        UPDATE settlementhistory
+        SET status = 'active'
+        WHERE settlementId = ? AND status = 'pending'
+    """, ('settlementId',)),
+    AuditedQuery('settlement.mark_proposals_settled', 'scoring/settlement.ts:777', """
+        UPDATE rankingproposals
+        SET settleTime = ?
+        WHERE projectId = ? AND stageId = ? AND settleTime IS NULL
+    """, ('now', 'projectId', 'stageId')),
+    AuditedQuery('settlement.comment_authors', 'scoring/settlement.ts:832, 923', """
+        SELECT commentId, authorEmail FROM comments
+        WHERE commentId IN ({commentIds})
+    """, ('commentIds',)),
+    AuditedQuery('settlement.group_names', 'scoring/settlement.ts:883', """
+        SELECT groupId, groupName
+        FROM groups
+        WHERE projectId = ? AND groupId IN ({groupIds})
+    """, ('projectId', 'groupIds')),
+    AuditedQuery('settlement.user_names', 'scoring/settlement.ts:946', """
+        SELECT userEmail, displayName
+        FROM users
+        WHERE userEmail IN ({userEmails})
+    """, ('userEmails',)),
+    AuditedQuery('settlement.settled_stage', 'scoring/settlement.ts:1096', """
+        SELECT stageId, stageName, status, finalRankings, scoringResults, settledTime
+        FROM stages_with_status
+        WHERE stageId = ? AND projectId = ?
+    """, ('stageId', 'projectId')),
+    AuditedQuery('settlement.active_settlement', 'scoring/settlement.ts:1111', """
+        SELECT * FROM settlementhistory
+        WHERE stageId = ? AND status = 'active'
+        ORDER BY settlementTime DESC
+        LIMIT 1
+    """, ('stageId',)),
+    AuditedQuery('settlement.settlement_details', 'scoring/settlement.ts:1119', """
+        SELECT * FROM stagesettlements
+        WHERE stageId = ? AND settlementId = ?
+        ORDER BY finalRank ASC
+    """, ('stageId', 'settlementId')),
+    AuditedQuery('settlement.latest_approved_submissions', 'scoring/settlement.ts:233, 1493',
+                 _LATEST_APPROVED_SUBMISSIONS, ('stageId', 'groupIds')),
+    AuditedQuery('settlement.awarded_comments', 'scoring/settlement.ts:1653', """
+        SELECT commentId, authorEmail, content
+        FROM comments
+        WHERE commentId IN ({commentIds})
+    """, ('commentIds',)),
+    AuditedQuery('settlement.award_comment', 'scoring/settlement.ts:1707', """
+        UPDATE comments
+        SET isAwarded = 1, awardRank = ?
+        WHERE commentId = ?
+    """, ('one', 'commentId')),
+
+    # --- handlers/wallets/leaderboard.ts ----------------------------------
+    AuditedQuery('leaderboard.top_balances', 'wallets/leaderboard.ts:24', """
+        SELECT
+          u.userId, u.userEmail, u.displayName,
+          SUM(t.amount) as balance,
+          COUNT(t.transactionId) as transactionCount
+        FROM transactions t
+        JOIN users u ON t.userEmail = u.userEmail
+        WHERE t.projectId = ?
+        GROUP BY u.userId, u.userEmail, u.displayName
+        ORDER BY balance DESC
+        LIMIT ?
+    """, ('projectId', 'limit')),
+    AuditedQuery('leaderboard.score_range', 'wallets/leaderboard.ts:75', """
+        SELECT scoreRangeMin, scoreRangeMax
+        FROM projects
+        WHERE projectId = ?
+    """, ('projectId',)),
+    AuditedQuery('leaderboard.member_balances', 'wallets/leaderboard.ts:90', """
+        SELECT
+          u.userId, u.userEmail, u.displayName,
+          u.avatarSeed, u.avatarStyle, u.avatarOptions,
+          COALESCE(SUM(t.amount), 0) as currentBalance
+        FROM usergroups ug
+        JOIN users u ON ug.userEmail = u.userEmail
+        LEFT JOIN transactions t ON u.userEmail = t.userEmail AND t.projectId = ?
+        WHERE ug.projectId = ? AND ug.isActive = 1
+        GROUP BY u.userId, u.userEmail, u.displayName, u.avatarSeed, u.avatarStyle, u.avatarOptions
+        ORDER BY currentBalance DESC
+    """, ('projectId', 'projectId')),
+    AuditedQuery('leaderboard.user_groups', 'wallets/leaderboard.ts:152', """
+        SELECT groupId FROM usergroups
+        WHERE userEmail = ? AND projectId = ? AND isActive = 1
+    """, ('userEmail', 'projectId')),
+    AuditedQuery('leaderboard.member_balances_by_group', 'wallets/leaderboard.ts:164', """
+        SELECT
+          u.userId, u.userEmail, u.displayName,
+          u.avatarSeed, u.avatarStyle, u.avatarOptions,
+          ug.groupId,
+          COALESCE(SUM(t.amount), 0) as currentBalance
+        FROM usergroups ug
+        JOIN users u ON ug.userEmail = u.userEmail
+        LEFT JOIN transactions t ON u.userEmail = t.userEmail AND t.projectId = ?
+        WHERE ug.projectId = ? AND ug.isActive = 1
+        GROUP BY u.userId, u.userEmail, u.displayName, u.avatarSeed, u.avatarStyle, u.avatarOptions, ug.groupId
+        ORDER BY currentBalance DESC
+    """, ('projectId', 'projectId')),
+    AuditedQuery('leaderboard.group_balances', 'wallets/leaderboard.ts:246', """
+        SELECT
+          pg.groupId, pg.groupName,
+          COUNT(DISTINCT pug.userEmail) as memberCount,
+          COALESCE(SUM(t.amount), 0) as totalBalance,
+          COALESCE(AVG(t.amount), 0) as avgBalancePerMember
+        FROM groups pg
+        JOIN usergroups pug ON pg.groupId = pug.groupId
+        LEFT JOIN users u ON pug.userEmail = u.userEmail
+        LEFT JOIN transactions t ON u.userEmail = t.userEmail AND t.projectId = ?
+        WHERE pg.projectId = ?
+        GROUP BY pg.groupId, pg.groupName
+        ORDER BY totalBalance DESC
+    """, ('projectId', 'projectId')),
+    AuditedQuery('leaderboard.all_balances', 'wallets/leaderboard.ts:294', """
+        SELECT
+          u.userId, u.userEmail, u.displayName,
+          COALESCE(SUM(t.amount), 0) as balance,
+          COUNT(t.transactionId) as transactionCount
+        FROM users u
+        LEFT JOIN transactions t ON u.userEmail = t.userEmail AND t.projectId = ?
+        WHERE u.userEmail IN (
+          SELECT userEmail FROM usergroups WHERE projectId = ?
+        )
+        GROUP BY u.userId, u.userEmail, u.displayName
+        ORDER BY balance DESC
+    """, ('projectId', 'projectId')),
+    AuditedQuery('leaderboard.project', 'wallets/leaderboard.ts:309', """
+        SELECT projectId, projectName, createdAt, scoreRangeMin, scoreRangeMax
+        FROM projects
+        WHERE projectId = ?
+    """, ('projectId',)),
+    AuditedQuery('leaderboard.stages', 'wallets/leaderboard.ts:413', """
+        SELECT stageId, stageName, stageOrder, endTime
+        FROM stages
+        WHERE projectId = ?
+        ORDER BY stageOrder ASC
+    """, ('projectId',)),
+    AuditedQuery('leaderboard.top_earner', 'wallets/leaderboard.ts:429', """
+        SELECT
+          u.userId,
+          u.userEmail,
+          u.displayName,
+          SUM(t.amount) as totalPoints
+        FROM transactions t
+        JOIN users u ON t.userEmail = u.userEmail
+        WHERE t.projectId = ?
+        GROUP BY u.userId, u.userEmail, u.displayName
+        ORDER BY totalPoints DESC
+        LIMIT 1
+    """, ('projectId',)),
+    AuditedQuery('leaderboard.stage_totals', 'wallets/leaderboard.ts:467', """
+        SELECT
+          s.stageId,
+          s.stageOrder,
+          COALESCE(SUM(t.amount), 0) as stageTotal
+        FROM stages s
+        LEFT JOIN transactions t ON t.stageId = s.stageId
+          AND t.projectId = ?
+          AND t.userEmail = ?
+        WHERE s.projectId = ?
+        GROUP BY s.stageId, s.stageOrder
+        ORDER BY s.stageOrder ASC
+    """, ('projectId', 'userEmail', 'projectId')),
+
+    # --- voting handlers ----------------------------------------------------
+    AuditedQuery('vote.proposal', 'rankings/vote.ts:34', """
+        SELECT proposalId, projectId, stageId, groupId, proposerEmail,
+               status, settleTime, withdrawnTime, resetTime
+        FROM rankingproposals_with_status
+        WHERE proposalId = ? AND projectId = ?
+    """, ('proposalId', 'projectId')),
+    AuditedQuery('vote.membership', 'rankings/vote.ts:63, stage-vote.ts:35, voting-status.ts:31', """
+        SELECT groupId, role FROM usergroups
+        WHERE userEmail = ? AND projectId = ? AND isActive = 1
+    """, ('userEmail', 'projectId')),
+    AuditedQuery('vote.group_size', 'rankings/vote.ts:83', """
+        SELECT COUNT(*) as count
+        FROM usergroups
+        WHERE projectId = ? AND groupId = ? AND isActive = 1
+    """, ('projectId', 'groupId')),
+    AuditedQuery('vote.proposal_votes', 'rankings/vote.ts:129', """
+        SELECT voteId, voterEmail, agree, timestamp
+        FROM proposalvotes
+        WHERE proposalId = ? AND projectId = ?
+    """, ('proposalId', 'projectId')),
+    AuditedQuery('vote.proposal_status', 'rankings/vote.ts:139, 218', """
+        SELECT status, votingResult, settleTime FROM rankingproposals_with_status WHERE proposalId = ?
+    """, ('proposalId',)),
+    AuditedQuery('vote.existing_vote', 'rankings/vote.ts:167', """
+        SELECT voteId FROM proposalvotes
+        WHERE proposalId = ? AND voterEmail = ?
+    """, ('proposalId', 'userEmail')),
+    AuditedQuery('vote.tally', 'rankings/vote.ts:223', """
+        SELECT
+          SUM(CASE WHEN agree = 1 THEN 1 ELSE 0 END) as agreeCount,
+          SUM(CASE WHEN agree = -1 THEN 1 ELSE 0 END) as disagreeCount,
+          COUNT(*) as totalVotes
+        FROM proposalvotes
+        WHERE proposalId = ?
+    """, ('proposalId',)),
+    AuditedQuery('stage_vote.stage', 'rankings/stage-vote.ts:45', """
+        SELECT stageId, stageName, status, config FROM stages_with_status
+        WHERE stageId = ? AND projectId = ?
+    """, ('stageId', 'projectId')),
+    AuditedQuery('stage_vote.groups', 'rankings/stage-vote.ts:75', """
+        SELECT groupId FROM groups
+        WHERE projectId = ? AND groupId IN ({groupIds})
+    """, ('projectId', 'groupIds')),
+    AuditedQuery('stage_vote.own_ranking', 'rankings/stage-vote.ts:116, voting-status.ts:103', """
+        SELECT proposalId, rankingData, createdAt, lastModified
+        FROM rankings
+        WHERE stageId = ? AND proposerUserId = ?
+    """, ('stageId', 'userId')),
+    AuditedQuery('teacher_vote.teacher', 'rankings/teacherVote.ts:79', """
+        SELECT role
+        FROM projectviewers
+        WHERE projectId = ? AND userEmail = ? AND role = 'teacher'
+    """, ('projectId', 'teacherEmail')),
+    AuditedQuery('teacher_vote.user', 'rankings/teacherVote.ts:94', """
+        SELECT userId FROM users WHERE userEmail = ?
+    """, ('teacherEmail',)),
+    AuditedQuery('teacher_vote.submission_ranking_count', 'rankings/teacherVote.ts:126', """
+        SELECT COUNT(*) as count FROM teachersubmissionrankings
+        WHERE projectId = ? AND stageId = ? AND teacherEmail = ?
+        ORDER BY createdTime DESC
+        LIMIT 10
+    """, ('projectId', 'stageId', 'teacherEmail')),
+    AuditedQuery('teacher_vote.comment_ranking_count', 'rankings/teacherVote.ts:133', """
+        SELECT COUNT(*) as count FROM teachercommentrankings
+        WHERE projectId = ? AND stageId = ? AND teacherEmail = ?
+        ORDER BY createdTime DESC
+        LIMIT 10
+    """, ('projectId', 'stageId', 'teacherEmail')),
+    AuditedQuery('voting_status.viewer', 'rankings/voting-status.ts:36', """
+        SELECT role FROM projectviewers
+        WHERE projectId = ? AND userEmail = ? AND role = 'teacher' AND isActive = 1
+    """, ('projectId', 'teacherEmail')),
+    AuditedQuery('voting_status.group_count', 'rankings/voting-status.ts:67', """
+        SELECT COUNT(DISTINCT groupId) as count FROM usergroups
+        WHERE projectId = ? AND isActive = 1
+    """, ('projectId',)),
+    AuditedQuery('voting_status.member_count', 'rankings/voting-status.ts:75', """
+        SELECT COUNT(DISTINCT userEmail) as count FROM usergroups
+        WHERE projectId = ? AND isActive = 1
+    """, ('projectId',)),
+    AuditedQuery('voting_status.proposal_count', 'rankings/voting-status.ts:83', """
+        SELECT COUNT(*) as count FROM rankingproposals_with_status
+        WHERE projectId = ? AND stageId = ? AND status != 'withdrawn'
+    """, ('projectId', 'stageId')),
+    AuditedQuery('voting_status.submitted_rankings', 'rankings/voting-status.ts:91', """
+        SELECT COUNT(*) as count FROM rankings
+        WHERE stageId = ? AND status = 'submitted'
+    """, ('stageId',)),
+    AuditedQuery('voting_status.proposals', 'rankings/voting-status.ts:121', """
+        SELECT
+          rp.proposalId,
+          rp.groupId,
+          rp.proposerEmail,
+          rp.status,
+          rp.votingResult,
+          rp.createdTime,
+          rp.agreeVotes,
+          rp.disagreeVotes,
+          rp.totalVotes,
+          g.groupName
+        FROM rankingproposals_with_status rp
+        LEFT JOIN groups g ON rp.groupId = g.groupId
+        WHERE rp.projectId = ? AND rp.stageId = ?
+        ORDER BY rp.createdTime DESC
+    """, ('projectId', 'stageId')),
+    AuditedQuery('comment_vote.own_comments', 'comments/voting.ts:22', """
+        SELECT commentId, mentionedGroups, mentionedUsers
+        FROM comments
+        WHERE projectId = ? AND stageId = ? AND authorEmail = ? AND isReply = 0
+    """, ('projectId', 'stageId', 'userEmail')),
+    AuditedQuery('comment_vote.latest_proposal', 'comments/voting.ts:72, 286, 369', """
+        SELECT rankingData
+        FROM commentrankingproposals
+        WHERE projectId = ? AND stageId = ? AND authorEmail = ?
+        ORDER BY createdTime DESC
+        LIMIT 1
+    """, ('projectId', 'stageId', 'userEmail')),
+    AuditedQuery('comment_vote.proposal_count', 'comments/voting.ts:84', """
+        SELECT COUNT(*) as count
+        FROM commentrankingproposals
+        WHERE projectId = ? AND stageId = ?
+    """, ('projectId', 'stageId')),
+    AuditedQuery('comment_vote.teacher_rank', 'comments/voting.ts:308', """
+        SELECT rank
+        FROM teachercommentrankings
+        WHERE projectId = ? AND stageId = ? AND commentId = ?
+        ORDER BY createdTime DESC
+        LIMIT 1
+    """, ('projectId', 'stageId', 'commentId')),
+    AuditedQuery('comment_vote.stage_comments', 'comments/voting.ts:352', """
+        SELECT c.commentId, c.authorEmail, c.awardRank
+        FROM comments c
+        LEFT JOIN projectviewers pv
+          ON pv.userEmail = c.authorEmail
+          AND pv.projectId = c.projectId
+        WHERE c.projectId = ? AND c.stageId = ? AND c.isReply = 0
+          AND (pv.role IS NULL OR pv.role != 'teacher')
+    """, ('projectId', 'stageId')),
+    AuditedQuery('comment_vote.teacher_rankings', 'comments/voting.ts:392', """
+        SELECT teacherEmail, commentId, rank, createdTime
+        FROM teachercommentrankings
+        WHERE projectId = ? AND stageId = ?
+        ORDER BY teacherEmail ASC, createdTime DESC
+    """, ('projectId', 'stageId')),
+    AuditedQuery('comment_vote.proposal_history', 'comments/voting.ts:477', """
+        SELECT proposalId, rankingData, createdTime, metadata
+        FROM commentrankingproposals
+        WHERE projectId = ? AND stageId = ? AND authorEmail = ?
+        ORDER BY createdTime ASC
+    """, ('projectId', 'stageId', 'userEmail')),
+]
+
+
+def representative_context(conn, list_limit=50):
+    """Bind values for REGISTRY parameters, taken from the busiest stage in the database
+
+    Missing entities bind as '' (the plan does not depend on the value).
+    """
+    def scalar(sql, *params):
+        row = conn.execute(sql, params).fetchone()
+        return row[0] if row and row[0] is not None else ''
+
+    def column(sql, *params):
+        return [row[0] for row in conn.execute(sql, params)] or ['']
+
+    stage_id = scalar("""
+        SELECT s.stageId FROM stages s
+        ORDER BY (SELECT COUNT(*) FROM rankingproposals rp WHERE rp.stageId = s.stageId)
+               + (SELECT COUNT(*) FROM rankings r WHERE r.stageId = s.stageId)
+               + (SELECT COUNT(*) FROM comments c WHERE c.stageId = s.stageId) DESC
+        LIMIT 1
+    """)
+    project_id = scalar("SELECT projectId FROM stages WHERE stageId = ?", stage_id)
+    user_email = scalar("""
+        SELECT userEmail FROM usergroups WHERE projectId = ? AND isActive = 1 ORDER BY joinTime LIMIT 1
+    """, project_id)
+    return {
+        'stageId': stage_id,
+        'projectId': project_id,
+        'userEmail': user_email,
+        'userId': scalar("SELECT userId FROM users WHERE userEmail = ?", user_email),
+        'groupId': scalar("""
+            SELECT groupId FROM usergroups WHERE projectId = ? AND userEmail = ? AND isActive = 1
+        """, project_id, user_email),
+        'teacherEmail': scalar("""
+            SELECT userEmail FROM projectviewers WHERE projectId = ? AND role = 'teacher' LIMIT 1
+        """, project_id),
+        'proposalId': scalar("""
+            SELECT proposalId FROM rankingproposals WHERE stageId = ? ORDER BY createdTime DESC LIMIT 1
+        """, stage_id),
+        'commentId': scalar("SELECT commentId FROM comments WHERE stageId = ? LIMIT 1", stage_id),
+        'settlementId': scalar("""
+            SELECT settlementId FROM settlementhistory WHERE stageId = ? ORDER BY settlementTime DESC LIMIT 1
+        """, stage_id),
+        'groupIds': column("SELECT groupId FROM groups WHERE projectId = ? LIMIT ?", project_id, list_limit),
+        'commentIds': column("SELECT commentId FROM comments WHERE stageId = ? LIMIT ?", stage_id, list_limit),
+        'userEmails': column("""
+            SELECT DISTINCT userEmail FROM usergroups WHERE projectId = ? LIMIT ?
+        """, project_id, list_limit),
+        'limit': 100,
+        'now': int(time.time() * 1000),
+        'one': 1,
+        'empty': '{}',
+    }
+
+
+def bind(query, context):
+    """Expand {list} markers into IN placeholders; returns (sql, params)"""
+    sql, params = dedent(query.sql).strip(), []
+    for key in query.params:
+        value = context[key]
+        if isinstance(value, list):
+            sql = sql.replace('{' + key + '}', ','.join('?' * len(value)), 1)
+            params.extend(value)
+        else:
+            params.append(value)
+    return sql, params
+
+
+def alias_map(conn, sql):
+    """alias → base table for `FROM x a` / `JOIN x AS a` in the query and every view"""
+    texts = [sql] + [row[0] for row in conn.execute("SELECT sql FROM sqlite_master WHERE type = 'view'")]
+    tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    aliases = {table: table for table in tables}
+    for text in texts:
+        for table, alias in re.findall(r'\b(?:FROM|JOIN)\s+(\w+)(?:\s+(?:AS\s+)?(\w+))?', text, re.I):
+            if table in tables and alias and alias.upper() not in SQL_KEYWORDS:
+                aliases.setdefault(alias, table)
+    return aliases
+
+
+def classify_plan(plan, aliases):
+    """Flag plan lines; returns [(severity, flag, detail)]"""
+    flags = []
+    for detail in plan:
+        match = re.match(r'(SCAN|SEARCH) (\S+)', detail)
+        table = aliases.get(match.group(2)) if match else None
+        if 'AUTOMATIC' in detail:
+            flags.append(('issue' if table else 'warning', 'automatic index', detail))
+        elif match and match.group(1) == 'SCAN' and table:
+            if 'INDEX' in detail:
+                flags.append(('warning', 'full index scan', detail))
+            else:
+                flags.append(('issue', 'full table scan', detail))
+        elif 'TEMP B-TREE' in detail:
+            flags.append(('warning', 'temp b-tree', detail))
+    return flags
+
+
+def audit_query(conn, query, context, runs=DEFAULT_RUNS):
+    """Plan (and for reads, time) one registry entry
+
+    Returns {'name', 'source', 'plan', 'flags', 'rows', 'timings'} with
+    timings in milliseconds (empty for writes).
+    """
+    sql, params = bind(query, context)
+    plan = [row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params)]
+    result = {
+        'name': query.name,
+        'source': query.source,
+        'plan': plan,
+        'flags': classify_plan(plan, alias_map(conn, sql)),
+        'rows': None,
+        'timings': [],
+    }
+    if sql.lstrip().split(None, 1)[0].upper() not in WRITE_KEYWORDS:
+        for _ in range(runs):
+            started = time.perf_counter()
+            rows = conn.execute(sql, params).fetchall()
+            result['timings'].append((time.perf_counter() - started) * 1000)
+        result['rows'] = len(rows)
+    return result
+
+
+def audit_registry(conn, registry=REGISTRY, runs=DEFAULT_RUNS, context=None):
+    """Audit every registry entry; returns (context, results)"""
+    context = context or representative_context(conn)
+    return context, [audit_query(conn, query, context, runs) for query in registry]
+
+
+def median_ms(result):
+    return statistics.median(result['timings']) if result['timings'] else None
@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+"""
+Monte Carlo Rank Stability
+==========================
+How stable is a close settlement? Each replicate re-scores a stage with
+resampled ballots and (optionally) jittered student/teacher weights, using
+the same mid-rank averaging, weighted score and FLOAT_TOLERANCE standard
+ranking as settlement_engine.py.
+
+Replicates never rebuild ballots. Ballots are normalized to mid-ranks once;
+a replicate is a vector of per-ballot multiplicities (bootstrap: multinomial
+draws, jackknife: leave-one-out), so a block of R replicates is
+
+    sums   = C (R × voters) @ mid_ranks (voters × items)
+    counts = C @ ranked
+
+followed by row-wise sorting and ranking of an R × items score array, and an
+R × items × items comparison for the pairwise swap tally. Blocks are
+sharded across a process pool with independent SeedSequence streams.
+
+Usage:
+    python test_settlement.py --stability [--replicates 5000] [--resample jackknife]
+                              [--weight-jitter 0.1] [--workers 4] [--seed 1]
+
+Requires: numpy
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from settlement_engine import FLOAT_TOLERANCE, dense_to_mid_ranks, pad_columns
+
+RESAMPLE_METHODS = ('bootstrap', 'jackknife')
+
+# Replicates scored per array block (bounds the R × items × items swap tally)
+BLOCK_SIZE = 256
+
+
+class StabilityInputs:
+    """Mid-rank matrices of one stage, normalized once and shared by every replicate"""
+
+    def __init__(self, teacher_matrix, student_matrix):
+        width = max(teacher_matrix.shape[1], student_matrix.shape[1])
+        teacher = dense_to_mid_ranks(pad_columns(teacher_matrix, width))
+        student = dense_to_mid_ranks(pad_columns(student_matrix, width))
+        self.width = width
+        self.teacher_ranked = ~np.isnan(teacher)
+        self.student_ranked = ~np.isnan(student)
+        self.teacher = np.where(self.teacher_ranked, teacher, 0.0)
+        self.student = np.where(self.student_ranked, student, 0.0)
+
+
+def resample_counts(rng, voters, replicates, method, start=0):
+    """Per-replicate ballot multiplicities (replicates × voters)
+
+    Jackknife replicate k drops ballot start + k; with no ballots every
+    replicate is empty.
+    """
+    if voters == 0:
+        return np.zeros((replicates, 0))
+    if method == 'jackknife':
+        counts = np.ones((replicates, voters))
+        counts[np.arange(replicates), (start + np.arange(replicates)) % voters] = 0.0
+        return counts
+    return rng.multinomial(voters, np.full(voters, 1.0 / voters), size=replicates).astype(float)
+
+
+def replicate_ranks(inputs, student_counts, teacher_counts, student_weights, teacher_weights,
+                    tolerance=FLOAT_TOLERANCE):
+    """Standard ranks of one block of replicates (R × items; 0 = item not ranked)"""
+    student_sums = student_counts @ inputs.student
+    student_votes = student_counts @ inputs.student_ranked
+    teacher_sums = teacher_counts @ inputs.teacher
+    teacher_votes = teacher_counts @ inputs.teacher_ranked
+
+    participating = (student_votes + teacher_votes) > 0
+    worst_rank = participating.sum(axis=1, keepdims=True) + 1.0
+    student_avg = np.divide(student_sums, student_votes, out=np.broadcast_to(worst_rank, student_sums.shape).copy(),
+                            where=student_votes > 0)
+    teacher_avg = np.divide(teacher_sums, teacher_votes, out=np.broadcast_to(worst_rank, teacher_sums.shape).copy(),
+                            where=teacher_votes > 0)
+    scores = student_avg * student_weights[:, None] + teacher_avg * teacher_weights[:, None]
+    scores[~participating] = np.inf
+
+    # Row-wise standard_ranking; non-participating items sort last and get rank 0
+    order = np.argsort(scores, axis=1, kind='stable')
+    sorted_scores = np.take_along_axis(scores, order, axis=1)
+    tied = np.zeros(sorted_scores.shape, dtype=bool)
+    with np.errstate(invalid='ignore'):
+        tied[:, 1:] = np.abs(np.diff(sorted_scores, axis=1)) < tolerance
+    positions = np.broadcast_to(np.arange(1, inputs.width + 1), tied.shape)
+    sorted_ranks = np.maximum.accumulate(np.where(tied, 0, positions), axis=1)
+
+    ranks = np.empty_like(sorted_ranks)
+    np.put_along_axis(ranks, order, sorted_ranks, axis=1)
+    ranks[~participating] = 0
+    return ranks
+
+
+def tally_ranks(ranks, width):
+    """(rank histogram items × (width + 1), beats items × items) for a block of replicates
+
+    beats[i, j] counts replicates where item i ranked strictly ahead of j.
+    """
+    columns = np.broadcast_to(np.arange(width), ranks.shape)
+    histogram = np.bincount((columns * (width + 1) + ranks).ravel(),
+                            minlength=width * (width + 1)).reshape(width, width + 1)
+    ranked = ranks > 0
+    ahead = (ranks[:, :, None] < ranks[:, None, :]) & ranked[:, :, None] & ranked[:, None, :]
+    return histogram, ahead.sum(axis=0)
+
+
+def run_shard(inputs, replicates, method, weights, weight_jitter, seed, start=0, tolerance=FLOAT_TOLERANCE):
+    """Simulate `replicates` replicates in blocks; returns summed (histogram, beats)"""
+    rng = np.random.default_rng(seed)
+    student_weight, teacher_weight = weights
+    histogram = np.zeros((inputs.width, inputs.width + 1), dtype=np.int64)
+    beats = np.zeros((inputs.width, inputs.width), dtype=np.int64)
+
+    for block_start in range(0, replicates, BLOCK_SIZE):
+        size = min(BLOCK_SIZE, replicates - block_start)
+        student_counts = resample_counts(rng, inputs.student.shape[0], size, method, start + block_start)
+        # Jackknife leaves out one student ballot at a time; bootstrap also resamples teachers
+        teacher_counts = (np.ones((size, inputs.teacher.shape[0])) if method == 'jackknife'
+                          else resample_counts(rng, inputs.teacher.shape[0], size, method))
+        # Jitter moves weight between students and teachers, keeping the total
+        shift = rng.uniform(-weight_jitter, weight_jitter, size) if weight_jitter else np.zeros(size)
+        student_weights = np.clip(student_weight + shift, 0.0, student_weight + teacher_weight)
+        teacher_weights = (student_weight + teacher_weight) - student_weights
+
+        ranks = replicate_ranks(inputs, student_counts, teacher_counts, student_weights, teacher_weights, tolerance)
+        block_histogram, block_beats = tally_ranks(ranks, inputs.width)
+        histogram += block_histogram
+        beats += block_beats
+    return histogram, beats
+
+
+def _run_shard_task(args):
+    return run_shard(*args)
+
+
+def analyze_stability(teacher_matrix, student_matrix, student_weight, teacher_weight, replicates=2000,
+                      method='bootstrap', weight_jitter=0.0, seed=None, workers=1, tolerance=FLOAT_TOLERANCE):
+    """Run the Monte Carlo study for one stage
+
+    Jackknife always runs one replicate per student ballot (`replicates` is
+    ignored). Returns {'replicates', 'histogram', 'beats'} with counts summed
+    over every shard.
+    """
+    if method not in RESAMPLE_METHODS:
+        raise ValueError(f"unknown resample method {method!r}")
+    inputs = StabilityInputs(teacher_matrix, student_matrix)
+    if method == 'jackknife':
+        replicates = inputs.student.shape[0]
+
+    workers = max(1, min(workers or 1, replicates or 1))
+    shard_sizes = [replicates // workers + (1 if k < replicates % workers else 0) for k in range(workers)]
+    seeds = np.random.SeedSequence(seed).spawn(workers)
+    starts = np.concatenate([[0], np.cumsum(shard_sizes)[:-1]])
+    tasks = [(inputs, size, method, (student_weight, teacher_weight), weight_jitter, child, int(start), tolerance)
+             for size, child, start in zip(shard_sizes, seeds, starts) if size > 0]
+
+    if len(tasks) > 1:
+        with ProcessPoolExecutor(max_workers=len(tasks)) as pool:
+            results = list(pool.map(_run_shard_task, tasks))
+    else:
+        results = [_run_shard_task(task) for task in tasks]
+
+    histogram = np.zeros((inputs.width, inputs.width + 1), dtype=np.int64)
+    beats = np.zeros((inputs.width, inputs.width), dtype=np.int64)
+    for shard_histogram, shard_beats in results:
+        histogram += shard_histogram
+        beats += shard_beats
+    return {'replicates': replicates, 'histogram': histogram, 'beats': beats}
+
+
+def summarize_stability(study, baseline_ranks, item_ids):
+    """Per-item rank distributions and pairwise swap probabilities
+
+    `baseline_ranks` are the engine's rankings per column (0 = not ranked).
+    Returns (items, swaps): items in baseline order with the probability of
+    each rank and of keeping the baseline rank; swaps for every pair (a ahead
+    of b in the baseline) with the probability that b finishes strictly ahead
+    and that neither is strictly ahead (tied, or one of them unranked).
+    """
+    replicates = max(study['replicates'], 1)
+    histogram, beats = study['histogram'], study['beats']
+    columns = [column for column in np.argsort(baseline_ranks, kind='stable') if baseline_ranks[column] > 0]
+
+    items = []
+    for column in columns:
+        counts = histogram[column]
+        ranked = counts[1:].sum()
+        distribution = {rank: counts[rank] / replicates for rank in np.flatnonzero(counts[1:]) + 1}
+        mean_rank = float((np.arange(1, counts.size) * counts[1:]).sum() / ranked) if ranked else None
+        items.append({
+            'itemId': item_ids[column],
+            'baselineRank': int(baseline_ranks[column]),
+            'meanRank': mean_rank,
+            'pBaselineRank': counts[baseline_ranks[column]] / replicates,
+            'pUnranked': counts[0] / replicates,
+            'rankDistribution': {int(rank): float(p) for rank, p in distribution.items()},
+        })
+
+    swaps = []
+    for i, a in enumerate(columns):
+        for b in columns[i + 1:]:
+            swaps.append({
+                'ahead': item_ids[a],
+                'behind': item_ids[b],
+                'pSwap': beats[b, a] / replicates,
+                'pTie': 1.0 - (beats[a, b] + beats[b, a]) / replicates,
+            })
+    return items, swaps
@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+"""
+Schema & Index Audit
+====================
+Diffs the live D1 catalog against database/schema.sql plus
+database/migrations/*.sql: tables, columns (type, NOT NULL, primary key),
+every idx_* index (table, key columns with sort order, UNIQUE, partial WHERE)
+and the views (the *_with_status views the handlers read through).
+
+The expected catalog is built by applying schema.sql and then each migration,
+statement by statement in file-name order, to a scratch :memory: database, so
+SQLite's own parser handles triggers, partial indexes and the table rebuild
+in 003_remove_lastLoginTime.sql. Statements a deployed database has already
+absorbed (a column schema.sql now declares, an index that exists) fail the
+same way `wrangler d1 execute` would and are skipped.
+
+Both sides are then read with one catalog query: sqlite_master joined to the
+pragma_table_info / pragma_index_list / pragma_index_xinfo table-valued
+functions.
+
+Usage:
+    python test_settlement.py            # audit runs right after the schema check
+"""
+
+import sqlite3
+from pathlib import Path
+
+SCHEMA_DIR = Path(__file__).parent / "database"
+
+# Objects D1 / SQLite create for themselves
+INTERNAL_PREFIXES = ('sqlite_', '_cf_', 'd1_')
+
+# Errors from re-applying a migration the base schema already contains
+ALREADY_APPLIED = ('duplicate column name', 'already exists')
+
+CATALOG_QUERY = """
+    SELECT m.type, m.name, m.tbl_name, c.cid, c.name, c.type, c."notnull", c.pk, NULL
+    FROM sqlite_master m
+    JOIN pragma_table_info(m.name) c
+    WHERE m.type IN ('table', 'view')
+    UNION ALL
+    SELECT 'index', i.name, m.name, x.seqno, x.name, NULL, i."unique", x."desc", i.partial
+    FROM sqlite_master m
+    JOIN pragma_index_list(m.name) i
+    JOIN pragma_index_xinfo(i.name) x
+    WHERE m.type = 'table' AND x.key = 1
+    ORDER BY 1, 2, 4
+"""
+
+
+def split_statements(sql):
+    """Split a script into complete statements (trigger bodies stay whole)"""
+    statements, pending = [], ''
+    for line in sql.splitlines(keepends=True):
+        pending += line
+        if sqlite3.complete_statement(pending):
+            statement = pending.strip()
+            if statement.rstrip(';').strip():
+                statements.append(statement)
+            pending = ''
+    return statements
+
+
+def build_expected_connection(schema_dir=SCHEMA_DIR):
+    """Apply schema.sql and the migrations to :memory:; returns (conn, skipped statements)
+
+    `skipped` lists (file name, first line, error) for statements rejected as
+    already applied.
+    """
+    schema_dir = Path(schema_dir)
+    conn = sqlite3.connect(':memory:', isolation_level=None)
+    conn.executescript((schema_dir / 'schema.sql').read_text(encoding='utf-8'))
+
+    skipped = []
+    for path in sorted((schema_dir / 'migrations').glob('*.sql')):
+        for statement in split_statements(path.read_text(encoding='utf-8')):
+            keyword = statement.lstrip().split(None, 1)[0].upper()
+            if keyword in ('BEGIN', 'COMMIT', 'END', 'ROLLBACK', 'SELECT', 'PRAGMA'):
+                continue
+            try:
+                conn.execute(statement)
+            except sqlite3.OperationalError as e:
+                if not any(marker in str(e) for marker in ALREADY_APPLIED):
+                    raise
+                first_line = next(line for line in statement.splitlines() if not line.lstrip().startswith('--'))
+                skipped.append((path.name, first_line.strip(), str(e)))
+    return conn, skipped
+
+
+def read_catalog(conn):
+    """One-query snapshot of tables, views and indexes
+
+    Returns {'table': {name: {column: (type, notnull, pk)}},
+             'view': {name: [column, ...]},
+             'index': {name: {'table', 'columns', 'unique', 'partial'}}}.
+    """
+    catalog = {'table': {}, 'view': {}, 'index': {}}
+    for kind, name, table, _, column, col_type, flag, extra, partial in conn.execute(CATALOG_QUERY):
+        if name.startswith(INTERNAL_PREFIXES) or table.startswith(INTERNAL_PREFIXES):
+            continue
+        if kind == 'table':
+            catalog['table'].setdefault(name, {})[column] = ((col_type or '').upper(), bool(flag), extra)
+        elif kind == 'view':
+            catalog['view'].setdefault(name, []).append(column)
+        else:
+            index = catalog['index'].setdefault(name, {
+                'table': table, 'columns': [], 'unique': bool(flag), 'partial': bool(partial),
+            })
+            index['columns'].append(f"{column} DESC" if extra else column)
+    return catalog
+
+
+def diff_catalogs(expected, live):
+    """Findings as (severity, kind, object name, detail); severity is 'issue' or 'warning'
+
+    Anything expected but absent or different is an issue; objects only the
+    live database has (indexes added by hand, leftover tables) are warnings.
+    Only idx_* indexes are compared; autoindexes follow their constraints.
+    """
+    findings = []
+
+    for table, columns in expected['table'].items():
+        live_columns = live['table'].get(table)
+        if live_columns is None:
+            findings.append(('issue', 'table', table, 'missing'))
+            continue
+        for column, (col_type, notnull, pk) in columns.items():
+            actual = live_columns.get(column)
+            if actual is None:
+                findings.append(('issue', 'column', f"{table}.{column}", f"missing ({col_type})"))
+            elif actual[0] != col_type:
+                findings.append(('issue', 'column', f"{table}.{column}", f"type {actual[0]}, expected {col_type}"))
+            elif actual[1:] != (notnull, pk):
+                findings.append(('warning', 'column', f"{table}.{column}",
+                                 f"NOT NULL/pk {actual[1:]}, expected {(notnull, pk)}"))
+        for column in live_columns.keys() - columns.keys():
+            findings.append(('warning', 'column', f"{table}.{column}", 'not in schema'))
+    for table in live['table'].keys() - expected['table'].keys():
+        findings.append(('warning', 'table', table, 'not in schema'))
+
+    expected_indexes = {name: index for name, index in expected['index'].items() if name.startswith('idx_')}
+    live_indexes = {name: index for name, index in live['index'].items() if name.startswith('idx_')}
+    for name, index in expected_indexes.items():
+        actual = live_indexes.get(name)
+        if actual is None:
+            findings.append(('issue', 'index', name,
+                             f"missing: {index['table']}({', '.join(index['columns'])})"))
+        elif actual != index:
+            findings.append(('issue', 'index', name,
+                             f"{_describe_index(actual)}, expected {_describe_index(index)}"))
+    for name in live_indexes.keys() - expected_indexes.keys():
+        findings.append(('warning', 'index', name, f"not in schema: {_describe_index(live_indexes[name])}"))
+
+    for view, columns in expected['view'].items():
+        actual = live['view'].get(view)
+        if actual is None:
+            findings.append(('issue', 'view', view, 'missing'))
+        elif actual != columns:
+            missing = [column for column in columns if column not in actual]
+            detail = f"missing columns {missing}" if missing else f"columns {actual}, expected {columns}"
+            findings.append(('issue', 'view', view, detail))
+    for view in live['view'].keys() - expected['view'].keys():
+        findings.append(('warning', 'view', view, 'not in schema'))
+
+    return sorted(findings, key=lambda finding: (finding[0] != 'issue', finding[1], finding[2]))
+
+
+def _describe_index(index):
+    flags = ('UNIQUE ' if index['unique'] else '') + ('partial ' if index['partial'] else '')
+    return f"{flags}{index['table']}({', '.join(index['columns'])})"
+
+
+def audit_schema(conn, schema_dir=SCHEMA_DIR):
+    """Diff `conn` against the schema files; returns (findings, expected catalog, skipped statements)"""
+    expected_conn, skipped = build_expected_connection(schema_dir)
+    try:
+        expected = read_catalog(expected_conn)
+    finally:
+        expected_conn.close()
+    return diff_catalogs(expected, read_catalog(conn)), expected, skipped
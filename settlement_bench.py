@@ -0,0 +1,294 @@
+#!/usr/bin/env python3
+"""
+Settlement Simulation Benchmark
+===============================
+Builds synthetic stages in a temporary SQLite database created from
+database/schema.sql and times each SettlementTester phase (check_schema,
+query_test_data, simulate_settlement) across a sweep of cohort sizes, so we
+can see where the Python replay stops scaling before pointing it at a larger
+cohort.
+
+Each size point gets its own database with one project and one voting stage:
+`groups` groups, `students` student rankings (round-robin group membership)
+and `teachers` teacher rankings. `tie_density` is the chance that a ballot
+position shares the previous position's dense rank; `missing_rate` is the
+chance a voter leaves a group unranked.
+
+Results (per-phase min/median seconds and the log-log scaling slope per
+phase) are written as JSON. Passing a previous result file with --baseline
+flags phases that got slower than --regression-threshold.
+
+Usage:
+    python settlement_bench.py
+    python settlement_bench.py --groups 10,50 --students 100,1000,10000 --repeats 5
+    python settlement_bench.py --output bench.json --baseline bench_baseline.json
+
+Requires: numpy
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import math
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from collections import namedtuple
+from datetime import datetime
+from pathlib import Path
+
+from test_settlement import DatabaseOptions, SettlementTester
+
+SCHEMA_PATH = Path(__file__).parent / "database/schema.sql"
+
+PHASES = ('check_schema', 'query_test_data', 'simulate_settlement')
+
+BenchSize = namedtuple('BenchSize', ['groups', 'students', 'teachers', 'tie_density', 'missing_rate'])
+
+# Phases slower than baseline × threshold are reported as regressions
+DEFAULT_REGRESSION_THRESHOLD = 1.25
+
+BASE_TIME = 1700000000000
+
+
+def synthetic_ballot(rng, group_ids, tie_density, missing_rate):
+    """One dense-ranked {groupId: rank} ballot with ties and unranked groups"""
+    order = [group_id for group_id in group_ids if rng.random() >= missing_rate] or [rng.choice(group_ids)]
+    rng.shuffle(order)
+    ballot = {}
+    rank = 0
+    for position, group_id in enumerate(order):
+        if position == 0 or rng.random() >= tie_density:
+            rank += 1
+        ballot[group_id] = rank
+    return ballot
+
+
+def build_synthetic_db(path, size, seed=0):
+    """Create a schema.sql database holding one synthetic voting stage of the given size"""
+    rng = random.Random(seed)
+    Path(path).unlink(missing_ok=True)
+    conn = sqlite3.connect(path)
+    conn.executescript(SCHEMA_PATH.read_text(encoding='utf-8'))
+    conn.execute("PRAGMA journal_mode = OFF")
+    conn.execute("PRAGMA synchronous = OFF")
+
+    project_id, stage_id = 'proj_bench', 'stg_bench'
+    group_ids = [f'grp_{g:05d}' for g in range(size.groups)]
+
+    conn.execute("""
+        INSERT INTO projects (projectId, projectName, createdBy, createdTime, lastModified, createdAt, updatedAt)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    """, (project_id, 'Benchmark Project', 'bench@example.com', BASE_TIME, BASE_TIME, BASE_TIME, BASE_TIME))
+    conn.execute("""
+        INSERT INTO stages (stageId, projectId, stageName, stageOrder, startTime, endTime, status,
+                            createdTime, reportRewardPool, commentRewardPool)
+        VALUES (?, ?, ?, 1, ?, ?, 'voting', ?, 1000, 100)
+    """, (stage_id, project_id, 'Benchmark Stage', BASE_TIME - 10**9, BASE_TIME - 10**6, BASE_TIME))
+    conn.executemany("""
+        INSERT INTO groups (groupId, projectId, groupName, createdBy, createdTime)
+        VALUES (?, ?, ?, 'bench@example.com', ?)
+    """, [(group_id, project_id, f'Group {g}', BASE_TIME) for g, group_id in enumerate(group_ids)])
+
+    conn.executemany("""
+        INSERT INTO users (userId, password, userEmail, displayName, createdAt, updatedAt)
+        VALUES (?, 'x', ?, ?, ?, ?)
+    """, [(f'usr_{v:07d}', f'student{v}@example.com', f'Student {v}', BASE_TIME, BASE_TIME)
+          for v in range(size.students)])
+    conn.executemany("""
+        INSERT INTO usergroups (membershipId, projectId, groupId, userEmail, joinTime)
+        VALUES (?, ?, ?, ?, ?)
+    """, [(f'mem_{v:07d}', project_id, group_ids[v % size.groups], f'student{v}@example.com', BASE_TIME + v)
+          for v in range(size.students)])
+    conn.executemany("""
+        INSERT INTO rankings (proposalId, stageId, groupId, proposerUserId, rankingData, createdAt, lastModified)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    """, ((f'rnk_{v:07d}', stage_id, group_ids[v % size.groups], f'usr_{v:07d}',
+           json.dumps(synthetic_ballot(rng, group_ids, size.tie_density, size.missing_rate)),
+           BASE_TIME + v, BASE_TIME + v)
+          for v in range(size.students)))
+
+    teacher_rows = []
+    for t in range(size.teachers):
+        ballot = synthetic_ballot(rng, group_ids, size.tie_density, size.missing_rate)
+        teacher_rows.extend(
+            (f'tsr_{t:03d}_{group_id}', stage_id, project_id, f'teacher{t}@example.com',
+             f'sub_{group_id}', group_id, rank, BASE_TIME + t)
+            for group_id, rank in ballot.items()
+        )
+    conn.executemany("""
+        INSERT INTO teachersubmissionrankings (teacherRankingId, stageId, projectId, teacherEmail,
+                                               submissionId, groupId, rank, createdTime)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    """, teacher_rows)
+
+    conn.commit()
+    conn.close()
+
+
+def time_phases(db_path, repeats):
+    """Run the tester phases `repeats` times; returns {phase: [seconds, ...]}"""
+    timings = {phase: [] for phase in PHASES}
+    for _ in range(repeats):
+        tester = SettlementTester(db_path, db_options=DatabaseOptions(), quiet=True)
+        with contextlib.redirect_stdout(io.StringIO()):
+            if not tester.connect():
+                raise RuntimeError(f"could not open {db_path}")
+            try:
+                started = time.perf_counter()
+                tester.check_schema()
+                timings['check_schema'].append(time.perf_counter() - started)
+
+                started = time.perf_counter()
+                test_data = tester.query_test_data()
+                timings['query_test_data'].append(time.perf_counter() - started)
+
+                started = time.perf_counter()
+                tester.simulate_settlement(test_data)
+                timings['simulate_settlement'].append(time.perf_counter() - started)
+            finally:
+                tester.conn.close()
+    return timings
+
+
+def scaling_slopes(points, key):
+    """Least-squares slope of log(seconds) vs log(key) per phase (1.0 = linear)"""
+    slopes = {}
+    for phase in PHASES:
+        xs = [math.log(point['size'][key]) for point in points]
+        ys = [math.log(max(point['phases'][phase]['median'], 1e-9)) for point in points]
+        if len(set(xs)) < 2:
+            continue
+        mean_x, mean_y = statistics.fmean(xs), statistics.fmean(ys)
+        numerator = sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys))
+        denominator = sum((x - mean_x) ** 2 for x in xs)
+        slopes[phase] = numerator / denominator
+    return slopes
+
+
+def compare_to_baseline(points, baseline, threshold):
+    """Return (size, phase, baseline_median, median) for phases slower than baseline × threshold"""
+    previous = {
+        tuple(point['size'][field] for field in BenchSize._fields): point['phases']
+        for point in baseline.get('points', [])
+    }
+    regressions = []
+    for point in points:
+        key = tuple(point['size'][field] for field in BenchSize._fields)
+        if key not in previous:
+            continue
+        for phase in PHASES:
+            before = previous[key].get(phase, {}).get('median')
+            after = point['phases'][phase]['median']
+            if before and after > before * threshold:
+                regressions.append((point['size'], phase, before, after))
+    return regressions
+
+
+def run_sweep(sizes, repeats, seed):
+    """Build and time each size; returns one JSON-serializable point per size"""
+    points = []
+    with tempfile.TemporaryDirectory(prefix='settlement_bench_') as tmp:
+        for index, size in enumerate(sizes):
+            db_path = Path(tmp) / f'bench_{index}.sqlite'
+            started = time.perf_counter()
+            build_synthetic_db(db_path, size, seed=seed + index)
+            build_seconds = time.perf_counter() - started
+
+            timings = time_phases(db_path, repeats)
+            point = {
+                'size': size._asdict(),
+                'buildSeconds': build_seconds,
+                'dbBytes': db_path.stat().st_size,
+                'phases': {
+                    phase: {'min': min(samples), 'median': statistics.median(samples), 'samples': samples}
+                    for phase, samples in timings.items()
+                },
+            }
+            points.append(point)
+
+            phase_text = ', '.join(f"{phase} {point['phases'][phase]['median'] * 1000:.1f}ms" for phase in PHASES)
+            print(f"  ✅ {size.groups:>5} groups × {size.students:>7} students × {size.teachers} teachers: {phase_text}")
+    return points
+
+
+def _int_list(text):
+    return [int(value) for value in text.split(',') if value]
+
+
+def main():
+    """Main entry point"""
+    parser = argparse.ArgumentParser(description="Settlement simulation scaling benchmark")
+    parser.add_argument('--groups', type=_int_list, default=[10, 40],
+                        help='comma-separated group counts (default: 10,40)')
+    parser.add_argument('--students', type=_int_list, default=[100, 1000, 10000],
+                        help='comma-separated student voter counts (default: 100,1000,10000)')
+    parser.add_argument('--teachers', type=int, default=3, help='teacher voters per stage (default: 3)')
+    parser.add_argument('--tie-density', type=float, default=0.1,
+                        help='chance a ballot position ties the previous one (default: 0.1)')
+    parser.add_argument('--missing-rate', type=float, default=0.05,
+                        help='chance a voter leaves a group unranked (default: 0.05)')
+    parser.add_argument('--repeats', type=int, default=3, help='timed runs per size (default: 3)')
+    parser.add_argument('--seed', type=int, default=0, help='random seed (default: 0)')
+    parser.add_argument('--output', default='settlement_bench.json', help='result JSON path')
+    parser.add_argument('--baseline', default=None, help='previous result JSON to compare against')
+    parser.add_argument('--regression-threshold', type=float, default=DEFAULT_REGRESSION_THRESHOLD,
+                        help=f'slowdown factor flagged as a regression (default: {DEFAULT_REGRESSION_THRESHOLD})')
+    args = parser.parse_args()
+
+    sizes = [BenchSize(groups, students, args.teachers, args.tie_density, args.missing_rate)
+             for groups in args.groups for students in args.students]
+
+    print("="*80)
+    print("⏱️  SETTLEMENT SIMULATION BENCHMARK")
+    print("="*80)
+    print(f"Sizes: {len(sizes)}  Repeats: {args.repeats}  Time: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
+
+    points = run_sweep(sizes, args.repeats, args.seed)
+
+    print("\n📈 Scaling (log-log slope of median time; 1.0 = linear):")
+    scaling = {}
+    for groups in args.groups:
+        curve = [point for point in points if point['size']['groups'] == groups]
+        slopes = scaling_slopes(curve, 'students')
+        scaling[f'students@groups={groups}'] = slopes
+        if slopes:
+            print(f"  vs students (groups={groups}): " +
+                  ', '.join(f"{phase} {slope:.2f}" for phase, slope in slopes.items()))
+    for students in args.students:
+        curve = [point for point in points if point['size']['students'] == students]
+        slopes = scaling_slopes(curve, 'groups')
+        scaling[f'groups@students={students}'] = slopes
+        if slopes:
+            print(f"  vs groups (students={students}): " +
+                  ', '.join(f"{phase} {slope:.2f}" for phase, slope in slopes.items()))
+
+    result = {
+        'createdAt': datetime.now().isoformat(timespec='seconds'),
+        'python': sys.version.split()[0],
+        'repeats': args.repeats,
+        'seed': args.seed,
+        'points': points,
+        'scaling': scaling,
+    }
+    Path(args.output).write_text(json.dumps(result, indent=2), encoding='utf-8')
+    print(f"\n📝 Results written to {args.output}")
+
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text(encoding='utf-8'))
+        regressions = compare_to_baseline(points, baseline, args.regression_threshold)
+        if regressions:
+            print(f"\n❌ {len(regressions)} regressions vs {args.baseline}:")
+            for size, phase, before, after in regressions:
+                print(f"   {size['groups']} groups × {size['students']} students {phase}: "
+                      f"{before * 1000:.1f}ms → {after * 1000:.1f}ms ({after / before:.2f}×)")
+            sys.exit(1)
+        print(f"\n✅ No regressions vs {args.baseline} (threshold {args.regression_threshold}×)")
+
+
+if __name__ == '__main__':
+    main()
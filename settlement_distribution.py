@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+Participation-Based Point Distribution
+======================================
+Port of the member payout step of `prepareSettlementStatements` in
+scoringSystem-cf/packages/backend/src/handlers/scoring/settlement.ts.
+
+For every scored group the backend takes the latest approved submission
+(ROW_NUMBER() over submissions_with_status, newest submitTime first) and
+pays each participant of its participationProposal:
+
+    points = Math.round(allocatedPoints * percentage * 100) / 100   (cents)
+    amount = Math.ceil(points)                                      (transaction)
+
+Groups whose proposal has no positive share are skipped (no stagesettlements
+row, no transactions). Here the window query runs once for a whole batch of
+stages, and the per-member arithmetic runs on flat participant arrays for
+every group of a stage at once.
+
+Usage:
+    python test_settlement.py            # per-member payouts for the test stage
+    python test_settlement.py --batch    # ... for every replayed stage
+"""
+
+import json
+
+import numpy as np
+
+from settlement_engine import MAX_SQL_PARAMS, js_round
+
+
+def parse_participation(raw):
+    """Decode a participationProposal column into {email: share} for positive shares
+
+    Mirrors `Object.entries(parseJSON(proposal, {}))` in the backend: keys are
+    emails and are kept as they are (the ranking decoder drops ids containing
+    '@'), shares become floats, and numeric strings count as JS coercion would.
+    A payload that is not an object has no email keys and pays nobody.
+    """
+    if not raw:
+        return {}
+    try:
+        proposal = json.loads(raw)
+    except (TypeError, ValueError):
+        return {}
+    if not isinstance(proposal, dict):
+        return {}
+
+    shares = {}
+    for email, share in proposal.items():
+        if isinstance(share, str):
+            try:
+                share = float(share)
+            except ValueError:
+                continue
+        if isinstance(share, (int, float)) and not isinstance(share, bool) and share > 0:
+            shares[email] = float(share)
+    return shares
+
+
+def load_latest_submissions(conn, stage_ids):
+    """Latest approved submission of every group, for a batch of stages
+
+    Returns {stageId: {groupId: (submissionId, groupName, {email: share})}},
+    keeping only positive shares in proposal order.
+    """
+    source = 'submissions_with_status' if conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'view' AND name = 'submissions_with_status'"
+    ).fetchone() else 'submissions'
+
+    stage_ids = list(stage_ids)
+    submissions = {}
+    for start in range(0, len(stage_ids), MAX_SQL_PARAMS):
+        chunk = stage_ids[start:start + MAX_SQL_PARAMS]
+        for stage_id, group_id, submission_id, proposal, group_name in conn.execute(f"""
+            WITH LatestApprovedSubmissions AS (
+                SELECT s.stageId, s.groupId, s.submissionId, s.participationProposal, g.groupName,
+                       ROW_NUMBER() OVER (
+                           PARTITION BY s.stageId, s.groupId
+                           ORDER BY s.submitTime DESC
+                       ) AS rn
+                FROM {source} s
+                JOIN groups g ON s.groupId = g.groupId
+                WHERE s.stageId IN ({','.join('?' * len(chunk))})
+                  AND s.approvedTime IS NOT NULL
+            )
+            SELECT stageId, groupId, submissionId, participationProposal, groupName
+            FROM LatestApprovedSubmissions
+            WHERE rn = 1
+        """, chunk):
+            submissions.setdefault(stage_id, {})[group_id] = (submission_id, group_name, parse_participation(proposal))
+    return submissions
+
+
+def distribute_member_points(scores, submissions):
+    """Per-member payouts for one stage
+
+    `scores` is {groupId: allocatedPoints} (result_to_dicts 'scores');
+    `submissions` is one stage of load_latest_submissions. Returns
+    ({groupId: row}, skipped groupIds) where each row carries the
+    stagesettlements fields memberEmails / memberPointsDistribution plus the
+    Math.ceil transaction `amounts`.
+    """
+    group_ids, emails, shares = [], [], []
+    skipped = []
+    for group_id in scores:
+        participants = submissions.get(group_id, (None, None, {}))[2]
+        if not participants:
+            skipped.append(group_id)
+            continue
+        group_ids.append(group_id)
+        emails.append(list(participants))
+        shares.extend(participants.values())
+
+    if not group_ids:
+        return {}, skipped
+
+    sizes = np.array([len(members) for members in emails])
+    allocated = np.array([scores[group_id] for group_id in group_ids], dtype=float)
+    # Same operation order as the backend: (totalScore * percentage) * 100
+    points = js_round(np.repeat(allocated, sizes) * np.array(shares, dtype=float) * 100) / 100
+    amounts = np.ceil(points)
+    bounds = np.concatenate([[0], np.cumsum(sizes)])
+
+    rows = {}
+    for slot, group_id in enumerate(group_ids):
+        start, stop = bounds[slot], bounds[slot + 1]
+        submission_id, group_name, participants = submissions[group_id]
+        member_points = points[start:stop].tolist()
+        rows[group_id] = {
+            'submissionId': submission_id,
+            'groupName': group_name or f"Group {group_id}",
+            'allocatedPoints': scores[group_id],
+            'memberEmails': emails[slot],
+            'memberPointsDistribution': dict(zip(emails[slot], member_points)),
+            'participationPercentages': dict(participants),
+            'amounts': dict(zip(emails[slot], amounts[start:stop].tolist())),
+        }
+    return rows, skipped
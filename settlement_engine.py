@@ -0,0 +1,460 @@
+#!/usr/bin/env python3
+"""
+Settlement Engine (NumPy)
+=========================
+Matrix-based port of `_calculateScoresFromVotesCore` from
+scoringSystem-cf/packages/backend/src/handlers/scoring/settlement.ts.
+
+Each stage's ballots are packed into a voter × item rank matrix (NaN = the
+voter did not rank that item) and scored with array operations:
+1. Dense weak-order ranks → mid-ranks (denseRanksToMidRanks in @repo/shared)
+2. Separate student / teacher average ranks (WORST_RANK = items + 1 fallback)
+3. Weighted final score (default 70% student + 30% teacher), lower is better
+4. Standard ranking with FLOAT_TOLERANCE tie detection
+5. Occupied-rank point distribution (optional top-N filter for comments)
+
+Large stages can stream through RankAccumulator instead of materializing the
+whole matrix: only per-item running sums and counts are kept. BallotStore
+keeps parsed ballots in compact CSR arrays (interned item columns + float
+ranks) so each rankingData payload is decoded once and reused by later phases.
+
+Requires: numpy
+"""
+
+import json
+import math
+from array import array
+
+import numpy as np
+
+try:
+    import orjson
+except ImportError:  # optional: stdlib json is used when orjson is not installed
+    orjson = None
+
+_json_loads = orjson.loads if orjson is not None else json.loads
+
+# Same constants as settlement.ts / scoring-config.ts
+FLOAT_TOLERANCE = 0.01
+DEFAULT_STUDENT_WEIGHT = 0.7
+DEFAULT_TEACHER_WEIGHT = 0.3
+
+# SQLite's default SQLITE_MAX_VARIABLE_NUMBER on older builds
+MAX_SQL_PARAMS = 999
+
+DEFAULT_SCORING_CONFIG = {
+    'maxCommentSelections': 3,
+    'studentRankingWeight': DEFAULT_STUDENT_WEIGHT,
+    'teacherRankingWeight': DEFAULT_TEACHER_WEIGHT,
+    'commentRewardPercentile': 0,
+}
+
+
+def effective_scoring_config(project):
+    """Project-level scoring settings with hardcoded fallbacks (KV/wrangler tiers are not visible here)"""
+    keys = project.keys() if project is not None else ()
+    return {
+        key: project[key] if key in keys and project[key] is not None else default
+        for key, default in DEFAULT_SCORING_CONFIG.items()
+    }
+
+
+def calculate_comment_reward_limit(unique_authors, percentile, fallback_top_n):
+    """Port of calculateCommentRewardLimit: ceil(percentile% of authors), at least 1"""
+    if percentile > 0:
+        return max(1, math.ceil((percentile / 100) * unique_authors))
+    return fallback_top_n
+
+
+def aggregate_teacher_rankings(rows):
+    """Port of aggregateTeacherRankings / aggregateTeacherCommentRankings
+
+    `rows` are (teacherEmail, itemId, rank, createdTime) ordered by teacherEmail
+    ASC, createdTime DESC; only each teacher's latest submission is kept.
+    Returns {teacherEmail: {itemId: rank}}.
+    """
+    ballots = {}
+    latest_time = {}
+    for teacher_email, item_id, rank, created_time in rows:
+        if teacher_email not in latest_time:
+            latest_time[teacher_email] = created_time
+            ballots[teacher_email] = {}
+        if latest_time[teacher_email] == created_time:
+            ballots[teacher_email][item_id] = rank
+    return ballots
+
+
+def convert_array_to_object(ranking_data):
+    """Port of convertArrayToObject: [{groupId|commentId|targetId, rank}, ...] → {id: rank}"""
+    if not ranking_data:
+        return {}
+
+    if isinstance(ranking_data, dict):
+        return {item_id: rank for item_id, rank in ranking_data.items() if _is_rank(rank)}
+
+    result = {}
+    for item in ranking_data:
+        if not isinstance(item, dict):
+            continue
+        item_id = item.get('groupId') or item.get('commentId') or item.get('targetId')
+        rank = item.get('rank')
+        # Same guard as the backend: ids that look like emails are rejected
+        if item_id and _is_rank(rank) and '@' not in item_id:
+            result[item_id] = rank
+    return result
+
+
+def parse_ranking_data(raw):
+    """Decode a rankingData column into {itemId: rank}; invalid JSON yields {}"""
+    if not raw:
+        return {}
+    try:
+        return convert_array_to_object(_json_loads(raw))
+    except (TypeError, ValueError):
+        return {}
+
+
+def _is_rank(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+class ItemIndex:
+    """Insertion-ordered itemId → column mapping (mirrors the JS `Set` of item ids)"""
+
+    def __init__(self, item_ids=()):
+        self.ids = []
+        self.columns = {}
+        for item_id in item_ids:
+            self.add(item_id)
+
+    def add(self, item_id):
+        column = self.columns.get(item_id)
+        if column is None:
+            column = len(self.ids)
+            self.columns[item_id] = column
+            self.ids.append(item_id)
+        return column
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, item_id):
+        return item_id in self.columns
+
+
+class BallotStore:
+    """Parse-once ballots in CSR form sharing an ItemIndex
+
+    Ballot i ranks items `columns[offsets[i]:offsets[i+1]]` with the dense ranks
+    in `ranks[...]`. Item ids are interned to integer columns, so a ballot costs
+    16 bytes per ranked item instead of a dict keyed by id strings.
+    """
+
+    def __init__(self, item_index=None):
+        self.item_index = item_index if item_index is not None else ItemIndex()
+        self.offsets = array('q', [0])
+        self.columns = array('q')
+        self.ranks = array('d')
+
+    def add(self, ballot):
+        """Append one {itemId: rank} ballot (empty ballots are skipped); returns it"""
+        if ballot:
+            add_column = self.item_index.add
+            for item_id, rank in ballot.items():
+                self.columns.append(add_column(item_id))
+                self.ranks.append(rank)
+            self.offsets.append(len(self.ranks))
+        return ballot
+
+    def add_raw(self, raw):
+        """Decode a rankingData payload once and append it; returns the parsed ballot"""
+        return self.add(parse_ranking_data(raw))
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def ballot(self, i):
+        """Ballot i as {itemId: rank} (for display; scoring works on the arrays)"""
+        ids = self.item_index.ids
+        start, stop = self.offsets[i], self.offsets[i + 1]
+        return {ids[column]: rank for column, rank in zip(self.columns[start:stop], self.ranks[start:stop])}
+
+    def to_matrix(self, start=0, stop=None, width=None):
+        """Ballots [start, stop) as a voters × items rank matrix (NaN = unranked)"""
+        stop = len(self) if stop is None else stop
+        offsets = np.frombuffer(self.offsets, dtype=np.int64)[start:stop + 1]
+        matrix = np.full((stop - start, width or len(self.item_index)), np.nan)
+        if offsets.size > 1 and offsets[-1] > offsets[0]:
+            lo, hi = offsets[0], offsets[-1]
+            rows = np.repeat(np.arange(stop - start), np.diff(offsets))
+            columns = np.frombuffer(self.columns, dtype=np.int64)[lo:hi]
+            matrix[rows, columns] = np.frombuffer(self.ranks, dtype=np.float64)[lo:hi]
+        return matrix
+
+
+def build_rank_matrix(ballots, item_index, width=None):
+    """Pack [{itemId: rank}, ...] into a voters × items float matrix (NaN = unranked)
+
+    Unknown item ids are appended to `item_index`, so building the teacher matrix
+    before the student matrix reproduces the backend's item ordering.
+    """
+    rows, cols, values = [], [], []
+    for row, ballot in enumerate(ballots):
+        for item_id, rank in ballot.items():
+            rows.append(row)
+            cols.append(item_index.add(item_id))
+            values.append(rank)
+
+    matrix = np.full((len(ballots), width or len(item_index)), np.nan)
+    if values:
+        matrix[rows, cols] = values
+    return matrix
+
+
+def pad_columns(matrix, width):
+    """Widen a rank matrix with NaN columns (items registered after it was built)"""
+    if matrix.shape[1] >= width:
+        return matrix
+    padded = np.full((matrix.shape[0], width), np.nan)
+    padded[:, :matrix.shape[1]] = matrix
+    return padded
+
+
+def dense_to_mid_ranks(matrix):
+    """Row-wise denseRanksToMidRanks: tied items get the mean of the positions they occupy
+
+    Keeps every ballot's rank mass at N(N+1)/2 where N is the number of items
+    that voter ranked. NaN entries stay NaN.
+    """
+    matrix = np.asarray(matrix, dtype=float)
+    out = np.full(matrix.shape, np.nan)
+    rows, cols = np.nonzero(~np.isnan(matrix))
+    if rows.size == 0:
+        return out
+
+    values = matrix[rows, cols]
+    order = np.lexsort((values, rows))
+    rows, cols, values = rows[order], cols[order], values[order]
+
+    # Boundaries of each voter's row and of each tie tier inside it
+    new_row = np.ones(rows.size, dtype=bool)
+    new_row[1:] = rows[1:] != rows[:-1]
+    new_tier = new_row.copy()
+    new_tier[1:] |= values[1:] != values[:-1]
+
+    index = np.arange(rows.size)
+    row_start = np.maximum.accumulate(np.where(new_row, index, 0))
+    tier_start = np.maximum.accumulate(np.where(new_tier, index, 0))
+    tier_id = np.cumsum(new_tier) - 1
+    tier_size = np.bincount(tier_id)[tier_id]
+
+    # Tier occupies 1-based positions start+1 .. start+size → mean is start + (size+1)/2
+    out[rows, cols] = (tier_start - row_start) + (tier_size + 1) / 2
+    return out
+
+
+def rank_totals(mid_ranks):
+    """Per-item (sum, count) of mid-ranks — the backend's studentRankSums / teacherRankSums"""
+    ranked = ~np.isnan(mid_ranks)
+    return np.where(ranked, mid_ranks, 0.0).sum(axis=0), ranked.sum(axis=0)
+
+
+def average_ranks(sums, counts, worst_rank):
+    """Per-item mean rank; items nobody ranked fall back to worst_rank"""
+    avg = np.full(counts.shape, float(worst_rank))
+    np.divide(sums, counts, out=avg, where=counts > 0)
+    return avg
+
+
+class RankAccumulator:
+    """Running per-item mid-rank sums and counts, fed one batch of ballots at a time
+
+    Memory is O(items) regardless of how many ballots stream through, which is
+    what `_calculateScoresFromVotesCore` keeps once ballots are normalized.
+    """
+
+    def __init__(self, item_index=None):
+        self.item_index = item_index if item_index is not None else ItemIndex()
+        self.sums = np.zeros(0)
+        self.counts = np.zeros(0, dtype=int)
+        self.ballot_count = 0
+
+    def add_ballots(self, ballots):
+        """Normalize a batch of {itemId: rank} ballots and fold them into the totals"""
+        if ballots:
+            self.add_matrix(build_rank_matrix(ballots, self.item_index))
+
+    def add_matrix(self, matrix):
+        """Fold a voters × items dense-rank matrix (columns from item_index) into the totals"""
+        sums, counts = rank_totals(dense_to_mid_ranks(matrix))
+        self._grow(sums.size)
+        self.sums[:sums.size] += sums
+        self.counts[:counts.size] += counts
+        self.ballot_count += matrix.shape[0]
+
+    def remove_matrix(self, matrix):
+        """Take ballots previously folded in with add_matrix back out of the totals
+
+        Mid-ranks are half-integers, so the sums come back exactly.
+        """
+        sums, counts = rank_totals(dense_to_mid_ranks(matrix))
+        self._grow(sums.size)
+        self.sums[:sums.size] -= sums
+        self.counts[:counts.size] -= counts
+        self.ballot_count -= matrix.shape[0]
+
+    def totals(self, width=None):
+        """(sums, counts) padded to `width` columns"""
+        self._grow(width or len(self.item_index))
+        return self.sums, self.counts
+
+    def _grow(self, width):
+        if width > self.sums.size:
+            self.sums = np.concatenate([self.sums, np.zeros(width - self.sums.size)])
+            self.counts = np.concatenate([self.counts, np.zeros(width - self.counts.size, dtype=int)])
+
+
+def standard_ranking(sorted_scores, tolerance=FLOAT_TOLERANCE):
+    """Standard (1-2-2-4) ranking of ascending scores, ties within `tolerance` share a rank"""
+    n = sorted_scores.size
+    tied = np.zeros(n, dtype=bool)
+    tied[1:] = np.abs(np.diff(sorted_scores)) < tolerance
+    return np.maximum.accumulate(np.where(tied, 0, np.arange(1, n + 1)))
+
+
+def js_round(values):
+    """Math.round: nearest integer, ties toward +∞ (exact, unlike floor(x + 0.5))"""
+    floor = np.floor(values)
+    return floor + (values - floor >= 0.5)
+
+
+def distribute_points(ranks, total_points):
+    """Occupied-rank point distribution for items already sorted best → worst
+
+    Tied items share the position weights (total - position) they occupy; every
+    item but the last is rounded like Math.round and the last takes the remainder.
+    """
+    n = ranks.size
+    if n == 0:
+        return np.zeros(0)
+
+    position_weight = (n - np.arange(n)).astype(float)
+    _, tier = np.unique(ranks, return_inverse=True)
+    item_weight = (np.bincount(tier, position_weight) / np.bincount(tier))[tier]
+    total_weight = position_weight.sum()
+
+    points = js_round(total_points * item_weight / total_weight)
+    points[-1] = total_points - points[:-1].sum()
+    return points
+
+
+def calculate_scores_from_votes(teacher_matrix, student_matrix, total_points,
+                                student_weight=DEFAULT_STUDENT_WEIGHT,
+                                teacher_weight=DEFAULT_TEACHER_WEIGHT,
+                                top_n=None):
+    """Vectorized _calculateScoresFromVotesCore over rank matrices sharing one item index
+
+    See calculate_scores_from_totals for the returned arrays.
+    """
+    width = max(teacher_matrix.shape[1], student_matrix.shape[1])
+    teacher_totals = rank_totals(dense_to_mid_ranks(pad_columns(teacher_matrix, width)))
+    student_totals = rank_totals(dense_to_mid_ranks(pad_columns(student_matrix, width)))
+    return calculate_scores_from_totals(teacher_totals, student_totals, total_points,
+                                        student_weight, teacher_weight, top_n)
+
+
+def calculate_scores_from_accumulators(teacher, student, total_points,
+                                       student_weight=DEFAULT_STUDENT_WEIGHT,
+                                       teacher_weight=DEFAULT_TEACHER_WEIGHT,
+                                       top_n=None):
+    """Score two RankAccumulators that share one ItemIndex"""
+    width = len(student.item_index)
+    return calculate_scores_from_totals(teacher.totals(width), student.totals(width), total_points,
+                                        student_weight, teacher_weight, top_n)
+
+
+def calculate_scores_from_totals(teacher_totals, student_totals, total_points,
+                                 student_weight=DEFAULT_STUDENT_WEIGHT,
+                                 teacher_weight=DEFAULT_TEACHER_WEIGHT,
+                                 top_n=None):
+    """Rank and distribute points from per-item (sums, counts) of mid-ranks
+
+    Only columns ranked by at least one voter take part (the backend collects
+    items from ballot keys). Returns arrays aligned with the columns:
+    `rankings` (0 for non-participating items), `scores`, `weightedScores`,
+    `studentScores`, `teacherScores` (NaN for non-participating items), vote
+    counts, plus `order` — participating columns sorted best → worst.
+    """
+    teacher_sums, teacher_counts = teacher_totals
+    student_sums, student_counts = student_totals
+    width = student_sums.size
+
+    columns = np.flatnonzero((teacher_counts + student_counts) > 0)
+
+    result = {
+        'order': np.zeros(0, dtype=int),
+        'rankings': np.zeros(width, dtype=int),
+        'scores': np.full(width, np.nan),
+        'weightedScores': np.full(width, np.nan),
+        'studentScores': np.full(width, np.nan),
+        'teacherScores': np.full(width, np.nan),
+        'studentVoteCounts': np.asarray(student_counts, dtype=int).copy(),
+        'teacherVoteCounts': np.asarray(teacher_counts, dtype=int).copy(),
+    }
+    if columns.size == 0:
+        return result
+
+    worst_rank = columns.size + 1
+    student_avg = average_ranks(student_sums[columns], student_counts[columns], worst_rank)
+    teacher_avg = average_ranks(teacher_sums[columns], teacher_counts[columns], worst_rank)
+
+    student_component = student_avg * student_weight
+    teacher_component = teacher_avg * teacher_weight
+    final_scores = student_component + teacher_component
+
+    # Stable sort keeps insertion order for exact ties, like Array.prototype.sort
+    order = np.argsort(final_scores, kind='stable')
+    ranks = standard_ranking(final_scores[order])
+
+    scored = ranks <= top_n if top_n else np.ones(ranks.size, dtype=bool)
+    points = np.zeros(ranks.size)
+    points[scored] = distribute_points(ranks[scored], total_points)
+
+    sorted_columns = columns[order]
+    result['order'] = sorted_columns
+    result['rankings'][sorted_columns] = ranks
+    result['scores'][sorted_columns] = points
+    result['weightedScores'][columns] = final_scores
+    result['studentScores'][columns] = student_component
+    result['teacherScores'][columns] = teacher_component
+    return result
+
+
+def result_to_dicts(result, item_ids):
+    """Convert array results into the {itemId: value} records the backend stores"""
+    keys = ('rankings', 'scores', 'weightedScores', 'studentScores', 'teacherScores')
+    records = {key: {} for key in keys}
+    for column in result['order']:
+        item_id = item_ids[column]
+        records['rankings'][item_id] = int(result['rankings'][column])
+        for key in keys[1:]:
+            records[key][item_id] = float(result[key][column])
+    return records
+
+
+def score_ballots(teacher_ballots, student_ballots, total_points, config, top_n=None):
+    """Score {itemId: rank} ballots with a scoring config; returns result_to_dicts records
+
+    Teacher ballots go into the ItemIndex first so item order (and exact-tie
+    order) matches the backend.
+    """
+    item_index = ItemIndex()
+    teacher_matrix = build_rank_matrix(list(teacher_ballots), item_index)
+    student_matrix = build_rank_matrix([ballot for ballot in student_ballots if ballot], item_index)
+    result = calculate_scores_from_votes(
+        teacher_matrix, student_matrix, total_points,
+        student_weight=config['studentRankingWeight'],
+        teacher_weight=config['teacherRankingWeight'],
+        top_n=top_n
+    )
+    return result_to_dicts(result, item_index.ids)
@@ -0,0 +1,533 @@
+#!/usr/bin/env python3
+"""
+Settlement Fuzz Harness
+=======================
+Property-based fuzzing of the tie handling in settlement_engine.py, far past
+the fixed cases in backend/tests/settlement-tie.test.ts:
+
+1. dense_to_mid_ranks (denseRanksToMidRanks in @repo/shared) on millions of
+   random weak-order ballots, generated and checked in vectorized batches:
+   - rank mass: each ballot's mid-ranks sum to N(N+1)/2 (N = items ranked)
+   - tied inputs stay tied, strictly ordered inputs stay strictly ordered
+   - every mid-rank is a half-integer in [1, N]; strict rankings are unchanged
+   - unranked (NaN) entries stay NaN
+2. standard_ranking on score vectors clustered around multiples of
+   FLOAT_TOLERANCE (the ±ε cases where `Math.abs(a - b) < FLOAT_TOLERANCE`
+   flips): ties share the previous rank, and the rank after a tie block
+   skips to position + 1.
+3. Whole stages through calculate_scores_from_votes: points add up to the
+   pool, and rankings / points match a line-by-line port of the loops in
+   `_calculateScoresFromVotesCore`.
+4. Watch mode (settlement_watch.py) on an in-memory rankings table: random
+   stage openings, new votes and resubmissions land between refreshes, and
+   every live projection must score like a fresh replay of its latest rows.
+
+A sample of every batch is also compared against scalar ports of the
+TypeScript. Any failing case is shrunk (drop items, lower ranks, simplify
+values) to a minimal reproduction before it is reported.
+
+Usage:
+    python settlement_fuzz.py                        # 1M ballots, 20k stages
+    python settlement_fuzz.py --ballots 10000000 --batch-size 200000 --seed 7
+
+Requires: numpy
+"""
+
+import argparse
+import json
+import math
+import sqlite3
+import sys
+import time
+
+import numpy as np
+
+from settlement_engine import (
+    FLOAT_TOLERANCE,
+    calculate_scores_from_votes,
+    dense_to_mid_ranks,
+    parse_ranking_data,
+    score_ballots,
+    standard_ranking,
+)
+from settlement_watch import RankingsWatcher
+
+
+# ---------------------------------------------------------------------------
+# Scalar ports of the TypeScript (reference implementations)
+# ---------------------------------------------------------------------------
+
+def reference_mid_ranks(ranks):
+    """denseRanksToMidRanks for one ballot given as a list (None = unranked)"""
+    tiers = {}
+    for index, rank in enumerate(ranks):
+        if rank is not None:
+            tiers.setdefault(rank, []).append(index)
+    result = [None] * len(ranks)
+    position = 0
+    for rank in sorted(tiers):
+        tied = tiers[rank]
+        mid_rank = sum(position + k + 1 for k in range(len(tied))) / len(tied)
+        for index in tied:
+            result[index] = mid_rank
+        position += len(tied)
+    return result
+
+
+def reference_standard_ranking(sorted_scores, tolerance=FLOAT_TOLERANCE):
+    """The Standard Ranking loop of _calculateScoresFromVotesCore on already sorted scores"""
+    rankings = []
+    for i, score in enumerate(sorted_scores):
+        if i > 0 and abs(sorted_scores[i - 1] - score) < tolerance:
+            rankings.append(rankings[i - 1])
+        else:
+            rankings.append(i + 1)
+    return rankings
+
+
+def _js_round(value):
+    return math.floor(value) + (1 if value - math.floor(value) >= 0.5 else 0)
+
+
+def reference_distribution(ranks, total_points):
+    """The occupied-rank point distribution loop for items sorted best → worst"""
+    total_items = len(ranks)
+    groups = {}
+    for index, rank in enumerate(ranks):
+        groups.setdefault(rank, []).append(index)
+    weights = [0.0] * total_items
+    assigned, total_weight = 0, 0
+    for rank in sorted(groups):
+        tied = groups[rank]
+        group_weight = sum(total_items - (assigned + i) for i in range(len(tied)))
+        for index in tied:
+            weights[index] = group_weight / len(tied)
+        total_weight += group_weight
+        assigned += len(tied)
+
+    points, distributed = [], 0
+    for index in range(total_items):
+        if index < total_items - 1:
+            points.append(_js_round((total_points * weights[index]) / total_weight))
+            distributed += points[-1]
+        else:
+            points.append(total_points - distributed)
+    return points
+
+
+# ---------------------------------------------------------------------------
+# Vectorized generators
+# ---------------------------------------------------------------------------
+
+def generate_ballots(rng, count, width, missing_rate, dense=True):
+    """count × width weak-order ballots (NaN = unranked)
+
+    Each ballot draws its own number of tiers, so batches mix strict rankings,
+    a few large ties and all-tied ballots. With dense=False tier numbers keep
+    their gaps (ranks like 1, 4, 4, 9), which denseRanksToMidRanks also accepts.
+    """
+    tiers = rng.integers(1, width + 1, size=(count, 1))
+    raw = np.floor(rng.random((count, width)) * tiers) + 1
+    raw[rng.random((count, width)) < missing_rate] = np.nan
+    if not dense:
+        return raw * rng.integers(1, 4, size=(count, 1)) + np.where(np.isnan(raw), 0, rng.integers(0, 2, size=raw.shape))
+
+    # Compress each row's tier numbers to 1..K (dense), keeping NaN
+    order = np.argsort(raw, axis=1, kind='stable')
+    sorted_raw = np.take_along_axis(raw, order, axis=1)
+    new_tier = np.ones(sorted_raw.shape, dtype=bool)
+    new_tier[:, 1:] = sorted_raw[:, 1:] != sorted_raw[:, :-1]
+    dense_sorted = np.cumsum(new_tier, axis=1).astype(float)
+    dense_sorted[np.isnan(sorted_raw)] = np.nan
+    ballots = np.empty_like(dense_sorted)
+    np.put_along_axis(ballots, order, dense_sorted, axis=1)
+    return ballots
+
+
+def generate_scores(rng, count, width, tolerance=FLOAT_TOLERANCE):
+    """count × width ascending score rows clustered on the tolerance boundary
+
+    Half the rows start at 0, where sums of `tolerance` steps stay close to
+    exact and some neighbours differ by exactly `tolerance` (the < vs <= case).
+    """
+    steps = rng.integers(0, 4, size=(count, width)).astype(float)
+    jitter = rng.choice(np.array([0.0, 0.0, 0.0, -1e-12, 1e-12, -1e-9, 1e-9, tolerance / 2]), size=(count, width))
+    base = np.where(rng.random((count, 1)) < 0.5, 0.0, rng.uniform(1.0, 10.0, size=(count, 1)))
+    return np.sort(base + np.cumsum(steps * tolerance + jitter, axis=1), axis=1)
+
+
+# ---------------------------------------------------------------------------
+# Properties (each returns the indices of failing rows)
+# ---------------------------------------------------------------------------
+
+def check_mid_ranks(ballots, mid_ranks):
+    """Vectorized mid-rank invariants; returns failing row indices"""
+    ranked = ~np.isnan(ballots)
+    n = ranked.sum(axis=1)
+    bad = np.zeros(ballots.shape[0], dtype=bool)
+
+    bad |= (np.isnan(mid_ranks) != ~ranked).any(axis=1)
+    bad |= np.nansum(mid_ranks, axis=1) != n * (n + 1) / 2
+    values = np.where(ranked, mid_ranks, 1.0)
+    bad |= ((values < 1) | (values > np.maximum(n, 1)[:, None]) | (values * 2 != np.floor(values * 2))).any(axis=1)
+
+    # Order preservation: walk each row in input order
+    order = np.argsort(np.where(ranked, ballots, np.inf), axis=1, kind='stable')
+    sorted_in = np.take_along_axis(np.where(ranked, ballots, np.inf), order, axis=1)
+    sorted_out = np.take_along_axis(np.where(ranked, mid_ranks, np.inf), order, axis=1)
+    both = np.isfinite(sorted_in[:, 1:]) & np.isfinite(sorted_in[:, :-1])
+    with np.errstate(invalid='ignore'):
+        in_diff, out_diff = np.diff(sorted_in, axis=1), np.diff(sorted_out, axis=1)
+    bad |= (both & (in_diff == 0) & (out_diff != 0)).any(axis=1)
+    bad |= (both & (in_diff > 0) & ~(out_diff > 0)).any(axis=1)
+
+    # Strict rankings (a permutation of 1..N) come back unchanged
+    positions = np.arange(1, ballots.shape[1] + 1)
+    strict = ((sorted_in == positions) | (positions > n[:, None])).all(axis=1)
+    bad |= strict & np.where(ranked, mid_ranks != ballots, False).any(axis=1)
+    return np.flatnonzero(bad)
+
+
+def check_standard_ranking(scores, tolerance=FLOAT_TOLERANCE):
+    """Run the engine's 1-D standard_ranking over every row at once; returns failing rows
+
+    Rows are laid end to end with +inf separators (never within tolerance of
+    anything), so each row's ranks are the flat ranks minus its offset.
+    """
+    count, width = scores.shape
+    flat = np.concatenate([scores, np.full((count, 1), np.inf)], axis=1).ravel()
+    with np.errstate(invalid='ignore'):
+        flat_ranks = standard_ranking(flat, tolerance)
+    offsets = (np.arange(count) * (width + 1))[:, None]
+    ranks = flat_ranks.reshape(count, width + 1)[:, :width] - offsets
+
+    tied = np.zeros(scores.shape, dtype=bool)
+    tied[:, 1:] = np.abs(np.diff(scores, axis=1)) < tolerance
+    expected_new = np.broadcast_to(np.arange(1, width + 1), scores.shape)
+    previous = np.concatenate([np.zeros((count, 1), dtype=ranks.dtype), ranks[:, :-1]], axis=1)
+    bad = (tied & (ranks != previous)) | (~tied & (ranks != expected_new))
+    return np.flatnonzero(bad.any(axis=1)), ranks
+
+
+def check_stage(teacher_matrix, student_matrix, total_points, student_weight, teacher_weight, top_n=None):
+    """Whole-stage properties; returns a failure message or None"""
+    result = calculate_scores_from_votes(teacher_matrix, student_matrix, total_points,
+                                         student_weight, teacher_weight, top_n)
+    order = result['order']
+    if order.size == 0:
+        return None
+    ranks = result['rankings'][order]
+    scores = result['weightedScores'][order]
+    points = result['scores'][order]
+
+    if ranks.tolist() != reference_standard_ranking(scores.tolist()):
+        return f"rankings {ranks.tolist()} != reference for scores {scores.tolist()}"
+    scored = ranks <= top_n if top_n else np.ones(ranks.size, dtype=bool)
+    if scored.any():
+        want = reference_distribution(ranks[scored].tolist(), total_points)
+        if points[scored].tolist() != [float(p) for p in want]:
+            return f"points {points[scored].tolist()} != reference {want}"
+        if abs(points[scored].sum() - total_points) > 1e-9:
+            return f"points add up to {points[scored].sum()}, pool is {total_points}"
+    if (points[~scored] != 0).any():
+        return "items outside top-N received points"
+    return None
+
+
+# ---------------------------------------------------------------------------
+# Shrinking
+# ---------------------------------------------------------------------------
+
+def shrink(case, fails, candidates, max_steps=10000):
+    """Greedy shrink: keep taking the first simpler candidate that still fails"""
+    steps = 0
+    progress = True
+    while progress and steps < max_steps:
+        progress = False
+        for candidate in candidates(case):
+            steps += 1
+            if fails(candidate):
+                case = candidate
+                progress = True
+                break
+    return case
+
+
+def ballot_candidates(ballot):
+    """Simpler ballots: drop one or two items, unrank an item, lower a rank"""
+    for i in range(len(ballot)):
+        yield ballot[:i] + ballot[i + 1:]
+    for i in range(len(ballot) - 1):
+        yield ballot[:i] + ballot[i + 2:]
+    for i, rank in enumerate(ballot):
+        if rank is not None:
+            yield ballot[:i] + [None] + ballot[i + 1:]
+            if rank > 1:
+                yield ballot[:i] + [rank - 1] + ballot[i + 1:]
+
+
+def score_candidates(scores):
+    """Simpler ascending score vectors: drop a score, round one to fewer decimals"""
+    for i in range(len(scores)):
+        yield scores[:i] + scores[i + 1:]
+    for i, score in enumerate(scores):
+        for digits in (0, 2, 6):
+            rounded = round(score, digits)
+            candidate = sorted(scores[:i] + [rounded] + scores[i + 1:])
+            if rounded != score:
+                yield candidate
+
+
+def _as_row(values):
+    return np.array([[np.nan if v is None else v for v in values]], dtype=float)
+
+
+def mid_rank_fails(ballot):
+    if not ballot:
+        return False
+    row = _as_row(ballot)
+    engine = dense_to_mid_ranks(row)
+    if check_mid_ranks(row, engine).size:
+        return True
+    want = reference_mid_ranks(ballot)
+    got = [None if math.isnan(v) else v for v in engine[0]]
+    return got != want
+
+
+def ranking_fails(scores):
+    if not scores:
+        return False
+    row = np.array([scores], dtype=float)
+    failing, ranks = check_standard_ranking(row)
+    return bool(failing.size) or ranks[0].tolist() != reference_standard_ranking(scores)
+
+
+# ---------------------------------------------------------------------------
+# Driver
+# ---------------------------------------------------------------------------
+
+def fuzz_mid_ranks(rng, ballots, batch_size, max_items, missing_rate, reference_sample):
+    """Returns (ballots checked, shrunk failing ballot or None)"""
+    checked = 0
+    while checked < ballots:
+        count = min(batch_size, ballots - checked)
+        width = int(rng.integers(1, max_items + 1))
+        batch = generate_ballots(rng, count, width, missing_rate, dense=bool(rng.random() < 0.8))
+        mid_ranks = dense_to_mid_ranks(batch)
+
+        failing = check_mid_ranks(batch, mid_ranks).tolist()
+        for row in rng.choice(count, size=min(reference_sample, count), replace=False):
+            ballot = [None if math.isnan(v) else float(v) for v in batch[row]]
+            got = [None if math.isnan(v) else float(v) for v in mid_ranks[row]]
+            if got != reference_mid_ranks(ballot):
+                failing.append(int(row))
+        if failing:
+            ballot = [None if math.isnan(v) else float(v) for v in batch[failing[0]]]
+            return checked + count, shrink(ballot, mid_rank_fails, ballot_candidates)
+        checked += count
+    return checked, None
+
+
+def fuzz_standard_ranking(rng, rows, batch_size, max_items, reference_sample):
+    """Returns (score rows checked, shrunk failing score vector or None)"""
+    checked = 0
+    while checked < rows:
+        count = min(batch_size, rows - checked)
+        width = int(rng.integers(1, max_items + 1))
+        scores = generate_scores(rng, count, width)
+        failing, ranks = check_standard_ranking(scores)
+        failing = failing.tolist()
+        for row in rng.choice(count, size=min(reference_sample, count), replace=False):
+            if ranks[row].tolist() != reference_standard_ranking(scores[row].tolist()):
+                failing.append(int(row))
+        if failing:
+            return checked + count, shrink(scores[failing[0]].tolist(), ranking_fails, score_candidates)
+        checked += count
+    return checked, None
+
+
+def fuzz_stages(rng, stages, max_items, missing_rate):
+    """Returns (stages checked, failure description or None)"""
+    for checked in range(stages):
+        width = int(rng.integers(1, max_items + 1))
+        students = generate_ballots(rng, int(rng.integers(0, 30)), width, missing_rate)
+        teachers = generate_ballots(rng, int(rng.integers(0, 4)), width, missing_rate)
+        total_points = float(rng.choice([0, 1, 7, 100, 1000, 2500]))
+        student_weight = float(rng.choice([0.7, 0.5, 0.65, 1.0]))
+        top_n = int(rng.integers(1, width + 1)) if rng.random() < 0.3 else None
+        message = check_stage(teachers, students, total_points, student_weight, 1.0 - student_weight, top_n)
+        if message:
+            return checked + 1, {'message': message, 'students': students.tolist(), 'teachers': teachers.tolist(),
+                                 'totalPoints': total_points, 'studentWeight': student_weight, 'topN': top_n}
+    return stages, None
+
+
+# ---------------------------------------------------------------------------
+# Watch mode
+# ---------------------------------------------------------------------------
+
+WATCH_SCHEMA = """
+    CREATE TABLE projects (projectId TEXT PRIMARY KEY, projectName TEXT);
+    CREATE TABLE stages (stageId TEXT PRIMARY KEY, stageName TEXT, reportRewardPool REAL,
+                         projectId TEXT, status TEXT);
+    CREATE TABLE rankings (proposalId TEXT PRIMARY KEY, stageId TEXT, lastModified INTEGER, rankingData TEXT);
+    CREATE INDEX idx_rankings_stage ON rankings(stageId);
+    CREATE INDEX idx_rankings_modified ON rankings(lastModified);
+"""
+
+# Stages in voting at once; opening one more closes the oldest
+WATCH_OPEN_STAGES = 8
+
+
+def random_ranking_data(rng, width, missing_rate):
+    """One ballot as a rankingData JSON column"""
+    ballot = generate_ballots(rng, 1, width, missing_rate)[0]
+    return json.dumps([{'groupId': f"g{column}", 'rank': int(rank)}
+                       for column, rank in enumerate(ballot) if not np.isnan(rank)])
+
+
+def check_watch(watcher, conn, stage_ids):
+    """Watched projections of `stage_ids` against a fresh score of each stage; returns a failure message or None"""
+    for stage_id in stage_ids:
+        projection = watcher.stages[stage_id]
+        ballots = [parse_ranking_data(raw) for (raw,) in conn.execute(
+            "SELECT rankingData FROM rankings WHERE stageId = ?", (stage_id,))]
+        want = score_ballots([], ballots, projection.reward_pool, projection.config)['weightedScores']
+        got = projection.project()['weightedScores']
+        if want.keys() != got.keys() or any(abs(want[item_id] - got[item_id]) > 1e-9 for item_id in want):
+            return f"stage {stage_id}: watched scores {got} != replay {want}"
+    return None
+
+
+def fuzz_watch(rng, rounds, max_items, missing_rate):
+    """Returns (refreshes checked, failure description or None)
+
+    Each round applies a few events, refreshes, and checks the stages the
+    events touched. The clock only moves forward (often by 0, so rows share a
+    lastModified), which is how a resubmission in one stage and a stage
+    opening with newer votes land in the same refresh. Stages leave voting
+    after a while so the watched set stays small.
+    """
+    conn = sqlite3.connect(':memory:')
+    conn.row_factory = sqlite3.Row
+    conn.executescript(WATCH_SCHEMA)
+    conn.execute("INSERT INTO projects VALUES ('p0', 'Fuzz')")
+    watcher = RankingsWatcher(conn)
+    widths, proposals, clock, opened, votes = {}, [], 0, 0, 0
+    for checked in range(rounds):
+        events = []
+        for _ in range(int(rng.integers(1, 6))):
+            clock += int(rng.integers(0, 3))
+            action = rng.random()
+            if not widths or action < 0.15:
+                stage_id = f"s{opened}"
+                opened += 1
+                widths[stage_id] = int(rng.integers(1, max_items + 1))
+                conn.execute("INSERT INTO stages VALUES (?, ?, 1000, 'p0', 'voting')", (stage_id, stage_id))
+                events.append(('open', stage_id))
+                if len(widths) > WATCH_OPEN_STAGES:
+                    closed = list(widths)[0]
+                    del widths[closed]
+                    proposals = [proposal for proposal in proposals if proposal[1] != closed]
+                    conn.execute("UPDATE stages SET status = 'completed' WHERE stageId = ?", (closed,))
+                    events.append(('close', closed))
+            elif proposals and action < 0.5:
+                # a resubmission is always later than the vote it replaces
+                clock += 1
+                proposal_id, stage_id = proposals[int(rng.integers(len(proposals)))]
+                conn.execute("UPDATE rankings SET lastModified = ?, rankingData = ? WHERE proposalId = ?",
+                             (clock, random_ranking_data(rng, widths[stage_id], missing_rate), proposal_id))
+                events.append(('resubmit', stage_id, proposal_id, clock))
+            else:
+                stage_id = list(widths)[int(rng.integers(len(widths)))]
+                proposal_id = f"r{votes}"
+                votes += 1
+                proposals.append((proposal_id, stage_id))
+                conn.execute("INSERT INTO rankings VALUES (?, ?, ?, ?)",
+                             (proposal_id, stage_id, clock, random_ranking_data(rng, widths[stage_id], missing_rate)))
+                events.append(('vote', stage_id, proposal_id, clock))
+        watcher.refresh()
+        message = check_watch(watcher, conn, sorted({event[1] for event in events} & set(widths)))
+        if message:
+            return checked + 1, {'message': message, 'events': events}
+    return rounds, None
+
+
+def main():
+    """Main entry point"""
+    parser = argparse.ArgumentParser(description="Fuzz mid-rank tie normalization and tolerance ranking")
+    parser.add_argument('--ballots', type=int, default=1_000_000, help='weak-order ballots to check')
+    parser.add_argument('--score-rows', type=int, default=1_000_000, help='score vectors to rank')
+    parser.add_argument('--stages', type=int, default=20_000, help='whole stages to score')
+    parser.add_argument('--watch-rounds', type=int, default=2000, help='watch-mode refreshes to check')
+    parser.add_argument('--batch-size', type=int, default=100_000, help='rows generated per vectorized batch')
+    parser.add_argument('--max-items', type=int, default=16, help='maximum items per ballot / stage')
+    parser.add_argument('--missing-rate', type=float, default=0.2, help='probability an item is left unranked')
+    parser.add_argument('--reference-sample', type=int, default=2000,
+                        help='rows per batch also compared against the scalar TypeScript ports')
+    parser.add_argument('--seed', type=int, default=None, help='random seed (printed so failures can be replayed)')
+    args = parser.parse_args()
+
+    seed = args.seed if args.seed is not None else int(np.random.SeedSequence().entropy % 2**32)
+    rng = np.random.default_rng(seed)
+
+    print("="*80)
+    print("🎯 SETTLEMENT FUZZ HARNESS")
+    print("="*80)
+    print(f"Seed: {seed}")
+
+    failures = 0
+
+    started = time.perf_counter()
+    checked, ballot = fuzz_mid_ranks(rng, args.ballots, args.batch_size, args.max_items,
+                                     args.missing_rate, args.reference_sample)
+    elapsed = time.perf_counter() - started
+    if ballot is None:
+        print(f"\n✅ Mid-ranks: {checked:,} ballots in {elapsed:.2f}s ({checked / max(elapsed, 1e-9):,.0f}/s)")
+    else:
+        failures += 1
+        print(f"\n❌ Mid-ranks: failure after {checked:,} ballots; shrunk ballot (None = unranked):")
+        print(f"   input:     {ballot}")
+        print(f"   engine:    {dense_to_mid_ranks(_as_row(ballot))[0].tolist()}")
+        print(f"   reference: {reference_mid_ranks(ballot)}")
+
+    started = time.perf_counter()
+    checked, scores = fuzz_standard_ranking(rng, args.score_rows, args.batch_size, args.max_items,
+                                            args.reference_sample)
+    elapsed = time.perf_counter() - started
+    if scores is None:
+        print(f"✅ Standard ranking: {checked:,} score vectors in {elapsed:.2f}s "
+              f"(tolerance {FLOAT_TOLERANCE})")
+    else:
+        failures += 1
+        print(f"❌ Standard ranking: failure after {checked:,} score vectors; shrunk scores:")
+        print(f"   scores:    {[repr(s) for s in scores]}")
+        print(f"   engine:    {standard_ranking(np.array(scores)).tolist()}")
+        print(f"   reference: {reference_standard_ranking(scores)}")
+
+    started = time.perf_counter()
+    checked, failure = fuzz_stages(rng, args.stages, args.max_items, args.missing_rate)
+    elapsed = time.perf_counter() - started
+    if failure is None:
+        print(f"✅ Stages: {checked:,} stages scored in {elapsed:.2f}s")
+    else:
+        failures += 1
+        print(f"❌ Stages: failure in stage {checked:,}: {failure['message']}")
+        print(f"   {failure}")
+
+    started = time.perf_counter()
+    checked, failure = fuzz_watch(rng, args.watch_rounds, args.max_items, args.missing_rate)
+    elapsed = time.perf_counter() - started
+    if failure is None:
+        print(f"✅ Watch: {checked:,} refreshes match a fresh replay in {elapsed:.2f}s")
+    else:
+        failures += 1
+        print(f"❌ Watch: refresh {checked:,} diverged: {failure['message']}")
+        print(f"   events since the previous refresh: {failure['events']}")
+
+    print(f"\n📊 {failures} propert{'y' if failures == 1 else 'ies'} failed (seed {seed})")
+    sys.exit(0 if failures == 0 else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+"""
+Wallet Ledger Materializer & Reconciler
+=======================================
+The backend stores no balances: handlers/wallets/leaderboard.ts recomputes
+them with SUM(t.amount) on every request. This module folds the whole
+transactions table into per-project, per-user balances in one grouped scan
+and checkpoints the result by `timestamp`, so later runs only scan the rows
+added since the last checkpoint.
+
+It also reconciles settlementhistory against the ledger:
+- stage settlements: the pre-rounding amounts (metadata.originalAmount) of
+  their stage_settlement transactions should add up to
+  totalRewardDistributed; each transaction is Math.ceil of its original
+  amount, so the rounded ledger may exceed it by < 1 point per transaction.
+- reversals: their settlement_reversal transactions must exactly negate
+  every transaction of the original settlement.
+
+Transactions are append-only and written in atomic batches that share one
+timestamp, so a watermark of (timestamp, ids seen at that timestamp) is
+enough to resume. Rows inserted later with an older timestamp are not
+picked up incrementally; run with a fresh checkpoint to rebuild.
+
+Usage:
+    python test_settlement.py --ledger [--ledger-checkpoint ledger.json]
+"""
+
+import json
+import os
+from pathlib import Path
+
+CHECKPOINT_VERSION = 1
+
+POINTS_TOLERANCE = 0.01
+
+
+class WalletLedger:
+    """Materialized {projectId: {userEmail: [balance, transactionCount]}} with a timestamp watermark"""
+
+    def __init__(self, conn, checkpoint_path=None):
+        self.conn = conn
+        self.checkpoint_path = Path(checkpoint_path) if checkpoint_path else None
+        self.balances = {}
+        self.watermark = None
+        self.watermark_ids = set()
+        self.folded = 0
+
+    def load_checkpoint(self):
+        """Restore balances and watermark; returns False when there is nothing usable"""
+        if not self.checkpoint_path or not self.checkpoint_path.exists():
+            return False
+        data = json.loads(self.checkpoint_path.read_text(encoding='utf-8'))
+        if data.get('version') != CHECKPOINT_VERSION:
+            return False
+        self.balances = {
+            project_id: {email: list(entry) for email, entry in users.items()}
+            for project_id, users in data['balances'].items()
+        }
+        self.watermark = data['watermark']
+        self.watermark_ids = set(data['watermarkIds'])
+        return True
+
+    def save_checkpoint(self):
+        """Atomically write balances and watermark to the checkpoint file"""
+        if not self.checkpoint_path:
+            return
+        data = {
+            'version': CHECKPOINT_VERSION,
+            'watermark': self.watermark,
+            'watermarkIds': sorted(self.watermark_ids),
+            'balances': self.balances,
+        }
+        tmp_path = self.checkpoint_path.with_name(self.checkpoint_path.name + '.tmp')
+        tmp_path.write_text(json.dumps(data, separators=(',', ':')), encoding='utf-8')
+        os.replace(tmp_path, self.checkpoint_path)
+
+    def refresh(self):
+        """Fold transactions newer than the watermark into the balances
+
+        Returns the number of transactions folded in.
+        """
+        folded = 0
+        # One read transaction: the grouped scan, the watermark and its ids all
+        # see the same rows, so nothing committed in between is skipped
+        own_transaction = not self.conn.in_transaction
+        if own_transaction:
+            self.conn.execute("BEGIN")
+        try:
+            if self.watermark is None:
+                where, params = "", ()
+            else:
+                where, params = "WHERE timestamp > ?", (self.watermark,)
+                # Rows sharing the watermark timestamp may have been only partly seen
+                for project_id, user_email, transaction_id, amount in self.conn.execute("""
+                    SELECT projectId, userEmail, transactionId, amount
+                    FROM transactions
+                    WHERE timestamp = ?
+                """, (self.watermark,)):
+                    if transaction_id not in self.watermark_ids:
+                        self._fold(project_id, user_email, amount, 1)
+                        self.watermark_ids.add(transaction_id)
+                        folded += 1
+
+            # One grouped scan over everything past the watermark
+            for project_id, user_email, total, count in self.conn.execute(f"""
+                SELECT projectId, userEmail, SUM(amount), COUNT(*)
+                FROM transactions
+                {where}
+                GROUP BY projectId, userEmail
+            """, params):
+                self._fold(project_id, user_email, total, count)
+                folded += count
+
+            latest = self.conn.execute(f"SELECT MAX(timestamp) FROM transactions {where}", params).fetchone()[0]
+            if latest is not None:
+                self.watermark = latest
+                self.watermark_ids = {row[0] for row in self.conn.execute(
+                    "SELECT transactionId FROM transactions WHERE timestamp = ?", (latest,)
+                )}
+        finally:
+            if own_transaction:
+                self.conn.execute("COMMIT")
+
+        self.folded += folded
+        return folded
+
+    def _fold(self, project_id, user_email, amount, count):
+        entry = self.balances.setdefault(project_id, {}).setdefault(user_email, [0.0, 0])
+        entry[0] += amount
+        entry[1] += count
+
+    def project_totals(self):
+        """{projectId: (userCount, transactionCount, totalBalance)}"""
+        return {
+            project_id: (len(users), sum(entry[1] for entry in users.values()),
+                         sum(entry[0] for entry in users.values()))
+            for project_id, users in self.balances.items()
+        }
+
+    def verify_project(self, project_id):
+        """Recompute one project's balances with SUM() (as leaderboard.ts does) and diff them"""
+        expected = {
+            user_email: (total, count) for user_email, total, count in self.conn.execute("""
+                SELECT userEmail, SUM(amount), COUNT(*)
+                FROM transactions
+                WHERE projectId = ?
+                GROUP BY userEmail
+            """, (project_id,))
+        }
+        materialized = self.balances.get(project_id, {})
+        mismatches = []
+        for user_email in set(expected) | set(materialized):
+            want = expected.get(user_email, (0.0, 0))
+            got = materialized.get(user_email, [0.0, 0])
+            if want[1] != got[1] or abs(want[0] - got[0]) > 1e-6:
+                mismatches.append((user_email, want, tuple(got)))
+        return mismatches
+
+
+def reconcile_settlements(conn, points_tolerance=POINTS_TOLERANCE):
+    """Compare every settlement's totalRewardDistributed with its transactions
+
+    Returns one dict per settlement with an `ok` flag and a `reason` when it
+    does not reconcile.
+    """
+    ledger = {}
+    for settlement_id, transaction_type, total, original_total, count in conn.execute("""
+        SELECT settlementId, transactionType, SUM(amount),
+               SUM(COALESCE(CASE WHEN json_valid(metadata) THEN json_extract(metadata, '$.originalAmount') END, amount)), COUNT(*)
+        FROM transactions
+        WHERE settlementId IS NOT NULL
+        GROUP BY settlementId, transactionType
+    """):
+        ledger.setdefault(settlement_id, {})[transaction_type] = (total, original_total, count)
+
+    settlements = conn.execute("""
+        SELECT settlementId, projectId, stageId, settlementType, status,
+               totalRewardDistributed, settlementData
+        FROM settlementhistory
+        ORDER BY projectId, settlementTime
+    """).fetchall()
+
+    results = []
+    for settlement in settlements:
+        settlement_id = settlement['settlementId']
+        by_type = ledger.get(settlement_id, {})
+        ledger_total = sum(entry[0] for entry in by_type.values())
+        result = {
+            'settlementId': settlement_id,
+            'projectId': settlement['projectId'],
+            'stageId': settlement['stageId'],
+            'settlementType': settlement['settlementType'],
+            'status': settlement['status'],
+            'totalRewardDistributed': settlement['totalRewardDistributed'] or 0,
+            'ledgerTotal': ledger_total,
+            'transactionCount': sum(entry[2] for entry in by_type.values()),
+            'ok': True,
+        }
+        results.append(result)
+
+        if settlement['settlementType'] == 'reversal':
+            try:
+                original_id = json.loads(settlement['settlementData'] or '{}').get('originalSettlementId')
+            except ValueError:
+                original_id = None
+            original_total = sum(entry[0] for entry in ledger.get(original_id, {}).values())
+            if abs(ledger_total + original_total) > points_tolerance:
+                result.update(ok=False, reason=f"reversal nets {ledger_total:.2f}, "
+                                               f"original settlement {original_id} paid {original_total:.2f}")
+            continue
+
+        rounded, original, count = by_type.get('stage_settlement', (0.0, 0.0, 0))
+        result['originalTotal'] = original
+        # originalAmount is the unrounded participantPoints; only amount is Math.ceil'd
+        if count == 0 and result['totalRewardDistributed'] > 0:
+            result.update(ok=False, reason='no stage_settlement transactions')
+        elif abs(original - result['totalRewardDistributed']) > points_tolerance:
+            result.update(ok=False, reason=f"pre-rounding transactions total {original:.2f}")
+        elif not -points_tolerance <= rounded - original < count + points_tolerance:
+            result.update(ok=False, reason=f"rounded total {rounded:.2f} is not a Math.ceil of {original:.2f}")
+
+    return results
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""
+NDJSON Settlement Report Writer
+===============================
+Streams SettlementTester results as newline-delimited JSON: one object per
+line, each tagged with a `type` (stage, group, settlement, mismatch, issue,
+summary) so the output can be diffed between runs, grepped, or loaded into
+a dashboard without parsing the console report.
+
+Usage:
+    python test_settlement.py --batch --quiet --report replay.ndjson
+"""
+
+import json
+import math
+import time
+
+
+def _json_default(value):
+    """Serialize NumPy scalars/arrays that slip through from the engine"""
+    if hasattr(value, 'tolist'):
+        return value.tolist()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def _clean(value):
+    # NaN/inf are not valid JSON; report them as null
+    if isinstance(value, float) and not math.isfinite(value):
+        return None
+    if isinstance(value, dict):
+        return {key: _clean(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_clean(item) for item in value]
+    return value
+
+
+class NDJSONReportWriter:
+    """Write one JSON record per line to a file"""
+
+    def __init__(self, path):
+        self.path = str(path)
+        self.stream = open(self.path, 'w', encoding='utf-8')
+        self.count = 0
+
+    def write(self, record_type, **fields):
+        """Write one record; fields must be JSON-serializable (NumPy scalars are converted)"""
+        record = {'type': record_type, 'ts': int(time.time() * 1000), **_clean(fields)}
+        self.stream.write(json.dumps(record, ensure_ascii=False, separators=(',', ':'),
+                                     default=_json_default))
+        self.stream.write('\n')
+        self.count += 1
+
+    def close(self):
+        self.stream.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
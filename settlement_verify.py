@@ -0,0 +1,299 @@
+#!/usr/bin/env python3
+"""
+Settlement Replay Verifier
+==========================
+Recomputes every active stage settlement from the same inputs the backend
+used (teachersubmissionrankings + agreed rankingproposals, and the comment
+ranking tables) as of its settlementTime, then diffs the expected
+finalRank / studentScore / teacherScore / totalScore / allocatedPoints
+against the rows stored in stagesettlements and commentsettlements.
+
+Inputs are reconstructed as of the settlement: rows created after
+settlementTime are ignored, and proposals count as 'pending' if they were
+not settled or withdrawn before it (resetTime is record-only and does not
+affect status, as in schema.sql). Proposal votingResult comes from the
+current votes. Scoring weights come from the project row, falling back
+to the hardcoded defaults (system KV overrides are not visible offline).
+
+Usage:
+    python test_settlement.py --verify [--score-tolerance 1e-6] [--points-tolerance 0.01]
+"""
+
+from itertools import groupby
+
+from settlement_distribution import parse_participation
+from settlement_engine import (
+    MAX_SQL_PARAMS,
+    aggregate_teacher_rankings,
+    calculate_comment_reward_limit,
+    effective_scoring_config,
+    parse_ranking_data,
+    score_ballots,
+)
+
+SCORE_TOLERANCE = 1e-6
+POINTS_TOLERANCE = 0.01
+
+SETTLEMENT_FIELDS = ('finalRank', 'studentScore', 'teacherScore', 'totalScore', 'allocatedPoints')
+
+# Engine result key for each stored settlement column
+RESULT_KEYS = {
+    'finalRank': 'rankings',
+    'studentScore': 'studentScores',
+    'teacherScore': 'teacherScores',
+    'totalScore': 'weightedScores',
+    'allocatedPoints': 'scores',
+}
+
+
+class SettlementVerifier:
+    """Replay active stage settlements and diff them against the stored detail rows"""
+
+    def __init__(self, conn, score_tolerance=SCORE_TOLERANCE, points_tolerance=POINTS_TOLERANCE):
+        self.conn = conn
+        self.score_tolerance = score_tolerance
+        self.points_tolerance = points_tolerance
+        self._projects = {}
+
+    def active_settlements(self):
+        """All active stage settlements (reversal records are skipped)"""
+        return self.conn.execute("""
+            SELECT sh.settlementId, sh.projectId, sh.stageId, sh.settlementTime,
+                   sh.totalRewardDistributed, s.stageName,
+                   s.reportRewardPool, s.commentRewardPool
+            FROM settlementhistory sh
+            JOIN stages s ON s.stageId = sh.stageId
+            WHERE sh.status = 'active' AND sh.settlementType = 'stage'
+            ORDER BY sh.projectId, sh.settlementTime
+        """).fetchall()
+
+    def load_stored_rows(self, table, key_column):
+        """Load every stored detail row of every active settlement in one pass
+
+        The join probes idx_stagesettlements_settlement /
+        idx_commentsettlements_settlement once per settlement.
+        Returns {settlementId: {itemId: row}}.
+        """
+        cursor = self.conn.execute(f"""
+            SELECT d.settlementId, d.{key_column} AS itemId,
+                   d.finalRank, d.studentScore, d.teacherScore, d.totalScore, d.allocatedPoints
+            FROM settlementhistory sh
+            JOIN {table} d ON d.settlementId = sh.settlementId
+            WHERE sh.status = 'active' AND sh.settlementType = 'stage'
+            ORDER BY d.settlementId
+        """)
+        return {
+            settlement_id: {row['itemId']: row for row in rows}
+            for settlement_id, rows in groupby(cursor, key=lambda row: row['settlementId'])
+        }
+
+    def _project(self, project_id):
+        if project_id not in self._projects:
+            self._projects[project_id] = self.conn.execute(
+                "SELECT * FROM projects WHERE projectId = ?", (project_id,)
+            ).fetchone()
+        return self._projects[project_id]
+
+    def expected_stage_rows(self, settlement, config):
+        """Recompute the stagesettlements rows a settlement should have written
+
+        Returns (rows, totalRewardDistributed); the total covers every scored
+        group, including those skipped for having no participants.
+        """
+        project_id, stage_id, as_of = settlement['projectId'], settlement['stageId'], settlement['settlementTime']
+
+        teacher_ballots, proposals = load_stage_ballots(self.conn, project_id, stage_id, as_of)
+        student_ballots = [ballot for _, ballot in proposals]
+
+        reward_pool = settlement['reportRewardPool'] or 0
+        records = self._score(teacher_ballots, student_ballots, reward_pool, config)
+
+        # Only groups with participants in their latest approved submission get a row
+        participating = {
+            group_id for group_id, (_, shares) in load_participation(self.conn, stage_id, as_of).items()
+            if any(share > 0 for share in shares.values())
+        }
+
+        rows = {
+            group_id: row for group_id, row in _rows_from_records(records).items()
+            if group_id in participating
+        }
+        return rows, sum(records['scores'].values())
+
+    def expected_comment_rows(self, settlement, config):
+        """Recompute the commentsettlements rows a settlement should have written"""
+        comment_pool = settlement['commentRewardPool'] or 0
+        if comment_pool <= 0:
+            return {}
+
+        project_id, stage_id, as_of = settlement['projectId'], settlement['stageId'], settlement['settlementTime']
+
+        teacher_ballots = aggregate_teacher_rankings(self.conn.execute("""
+            SELECT teacherEmail, commentId, rank, createdTime
+            FROM teachercommentrankings
+            WHERE projectId = ? AND stageId = ? AND createdTime <= ?
+            ORDER BY teacherEmail ASC, createdTime DESC
+        """, (project_id, stage_id, as_of)))
+
+        student_ballots = [parse_ranking_data(row[0]) for row in self.conn.execute("""
+            WITH LatestCommentRankings AS (
+                SELECT rankingData, authorEmail,
+                       ROW_NUMBER() OVER (PARTITION BY authorEmail ORDER BY createdTime DESC) AS rn
+                FROM commentrankingproposals
+                WHERE stageId = ? AND createdTime <= ?
+            )
+            SELECT lcr.rankingData
+            FROM LatestCommentRankings lcr
+            JOIN usergroups ug ON ug.userEmail = lcr.authorEmail AND ug.projectId = ?
+            WHERE lcr.rn = 1 AND ug.isActive = 1
+        """, (stage_id, as_of, project_id))]
+
+        unique_authors = self.conn.execute("""
+            SELECT COUNT(DISTINCT c.authorEmail)
+            FROM comments c
+            WHERE c.stageId = ? AND c.isReply = 0 AND c.createdTime <= ?
+              AND (c.mentionedGroups IS NOT NULL OR c.mentionedUsers IS NOT NULL)
+              AND EXISTS (
+                SELECT 1 FROM usergroups ug
+                WHERE ug.userEmail = c.authorEmail AND ug.projectId = c.projectId AND ug.isActive = 1
+              )
+              AND EXISTS (
+                SELECT 1 FROM (
+                  SELECT targetId, reactionType,
+                         ROW_NUMBER() OVER (PARTITION BY targetId, userEmail ORDER BY createdAt DESC) AS rn
+                  FROM reactions
+                  WHERE targetType = 'comment' AND createdAt <= ?
+                ) r
+                WHERE r.targetId = c.commentId AND r.reactionType = 'helpful' AND r.rn = 1
+              )
+        """, (stage_id, as_of, as_of)).fetchone()[0]
+
+        top_n = calculate_comment_reward_limit(
+            unique_authors, config['commentRewardPercentile'], config['maxCommentSelections']
+        )
+        records = self._score(teacher_ballots, student_ballots, comment_pool, config, top_n=top_n)
+
+        # Only awarded comments that still exist get a row
+        awarded = [comment_id for comment_id, points in records['scores'].items() if points > 0]
+        existing = set()
+        for start in range(0, len(awarded), MAX_SQL_PARAMS):
+            chunk = awarded[start:start + MAX_SQL_PARAMS]
+            existing.update(row[0] for row in self.conn.execute(
+                f"SELECT commentId FROM comments WHERE commentId IN ({','.join('?' * len(chunk))})", chunk
+            ))
+
+        return {
+            comment_id: row for comment_id, row in _rows_from_records(records).items()
+            if comment_id in existing
+        }
+
+    def _score(self, teacher_ballots, student_ballots, total_points, config, top_n=None):
+        return score_ballots(teacher_ballots.values(), student_ballots, total_points, config, top_n)
+
+    def diff_rows(self, expected, stored):
+        """Field-by-field mismatches between expected and stored rows keyed by item id"""
+        mismatches = []
+        for item_id in list(expected) + [key for key in stored if key not in expected]:
+            if item_id not in stored:
+                mismatches.append((item_id, 'row', 'present', 'missing'))
+                continue
+            if item_id not in expected:
+                mismatches.append((item_id, 'row', 'absent', 'unexpected'))
+                continue
+
+            for field in SETTLEMENT_FIELDS:
+                want, got = expected[item_id][field], stored[item_id][field]
+                if field == 'finalRank':
+                    bad = got is None or int(got) != want
+                else:
+                    tolerance = self.points_tolerance if field == 'allocatedPoints' else self.score_tolerance
+                    bad = got is None or abs(float(got) - want) > tolerance
+                if bad:
+                    mismatches.append((item_id, field, want, got))
+        return mismatches
+
+    def verify_all(self):
+        """Verify every active stage settlement; returns one report dict per settlement"""
+        stored_groups = self.load_stored_rows('stagesettlements', 'groupId')
+        stored_comments = self.load_stored_rows('commentsettlements', 'commentId')
+
+        reports = []
+        for settlement in self.active_settlements():
+            config = effective_scoring_config(self._project(settlement['projectId']))
+            settlement_id = settlement['settlementId']
+
+            expected_groups, expected_total = self.expected_stage_rows(settlement, config)
+            expected_comments = self.expected_comment_rows(settlement, config)
+
+            group_mismatches = self.diff_rows(expected_groups, stored_groups.get(settlement_id, {}))
+            comment_mismatches = self.diff_rows(expected_comments, stored_comments.get(settlement_id, {}))
+
+            stored_total = settlement['totalRewardDistributed'] or 0
+
+            reports.append({
+                'settlementId': settlement_id,
+                'projectId': settlement['projectId'],
+                'stageId': settlement['stageId'],
+                'stageName': settlement['stageName'],
+                'groupRows': (len(expected_groups), len(stored_groups.get(settlement_id, {}))),
+                'commentRows': (len(expected_comments), len(stored_comments.get(settlement_id, {}))),
+                'groupMismatches': group_mismatches,
+                'commentMismatches': comment_mismatches,
+                'totalRewardDistributed': (expected_total, stored_total),
+                'totalMismatch': abs(stored_total - expected_total) > self.points_tolerance,
+            })
+        return reports
+
+
+def load_stage_ballots(conn, project_id, stage_id, as_of):
+    """Teacher ballots and agreed group proposals a stage settlement scores, as of `as_of`
+
+    Returns ({teacherEmail: {groupId: rank}}, [(groupId, {groupId: rank}), ...]);
+    teachers and proposals come in the order the backend feeds them to the engine.
+    """
+    teacher_ballots = aggregate_teacher_rankings(conn.execute("""
+        SELECT teacherEmail, groupId, rank, createdTime
+        FROM teachersubmissionrankings
+        WHERE projectId = ? AND stageId = ? AND createdTime <= ?
+        ORDER BY teacherEmail ASC, createdTime DESC
+    """, (project_id, stage_id, as_of)))
+
+    proposals = [(group_id, parse_ranking_data(raw)) for group_id, raw in conn.execute("""
+        WITH LatestSettledProposals AS (
+            SELECT groupId, rankingData,
+                   ROW_NUMBER() OVER (PARTITION BY groupId ORDER BY createdTime DESC) AS rn
+            FROM rankingproposals_with_status
+            WHERE projectId = ? AND stageId = ?
+              AND votingResult = 'agree'
+              AND createdTime <= ?
+              AND (settleTime IS NULL OR settleTime >= ?)
+              AND (withdrawnTime IS NULL OR withdrawnTime > ?)
+        )
+        SELECT groupId, rankingData FROM LatestSettledProposals
+        WHERE rn = 1
+        ORDER BY groupId
+    """, (project_id, stage_id, as_of, as_of, as_of))]
+    return teacher_ballots, proposals
+
+
+def load_participation(conn, stage_id, as_of):
+    """{groupId: (submissionId, {email: share})} from each group's latest submission approved by `as_of`"""
+    return {
+        group_id: (submission_id, parse_participation(proposal))
+        for group_id, submission_id, proposal in conn.execute("""
+            WITH LatestApprovedSubmissions AS (
+                SELECT groupId, submissionId, participationProposal,
+                       ROW_NUMBER() OVER (PARTITION BY groupId ORDER BY submitTime DESC) AS rn
+                FROM submissions
+                WHERE stageId = ? AND approvedTime IS NOT NULL AND approvedTime <= ?
+            )
+            SELECT groupId, submissionId, participationProposal FROM LatestApprovedSubmissions WHERE rn = 1
+        """, (stage_id, as_of))
+    }
+
+
+def _rows_from_records(records):
+    return {
+        item_id: {field: records[RESULT_KEYS[field]][item_id] for field in SETTLEMENT_FIELDS}
+        for item_id in records['rankings']
+    }
@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+"""
+Live Settlement Projection (watch mode)
+=======================================
+Keeps every voting stage's parsed ballots and mid-rank totals in memory and
+refreshes them as votes land in the miniflare D1 file, instead of replaying
+from scratch on each run.
+
+Change detection is `PRAGMA data_version`, which only moves when another
+connection commits, so an idle poll costs one pragma. On a change the
+watcher reads only `rankings` rows with lastModified at or after its
+watermark (lastModified, proposalIds already seen at that millisecond, as in
+settlement_ledger.py). A new proposal is folded into its stage's
+RankAccumulator; a resubmitted one (same proposalId, newer lastModified)
+first takes its old ballot back out. The stage is then re-scored from the
+running totals, which costs O(items), not O(ballots).
+
+The watermark cannot see deleted rows (or rows inserted with an older
+lastModified after a newer one), so each change also compares per-stage row
+counts with the proposals held and rebuilds a stage that no longer matches.
+Teacher rankings are small and are re-read for the watched stages on every
+change.
+Items are appended to the ItemIndex in arrival order, so exact score ties
+may list in a different order than a fresh replay; --verify after
+settlement remains the reference check.
+
+Usage:
+    python test_settlement.py --watch [--poll-interval 0.05] [--watch-timeout 600]
+"""
+
+import time
+
+from settlement_engine import (
+    ItemIndex,
+    MAX_SQL_PARAMS,
+    RankAccumulator,
+    build_rank_matrix,
+    calculate_scores_from_accumulators,
+    effective_scoring_config,
+    parse_ranking_data,
+    result_to_dicts,
+)
+
+
+DEFAULT_POLL_INTERVAL = 0.05
+
+# Stage statuses (from stages_with_status) whose projection is kept live
+WATCHED_STATUSES = ('voting',)
+
+
+class StageProjection:
+    """In-memory settlement inputs of one stage: latest ballot per proposal plus running totals"""
+
+    def __init__(self, stage, project, teacher_ballots):
+        self.stage_id = stage['stageId']
+        self.stage_name = stage['stageName']
+        self.project_name = project['projectName']
+        self.reward_pool = stage['reportRewardPool'] if stage['reportRewardPool'] is not None else 0
+        self.config = effective_scoring_config(project)
+        self.item_index = ItemIndex()
+        self.student = RankAccumulator(self.item_index)
+        self.proposals = {}     # proposalId -> (lastModified, ballot); empty ballots are kept but not scored
+        self.set_teacher_ballots(teacher_ballots)
+
+    def set_teacher_ballots(self, teacher_ballots):
+        """Replace the teacher totals (teacher items join the shared ItemIndex)"""
+        self.teacher_ballots = teacher_ballots
+        self.teacher = RankAccumulator(self.item_index)
+        self.teacher.add_ballots(list(teacher_ballots.values()))
+
+    def apply(self, rows):
+        """Fold (proposalId, lastModified, rankingData) rows in; returns (added, replaced)
+
+        Rows already applied at the same lastModified are ignored. All removals
+        and additions of the batch go through one matrix each.
+        """
+        removed, added = [], []
+        new, replaced = 0, 0
+        for proposal_id, last_modified, raw in rows:
+            previous = self.proposals.get(proposal_id)
+            if previous is not None:
+                if previous[0] >= last_modified:
+                    continue
+                replaced += 1
+                if previous[1]:
+                    removed.append(previous[1])
+            else:
+                new += 1
+            ballot = parse_ranking_data(raw)
+            self.proposals[proposal_id] = (last_modified, ballot)
+            if ballot:
+                added.append(ballot)
+
+        if removed:
+            self.student.remove_matrix(build_rank_matrix(removed, self.item_index))
+        if added:
+            self.student.add_matrix(build_rank_matrix(added, self.item_index))
+        return new, replaced
+
+    def project(self):
+        """Score the current totals; returns result_to_dicts records"""
+        result = calculate_scores_from_accumulators(
+            self.teacher, self.student, self.reward_pool,
+            student_weight=self.config['studentRankingWeight'],
+            teacher_weight=self.config['teacherRankingWeight'],
+        )
+        return result_to_dicts(result, self.item_index.ids)
+
+
+class RankingsWatcher:
+    """Polls one connection for commits and keeps a StageProjection per watched stage"""
+
+    def __init__(self, conn, stage_source='stages', load_teacher_rankings=None):
+        self.conn = conn
+        self.stage_source = stage_source
+        self.load_teacher_rankings = load_teacher_rankings or (lambda stage_ids: {})
+        self.stages = {}            # stageId -> StageProjection
+        self.projects = {}          # projectId -> projects row
+        self.watermark = None       # highest lastModified applied
+        self.seen_at_watermark = set()
+        self.data_version = None
+
+    def data_version_changed(self):
+        """True when another connection has committed since the last call"""
+        version = self.conn.execute("PRAGMA data_version").fetchone()[0]
+        changed = version != self.data_version
+        self.data_version = version
+        return changed
+
+    def refresh(self):
+        """Bring every projection up to date; returns {stageId: (added, replaced, rebuilt)} for changed stages"""
+        watched = {row['stageId']: row for row in self.conn.execute(f"""
+            SELECT stageId, stageName, reportRewardPool, projectId
+            FROM {self.stage_source}
+            WHERE status IN ({','.join('?' * len(WATCHED_STATUSES))})
+        """, WATCHED_STATUSES)}
+        for stage_id in list(self.stages):
+            if stage_id not in watched:
+                del self.stages[stage_id]
+
+        stage_ids = list(watched)
+        teacher_rankings = self.load_teacher_rankings(stage_ids)
+        changes = {}
+
+        # Held stages catch up before new ones load: loading a stage moves the
+        # shared watermark to its newest row, past held-stage updates not yet read
+        held = [stage_id for stage_id in stage_ids if stage_id in self.stages]
+        for stage_id, rows in self._rows_since_watermark(held).items():
+            added, replaced = self.stages[stage_id].apply(rows)
+            if added or replaced:
+                changes[stage_id] = (added, replaced, False)
+
+        for stage_id in stage_ids:
+            if stage_id not in self.stages:
+                changes[stage_id] = self._load_stage(watched[stage_id], teacher_rankings.get(stage_id, {}))
+
+        # The watermark cannot see deletes: a stage whose row count no longer
+        # matches its proposals is loaded again from scratch
+        row_counts = self._row_counts(stage_ids)
+        for stage_id in stage_ids:
+            projection = self.stages[stage_id]
+            if row_counts.get(stage_id, 0) != len(projection.proposals):
+                changes[stage_id] = self._load_stage(watched[stage_id], teacher_rankings.get(stage_id, {}))
+            elif teacher_rankings.get(stage_id, {}) != projection.teacher_ballots:
+                projection.set_teacher_ballots(teacher_rankings.get(stage_id, {}))
+                changes.setdefault(stage_id, (0, 0, False))
+        return changes
+
+    def _load_stage(self, stage, teacher_ballots):
+        """(Re)build one stage's projection from all of its rankings rows"""
+        project_id = stage['projectId']
+        if project_id not in self.projects:
+            self.projects[project_id] = self.conn.execute(
+                "SELECT * FROM projects WHERE projectId = ?", (project_id,)
+            ).fetchone()
+        projection = StageProjection(stage, self.projects[project_id], teacher_ballots)
+        self.stages[stage['stageId']] = projection
+        rows = self.conn.execute(
+            "SELECT proposalId, lastModified, rankingData FROM rankings WHERE stageId = ?", (stage['stageId'],)
+        ).fetchall()
+        for proposal_id, last_modified, _ in rows:
+            self._advance(proposal_id, last_modified)
+        added, replaced = projection.apply(rows)
+        return added, replaced, True
+
+    def _advance(self, proposal_id, last_modified):
+        if self.watermark is None or last_modified > self.watermark:
+            self.watermark = last_modified
+            self.seen_at_watermark = {proposal_id}
+        elif last_modified == self.watermark:
+            self.seen_at_watermark.add(proposal_id)
+
+    def _rows_since_watermark(self, stage_ids):
+        """{stageId: rows} for rankings at or after the watermark, minus the ids already seen there"""
+        if self.watermark is None:
+            return {}
+        rows_by_stage = {}
+        for start in range(0, len(stage_ids), MAX_SQL_PARAMS - 1):
+            chunk = stage_ids[start:start + MAX_SQL_PARAMS - 1]
+            for stage_id, proposal_id, last_modified, raw in self.conn.execute(f"""
+                SELECT stageId, proposalId, lastModified, rankingData
+                FROM rankings
+                WHERE lastModified >= ? AND stageId IN ({','.join('?' * len(chunk))})
+                ORDER BY lastModified
+            """, (self.watermark, *chunk)):
+                if last_modified == self.watermark and proposal_id in self.seen_at_watermark:
+                    continue
+                rows_by_stage.setdefault(stage_id, []).append((proposal_id, last_modified, raw))
+        for rows in rows_by_stage.values():
+            for proposal_id, last_modified, _ in rows:
+                self._advance(proposal_id, last_modified)
+        return rows_by_stage
+
+    def _row_counts(self, stage_ids):
+        counts = {}
+        for start in range(0, len(stage_ids), MAX_SQL_PARAMS):
+            chunk = stage_ids[start:start + MAX_SQL_PARAMS]
+            counts.update(self.conn.execute(f"""
+                SELECT stageId, COUNT(*) FROM rankings
+                WHERE stageId IN ({','.join('?' * len(chunk))})
+                GROUP BY stageId
+            """, chunk).fetchall())
+        return counts
+
+    def poll(self, interval=DEFAULT_POLL_INTERVAL, timeout=None):
+        """Yield (changes, elapsed seconds) after every refresh; the first refresh is the initial load"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        self.data_version_changed()
+        started = time.perf_counter()
+        yield self.refresh(), time.perf_counter() - started
+        while deadline is None or time.monotonic() < deadline:
+            time.sleep(interval)
+            if self.data_version_changed():
+                started = time.perf_counter()
+                changes = self.refresh()
+                if changes:
+                    yield changes, time.perf_counter() - started
@@ -0,0 +1,355 @@
+#!/usr/bin/env python3
+"""
+Columnar Stage Snapshots
+========================
+Exports one stage's group settlement inputs to a single .npz file, so
+weight-tuning sweeps can re-score the same stage hundreds of times without
+re-querying SQLite or re-parsing rankingData JSON:
+
+- group_ids / group_names: the group dictionary, in ItemIndex order (teacher
+  ballots first, then the agreed proposals, then groups that only have a
+  submission), so exact ties break the way the backend breaks them
+- ranks (voters × groups, float64, NaN = unranked) with roles and voters:
+  teacher ballots first, then one agreed proposal per proposing group
+- participation_offsets / participation_emails / participation_shares and
+  submission_ids: each group's latest approved participationProposal (CSR)
+- reward_pool, comment_reward_pool, student_weight, teacher_weight, as_of
+
+Inputs are reconstructed as of the stage's active settlement (or now, for a
+stage still in voting) with the same queries settlement_verify.py uses.
+
+The file is a standard uncompressed .npz (np.load reads it), written so each
+array's data starts on a 64-byte boundary. load_stage_snapshot memory-maps
+it and builds every array as a read-only view of the mapping: nothing is
+copied or parsed on load. Mid-rank totals are computed once per snapshot;
+each StageSnapshot.score() call after that is the O(groups) tail of
+calculate_scores_from_totals.
+
+Usage:
+    python stage_snapshot.py --db /tmp/d1.sqlite --stage stg_00000_03 --output stage.npz
+    python stage_snapshot.py --snapshot stage.npz --sweep 0.5,0.6,0.7,0.8,0.9 [--repeat 200]
+
+Requires: numpy
+"""
+
+import argparse
+import io
+import mmap
+import sqlite3
+import struct
+import sys
+import time
+import zipfile
+from pathlib import Path
+
+import numpy as np
+
+from settlement_distribution import distribute_member_points
+from settlement_engine import (
+    DEFAULT_SCORING_CONFIG,
+    ItemIndex,
+    build_rank_matrix,
+    calculate_scores_from_totals,
+    dense_to_mid_ranks,
+    effective_scoring_config,
+    rank_totals,
+    result_to_dicts,
+)
+from settlement_verify import load_participation, load_stage_ballots
+
+SNAPSHOT_VERSION = 1
+
+VOTER_STUDENT = 0
+VOTER_TEACHER = 1
+
+ARRAY_ALIGN = 64
+
+# Extra-field id zipalign uses for padding; readers skip unknown extra fields
+ZIP_PADDING_ID = 0xD935
+ZIP_LOCAL_HEADER = struct.Struct('<4s5H3I2H')
+NPY_MAGIC_LEN = 8
+
+
+class StageSnapshot:
+    """One stage's settlement inputs as (memory-mapped) arrays"""
+
+    def __init__(self, arrays):
+        self.arrays = arrays
+        version = int(arrays['format_version'])
+        if version != SNAPSHOT_VERSION:
+            raise ValueError(f"snapshot format {version}, expected {SNAPSHOT_VERSION}")
+        roles = arrays['roles']
+        self.teacher_count = int(np.count_nonzero(roles == VOTER_TEACHER))
+        if (roles[:self.teacher_count] != VOTER_TEACHER).any():
+            raise ValueError("snapshot ranks must list teacher ballots first")
+        self._totals = None
+
+    def __getattr__(self, name):
+        try:
+            return self.arrays[name]
+        except KeyError:
+            raise AttributeError(name) from None
+
+    @property
+    def teacher_ranks(self):
+        return self.arrays['ranks'][:self.teacher_count]
+
+    @property
+    def student_ranks(self):
+        return self.arrays['ranks'][self.teacher_count:]
+
+    def totals(self):
+        """(teacher, student) per-group (sums, counts) of mid-ranks, computed on first use"""
+        if self._totals is None:
+            self._totals = (rank_totals(dense_to_mid_ranks(self.teacher_ranks)),
+                            rank_totals(dense_to_mid_ranks(self.student_ranks)))
+        return self._totals
+
+    def score(self, student_weight=None, teacher_weight=None, total_points=None):
+        """calculate_scores_from_totals result arrays (columns follow group_ids)"""
+        teacher_totals, student_totals = self.totals()
+        return calculate_scores_from_totals(
+            teacher_totals, student_totals,
+            float(self.reward_pool) if total_points is None else total_points,
+            student_weight=float(self.student_weight) if student_weight is None else student_weight,
+            teacher_weight=float(self.teacher_weight) if teacher_weight is None else teacher_weight,
+        )
+
+    def records(self, result):
+        """result_to_dicts for a score() result"""
+        return result_to_dicts(result, self.group_ids.tolist())
+
+    def submissions(self):
+        """{groupId: (submissionId, groupName, {email: share})} as load_latest_submissions returns it"""
+        offsets = self.participation_offsets
+        emails, shares = self.participation_emails, self.participation_shares
+        submissions = {}
+        for column, group_id in enumerate(self.group_ids.tolist()):
+            start, stop = offsets[column], offsets[column + 1]
+            participants = {email: share for email, share in zip(emails[start:stop].tolist(),
+                                                                  shares[start:stop].tolist()) if share > 0}
+            if self.submission_ids[column]:
+                submissions[group_id] = (str(self.submission_ids[column]), str(self.group_names[column]),
+                                         participants)
+        return submissions
+
+
+def stage_as_of(conn, stage_id):
+    """settlementTime of the stage's active settlement, else now (ms)"""
+    row = conn.execute("""
+        SELECT settlementTime FROM settlementhistory
+        WHERE stageId = ? AND status = 'active' AND settlementType = 'stage'
+        ORDER BY settlementTime DESC LIMIT 1
+    """, (stage_id,)).fetchone()
+    return row[0] if row else int(time.time() * 1000)
+
+
+def build_snapshot_arrays(conn, stage_id, as_of=None):
+    """Read one stage's settlement inputs into the snapshot's {name: array}"""
+    stage = conn.execute("""
+        SELECT stageId, projectId, reportRewardPool, commentRewardPool FROM stages WHERE stageId = ?
+    """, (stage_id,)).fetchone()
+    if stage is None:
+        raise ValueError(f"stage {stage_id} not found")
+    _, project_id, report_pool, comment_pool = stage
+    project = conn.execute(f"""
+        SELECT {', '.join(DEFAULT_SCORING_CONFIG)} FROM projects WHERE projectId = ?
+    """, (project_id,)).fetchone()
+    config = effective_scoring_config(dict(zip(DEFAULT_SCORING_CONFIG, project)) if project else None)
+    as_of = stage_as_of(conn, stage_id) if as_of is None else as_of
+
+    teacher_ballots, proposals = load_stage_ballots(conn, project_id, stage_id, as_of)
+    proposals = [(group_id, ballot) for group_id, ballot in proposals if ballot]
+    participation = load_participation(conn, stage_id, as_of)
+
+    # Same ItemIndex order as score_ballots: teachers first, then proposals
+    item_index = ItemIndex()
+    teacher_matrix = build_rank_matrix(list(teacher_ballots.values()), item_index)
+    student_matrix = build_rank_matrix([ballot for _, ballot in proposals], item_index)
+    for group_id in participation:
+        item_index.add(group_id)
+    width = len(item_index)
+    ranks = np.full((teacher_matrix.shape[0] + student_matrix.shape[0], width), np.nan)
+    ranks[:teacher_matrix.shape[0], :teacher_matrix.shape[1]] = teacher_matrix
+    ranks[teacher_matrix.shape[0]:, :student_matrix.shape[1]] = student_matrix
+
+    group_ids = item_index.ids
+    names = dict(conn.execute("""
+        SELECT groupId, groupName FROM groups WHERE projectId = ?
+    """, (project_id,)).fetchall())
+
+    offsets, emails, shares, submission_ids = [0], [], [], []
+    for group_id in group_ids:
+        submission_id, participants = participation.get(group_id, ('', {}))
+        submission_ids.append(submission_id or '')
+        emails.extend(participants)
+        shares.extend(participants.values())
+        offsets.append(len(emails))
+
+    return {
+        'format_version': np.array(SNAPSHOT_VERSION),
+        'project_id': np.array(project_id),
+        'stage_id': np.array(stage_id),
+        'as_of': np.array(as_of, dtype=np.int64),
+        'group_ids': np.array(group_ids, dtype=str),
+        'group_names': np.array([names.get(group_id) or f"Group {group_id}" for group_id in group_ids], dtype=str),
+        'ranks': ranks,
+        'roles': np.array([VOTER_TEACHER] * len(teacher_ballots) + [VOTER_STUDENT] * len(proposals),
+                          dtype=np.uint8),
+        'voters': np.array(list(teacher_ballots) + [group_id for group_id, _ in proposals], dtype=str),
+        'participation_offsets': np.array(offsets, dtype=np.int64),
+        'participation_emails': np.array(emails, dtype=str),
+        'participation_shares': np.array(shares, dtype=np.float64),
+        'submission_ids': np.array(submission_ids, dtype=str),
+        'reward_pool': np.array(float(report_pool or 0)),
+        'comment_reward_pool': np.array(float(comment_pool or 0)),
+        'student_weight': np.array(float(config['studentRankingWeight'])),
+        'teacher_weight': np.array(float(config['teacherRankingWeight'])),
+    }
+
+
+def write_snapshot(path, arrays):
+    """Write {name: array} as an uncompressed .npz whose array data is ARRAY_ALIGN-aligned"""
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_STORED) as archive:
+        for name, value in arrays.items():
+            payload = io.BytesIO()
+            np.lib.format.write_array(payload, np.asarray(value), allow_pickle=False)
+            info = zipfile.ZipInfo(f"{name}.npy", date_time=(1980, 1, 1, 0, 0, 0))
+            info.compress_type = zipfile.ZIP_STORED
+            # The .npy header is a multiple of 64 bytes, so aligning the member aligns the data
+            data_start = archive.fp.tell() + ZIP_LOCAL_HEADER.size + len(info.filename) + 4
+            padding = -data_start % ARRAY_ALIGN
+            info.extra = struct.pack('<HH', ZIP_PADDING_ID, padding) + bytes(padding)
+            archive.writestr(info, payload.getvalue())
+
+
+def export_stage_snapshot(conn, stage_id, path, as_of=None):
+    """Export one stage to `path`; returns the arrays written"""
+    arrays = build_snapshot_arrays(conn, stage_id, as_of)
+    write_snapshot(path, arrays)
+    return arrays
+
+
+def load_stage_snapshot(path):
+    """Memory-map a snapshot; every array is a read-only view of the file"""
+    with open(path, 'rb') as f:
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    arrays = {}
+    with zipfile.ZipFile(path) as archive:
+        for info in archive.infolist():
+            if info.compress_type != zipfile.ZIP_STORED:
+                raise ValueError(f"{path}: {info.filename} is compressed; snapshots are stored uncompressed")
+            fields = ZIP_LOCAL_HEADER.unpack_from(buffer, info.header_offset)
+            start = info.header_offset + ZIP_LOCAL_HEADER.size + fields[-2] + fields[-1]
+
+            version = np.lib.format.read_magic(io.BytesIO(buffer[start:start + NPY_MAGIC_LEN]))
+            length_format = '<H' if version == (1, 0) else '<I'
+            header_length = struct.unpack_from(length_format, buffer, start + NPY_MAGIC_LEN)[0]
+            header_end = start + NPY_MAGIC_LEN + struct.calcsize(length_format) + header_length
+            header = io.BytesIO(buffer[start + NPY_MAGIC_LEN:header_end])
+            read_header = (np.lib.format.read_array_header_1_0 if version == (1, 0)
+                           else np.lib.format.read_array_header_2_0)
+            shape, fortran_order, dtype = read_header(header)
+            if dtype.hasobject:
+                raise ValueError(f"{path}: {info.filename} holds Python objects")
+
+            arrays[info.filename[:-len('.npy')]] = np.ndarray(
+                shape, dtype, buffer=buffer, offset=header_end, order='F' if fortran_order else 'C'
+            )
+    return StageSnapshot(arrays)
+
+
+def default_stage(conn):
+    """First voting stage (by project, stageOrder), else the most recent settled one"""
+    source = 'stages_with_status' if conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'view' AND name = 'stages_with_status'"
+    ).fetchone() else 'stages'
+    row = conn.execute(f"""
+        SELECT stageId FROM {source} WHERE status = 'voting' ORDER BY projectId, stageOrder LIMIT 1
+    """).fetchone() or conn.execute("""
+        SELECT stageId FROM settlementhistory
+        WHERE status = 'active' AND settlementType = 'stage'
+        ORDER BY settlementTime DESC LIMIT 1
+    """).fetchone()
+    return row[0] if row else None
+
+
+def run_sweep(snapshot, student_weights, repeat):
+    """Score the snapshot at every student weight `repeat` times; returns (weights, results, seconds per score)"""
+    total = float(snapshot.student_weight) + float(snapshot.teacher_weight)
+    weights = [(weight, total - weight) for weight in student_weights]
+    snapshot.totals()
+    started = time.perf_counter()
+    for _ in range(repeat):
+        results = [snapshot.score(student, teacher) for student, teacher in weights]
+    elapsed = time.perf_counter() - started
+    return weights, results, elapsed / (repeat * len(weights))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Export a stage's settlement inputs to a columnar .npz, or sweep scoring weights over one",
+    )
+    parser.add_argument('--db', help='SQLite database to export from')
+    parser.add_argument('--stage', help='stageId to export (default: first voting stage, else last settled)')
+    parser.add_argument('--as-of', type=int, default=None,
+                        help='reconstruct inputs as of this ms timestamp (default: settlementTime, else now)')
+    parser.add_argument('--output', help='snapshot path to write')
+    parser.add_argument('--snapshot', help='snapshot to load and sweep')
+    parser.add_argument('--sweep', default='0.5,0.6,0.7,0.8,0.9', metavar='WEIGHTS',
+                        help='student weights to score; teacher weight takes the rest of the saved total '
+                             '(default: 0.5,0.6,0.7,0.8,0.9)')
+    parser.add_argument('--repeat', type=int, default=100,
+                        help='times to score the whole sweep, for timing (default: 100)')
+    args = parser.parse_args()
+
+    if not args.snapshot and not (args.db and args.output):
+        parser.error('pass --db and --output to export, or --snapshot to sweep')
+
+    print("=" * 80)
+    print("🗜️  Stage Snapshot")
+    print("=" * 80)
+
+    if args.db and args.output:
+        conn = sqlite3.connect(f"file:{args.db}?mode=ro", uri=True)
+        try:
+            stage_id = args.stage or default_stage(conn)
+            if stage_id is None:
+                print("❌ No voting or settled stage to export")
+                return 1
+            started = time.perf_counter()
+            arrays = export_stage_snapshot(conn, stage_id, args.output, args.as_of)
+        finally:
+            conn.close()
+        print(f"💾 {stage_id} → {args.output}: {arrays['ranks'].shape[0]} ballots "
+              f"({int(np.count_nonzero(arrays['roles'] == VOTER_TEACHER))} teacher) × "
+              f"{arrays['ranks'].shape[1]} groups, {arrays['participation_emails'].size} participants, "
+              f"{Path(args.output).stat().st_size / 1024:,.1f} KiB in {(time.perf_counter() - started) * 1000:,.1f} ms")
+
+    path = args.snapshot or args.output
+    started = time.perf_counter()
+    snapshot = load_stage_snapshot(path)
+    loaded = time.perf_counter() - started
+    print(f"\n📂 Loaded {path} in {loaded * 1000:.2f} ms (memory-mapped, {len(snapshot.arrays)} arrays)")
+    print(f"   Stage {snapshot.stage_id} of {snapshot.project_id}: pool {float(snapshot.reward_pool):g}, "
+          f"weights {float(snapshot.student_weight):g}/{float(snapshot.teacher_weight):g}")
+
+    student_weights = [float(value) for value in args.sweep.split(',') if value]
+    weights, results, per_score = run_sweep(snapshot, student_weights, args.repeat)
+    names = snapshot.group_names.tolist()
+    print(f"\n🎛️  Weight sweep: {len(weights)} weight sets × {args.repeat} repeats, "
+          f"{per_score * 1e6:,.1f} µs per score")
+    for (student, teacher), result in zip(weights, results):
+        podium = ', '.join(f"{names[column]} {result['scores'][column]:g}" for column in result['order'][:3])
+        print(f"   {student:4.2f} / {teacher:4.2f}  {podium}")
+
+    members, skipped = distribute_member_points(snapshot.records(snapshot.score())['scores'],
+                                                snapshot.submissions())
+    print(f"\n💰 At the saved weights: {len(members)} groups paid, {len(skipped)} skipped, "
+          f"{sum(sum(row['amounts'].values()) for row in members.values()):.0f} points in transactions")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
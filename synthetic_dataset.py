@@ -0,0 +1,779 @@
+#!/usr/bin/env python3
+"""
+Synthetic D1 Dataset Generator
+==============================
+Builds a SQLite file from database/schema.sql and fills it with seeded,
+internally consistent course data at a chosen scale: users, projects with
+teachers and groups, usergroups (plus inactive history rows), stages in every
+status, submission version chains with approval votes, student rankings,
+group rankingproposals with proposalvotes, teacher rankings, comments,
+replies and reactions, settled stages (settlementhistory, stagesettlements,
+commentsettlements and their transactions), eventlogs, sys_logs and
+notifications.
+
+Every stage but the last two is settled, scored with settlement_engine from
+the generated ballots, so --verify and --ledger pass on a fresh file; the
+second-to-last stage is in voting (what --watch, --batch and --query-plans
+pick up) and the last one is still active.
+
+Loading: tables, views and triggers are created first and the schema's
+CREATE INDEX statements run after the data is in. Rows go in through
+executemany inside one transaction with journal_mode OFF, synchronous OFF and
+exclusive locking, and ids are zero-padded so every primary key is appended
+in order. Each project draws from its own numpy Generator seeded with
+(seed, project index), so a seed and shape always produce the same file.
+
+The default project shape is about 17k rows, most of them logs; 700 projects
+make a ~12M-row fixture.
+
+Throughput: the target was 10M rows in under a minute, and it is not met.
+On a single-core machine, 700 projects (11.65M rows, 3.5 GiB) load in about
+101s and build indexes in about 64s, roughly 71k rows/s end to end. The
+profile is dominated by SQLite itself (executemany and CREATE INDEX), not by
+row generation, so a 10M-row fixture takes ~2.5-3 minutes here.
+
+Usage:
+    python synthetic_dataset.py --output /tmp/d1.sqlite --projects 700 [--seed 0]
+    python test_settlement.py --db /tmp/d1.sqlite --verify
+"""
+
+import argparse
+import json
+import math
+import re
+import sqlite3
+import time
+from collections import namedtuple
+from itertools import islice, repeat
+from pathlib import Path
+
+import numpy as np
+
+from schema_audit import split_statements
+from settlement_engine import calculate_comment_reward_limit, effective_scoring_config, score_ballots
+
+SCHEMA_PATH = Path(__file__).parent / "database/schema.sql"
+
+BASE_TIME = 1700000000000
+HOUR_MS = 3600 * 1000
+DAY_MS = 24 * HOUR_MS
+STAGE_MS = 7 * DAY_MS
+
+# End time of the last stage: far enough ahead that stages_with_status reads 'active'
+OPEN_END_TIME = 4102444800000
+
+DEFAULT_CHUNK_ROWS = 50000
+
+DatasetShape = namedtuple('DatasetShape', [
+    'projects',     # scale knob
+    'groups',       # groups per project
+    'members',      # students per group
+    'teachers',     # teachers per project
+    'stages',       # stages per project (last is active, the one before it voting)
+    'versions',     # max submission / group proposal versions per stage
+    'comments',     # mean comments per student per stage
+    'reactions',    # mean reactions per comment
+    'event_logs',   # eventlogs rows per student
+    'sys_logs',     # sys_logs rows per student
+    'notifications',  # notifications per student
+    'churn',        # share of students with an earlier, inactive membership
+])
+
+DEFAULT_SHAPE = DatasetShape(
+    projects=10, groups=12, members=5, teachers=2, stages=6, versions=3,
+    comments=3.0, reactions=3.0, event_logs=40, sys_logs=100, notifications=20,
+    churn=0.05,
+)
+
+# Scoring settings a project may carry (None falls back to DEFAULT_SCORING_CONFIG)
+WEIGHT_CHOICES = ((None, None), (0.7, 0.3), (0.6, 0.4), (0.8, 0.2))
+MAX_COMMENT_CHOICES = (None, 3, 5)
+PERCENTILE_CHOICES = (None, 0, 10, 20)
+REPORT_POOLS = (500, 1000, 2000)
+COMMENT_POOLS = (100, 200)
+
+REPLY_RATE = 0.3
+HELPFUL_RATE = 0.85
+PROPOSAL_AGREE_RATE = 0.85
+
+EVENT_TYPES = ('login_success', 'activity', 'submission_created', 'ranking_submitted',
+               'comment_created', 'login_failed')
+EVENT_WEIGHTS = (0.3, 0.3, 0.1, 0.1, 0.15, 0.05)
+
+# (functionName, action, entityType) of logProjectOperation / logGlobalOperation calls
+SYS_LOG_OPERATIONS = (
+    ('submission_created', 'submission_created', 'submission'),
+    ('submission_approved', 'submission_approved', 'submission'),
+    ('ranking_submitted', 'ranking_submitted', 'stage'),
+    ('comment_created', 'comment_created', 'comment'),
+    ('reaction_added', 'reaction_added', 'comment'),
+    ('stage_updated', 'stage_updated', 'stage'),
+    ('stage_settled', 'stage_settled', 'stage'),
+    ('project_updated', 'project_updated', 'project'),
+    ('profile_updated', 'profile_updated', 'user'),
+    ('login', 'login_success', 'user'),
+)
+SYS_LOG_WEIGHTS = (0.12, 0.05, 0.14, 0.25, 0.2, 0.04, 0.01, 0.02, 0.02, 0.15)
+SYS_LOG_LEVELS = ('info', 'warning', 'error', 'critical')
+SYS_LOG_LEVEL_WEIGHTS = (0.9, 0.07, 0.025, 0.005)
+
+# (type, entity the row points at) of the notifications the handlers create
+NOTIFICATION_KINDS = (
+    ('submission_created', 'submission'),
+    ('submission_approved', 'submission'),
+    ('comment_replied', 'comment'),
+    ('comment_mentioned', 'comment'),
+    ('stage_voting', 'stage'),
+    ('stage_settled', 'settlement'),
+    ('group_member_added', 'group'),
+)
+NOTIFICATION_WEIGHTS = (0.15, 0.1, 0.25, 0.2, 0.12, 0.12, 0.06)
+NOTIFICATION_READ_RATE = 0.6
+
+INSERT_COLUMNS = {
+    'users': ('userId', 'password', 'userEmail', 'displayName', 'registrationTime',
+              'lastActivityTime', 'avatarSeed', 'createdAt', 'updatedAt'),
+    'projects': ('projectId', 'projectName', 'description', 'totalStages', 'currentStage', 'createdBy',
+                 'createdTime', 'lastModified', 'createdAt', 'updatedAt', 'maxCommentSelections',
+                 'studentRankingWeight', 'teacherRankingWeight', 'commentRewardPercentile'),
+    'projectviewers': ('projectId', 'userEmail', 'role', 'assignedBy', 'assignedAt'),
+    'groups': ('groupId', 'projectId', 'groupName', 'createdBy', 'createdTime'),
+    'usergroups': ('membershipId', 'projectId', 'groupId', 'userEmail', 'role', 'joinTime', 'isActive'),
+    'stages': ('stageId', 'projectId', 'stageName', 'stageOrder', 'startTime', 'endTime', 'status',
+               'createdTime', 'updatedAt', 'reportRewardPool', 'commentRewardPool', 'finalRankings',
+               'settledTime'),
+    'submissions': ('submissionId', 'projectId', 'stageId', 'groupId', 'contentMarkdown', 'actualAuthors',
+                    'participationProposal', 'submitTime', 'submitterEmail', 'withdrawnTime', 'withdrawnBy',
+                    'approvedTime', 'updatedAt', 'createdAt'),
+    'submissionapprovalvotes': ('voteId', 'projectId', 'submissionId', 'stageId', 'groupId', 'voterEmail',
+                                'agree', 'createdTime'),
+    'rankings': ('proposalId', 'stageId', 'groupId', 'proposerUserId', 'rankingData', 'status',
+                 'createdAt', 'lastModified'),
+    'rankingproposals': ('proposalId', 'projectId', 'stageId', 'groupId', 'proposerEmail', 'rankingData',
+                         'createdTime', 'settleTime', 'withdrawnTime', 'withdrawnBy', 'resetTime'),
+    'proposalvotes': ('voteId', 'projectId', 'proposalId', 'voterEmail', 'groupId', 'agree', 'timestamp'),
+    'teachersubmissionrankings': ('teacherRankingId', 'stageId', 'projectId', 'teacherEmail', 'submissionId',
+                                  'groupId', 'rank', 'createdTime'),
+    'comments': ('commentId', 'projectId', 'stageId', 'authorEmail', 'content', 'mentionedGroups',
+                 'parentCommentId', 'isReply', 'replyLevel', 'isAwarded', 'awardRank', 'createdTime'),
+    'reactions': ('reactionId', 'projectId', 'targetType', 'targetId', 'userEmail', 'reactionType',
+                  'createdAt'),
+    'commentrankingproposals': ('proposalId', 'projectId', 'stageId', 'authorEmail', 'rankingData',
+                                'createdTime'),
+    'teachercommentrankings': ('rankingId', 'stageId', 'projectId', 'teacherEmail', 'commentId',
+                               'authorEmail', 'rank', 'createdTime'),
+    'settlementhistory': ('settlementId', 'projectId', 'stageId', 'settlementType', 'settlementTime',
+                          'operatorEmail', 'totalRewardDistributed', 'participantCount', 'status',
+                          'settlementData'),
+    'stagesettlements': ('settlementDetailId', 'projectId', 'settlementId', 'stageId', 'groupId', 'finalRank',
+                         'studentScore', 'teacherScore', 'totalScore', 'allocatedPoints', 'memberEmails',
+                         'memberPointsDistribution'),
+    'commentsettlements': ('settlementDetailId', 'projectId', 'settlementId', 'stageId', 'commentId',
+                           'authorEmail', 'finalRank', 'studentScore', 'teacherScore', 'totalScore',
+                           'allocatedPoints', 'rewardPercentage'),
+    'transactions': ('transactionId', 'projectId', 'userEmail', 'stageId', 'settlementId', 'transactionType',
+                     'amount', 'source', 'timestamp', 'relatedSubmissionId', 'relatedCommentId', 'metadata'),
+    'eventlogs': ('logId', 'projectId', 'eventType', 'userId', 'entityType', 'entityId', 'details',
+                  'timestamp'),
+    'sys_logs': ('logId', 'level', 'functionName', 'userId', 'action', 'message', 'createdAt',
+                 'projectId', 'entityType', 'entityId'),
+    'notifications': ('notificationId', 'targetUserEmail', 'type', 'title', 'projectId', 'stageId',
+                      'commentId', 'submissionId', 'groupId', 'settlementId', 'isRead', 'createdTime'),
+}
+
+# High-volume tables bind compact columns; SQLite assembles the ids and message text
+INSERT_VALUES = {
+    'reactions': "printf('rct_%s_%06d', ?1, ?2), ?3, 'comment', ?4, ?5, ?6, ?7",
+    'eventlogs': "printf('evt_%05d_%06d', ?1, ?2), ?3, ?4, ?5, 'user', ?5, NULL, ?6",
+    'sys_logs': "printf('log_%05d_%07d', ?1, ?2), ?3, ?4, ?5, ?6, "
+                "?6 || ' for ' || ?9 || ' ' || ?10 || COALESCE(' in project ' || ?8, ''), ?7, ?8, ?9, ?10",
+    'notifications': "printf('ntf_%05d_%07d', ?1, ?2), ?3, ?4, replace(?4, '_', ' '), ?5, ?6, ?7, ?8, ?9, ?10, "
+                     "?11, ?12",
+}
+
+_CREATE_INDEX = re.compile(r'CREATE\s+(UNIQUE\s+)?INDEX\b', re.IGNORECASE)
+
+
+class BulkLoader:
+    """Buffers rows per table and writes each table with executemany every `chunk_rows` rows"""
+
+    def __init__(self, conn, chunk_rows=DEFAULT_CHUNK_ROWS):
+        self.conn = conn
+        self.chunk_rows = chunk_rows
+        self.buffers = {table: [] for table in INSERT_COLUMNS}
+        self.counts = dict.fromkeys(INSERT_COLUMNS, 0)
+        self.statements = {
+            table: f"INSERT INTO {table} ({', '.join(columns)}) "
+                   f"VALUES ({INSERT_VALUES.get(table) or ', '.join('?' * len(columns))})"
+            for table, columns in INSERT_COLUMNS.items()
+        }
+
+    def add(self, table, rows):
+        buffer = self.buffers[table]
+        buffer.extend(rows)
+        if len(buffer) >= self.chunk_rows:
+            self.flush(table)
+
+    def flush(self, table=None):
+        for name in [table] if table else list(self.buffers):
+            buffer = self.buffers[name]
+            if buffer:
+                self.conn.executemany(self.statements[name], buffer)
+                self.counts[name] += len(buffer)
+                buffer.clear()
+
+
+def create_schema(conn, schema_path=SCHEMA_PATH):
+    """Run schema.sql except its CREATE INDEX statements; returns those for after the load"""
+    deferred = []
+    for statement in split_statements(Path(schema_path).read_text(encoding='utf-8')):
+        body = '\n'.join(line for line in statement.splitlines() if not line.lstrip().startswith('--'))
+        if _CREATE_INDEX.match(body.lstrip()):
+            deferred.append(statement)
+        else:
+            conn.execute(statement)
+    return deferred
+
+
+def split_shares(rng, count):
+    """`count` participation shares rounded to cents that sum to exactly 1"""
+    shares = np.round(rng.dirichlet(np.full(count, 4.0)), 2)
+    shares[-1] = round(1 - shares[:-1].sum(), 2)
+    return [float(share) for share in shares]
+
+
+def noisy_order(rng, quality, rows, noise=1.0):
+    """Per row, item columns best-first by quality plus Gaussian noise"""
+    return np.argsort(-(quality + rng.normal(scale=noise, size=(rows, len(quality)))), axis=1)
+
+
+def generate_project(loader, shape, p, seed=0):
+    """Generate every row of project `p` into the loader"""
+    rng = np.random.default_rng((seed, p))
+    project_id = f'proj_{p:05d}'
+    project_start = BASE_TIME + p * HOUR_MS
+    project_end = project_start + shape.stages * STAGE_MS
+
+    n_students = shape.groups * shape.members
+    first = p * n_students
+    emails = [f'student{first + i}@example.com' for i in range(n_students)]
+    user_ids = [f'usr_{first + i:07d}' for i in range(n_students)]
+    teacher_emails = [f'teacher{p}_{t}@example.com' for t in range(shape.teachers)]
+    teacher_ids = [f'usr_t{p:05d}_{t}' for t in range(shape.teachers)]
+    owner = teacher_emails[0] if teacher_emails else emails[0]
+    group_ids = [f'grp_{p:05d}_{g:03d}' for g in range(shape.groups)]
+    group_names = [f'Team {g + 1}' for g in range(shape.groups)]
+    group_of = [i // shape.members for i in range(n_students)]
+    group_members = [list(range(g * shape.members, (g + 1) * shape.members)) for g in range(shape.groups)]
+
+    last_active = project_start + rng.integers(0, shape.stages * STAGE_MS, size=n_students)
+    loader.add('users', [
+        (user_id, 'x', email, f'Student {first + i}', project_start, int(last_active[i]), user_id,
+         project_start, project_start)
+        for i, (user_id, email) in enumerate(zip(user_ids, emails))
+    ])
+    loader.add('users', [
+        (user_id, 'x', email, f'Teacher {p}-{t}', project_start, project_end, user_id, project_start, project_start)
+        for t, (user_id, email) in enumerate(zip(teacher_ids, teacher_emails))
+    ])
+
+    student_weight, teacher_weight = WEIGHT_CHOICES[rng.integers(len(WEIGHT_CHOICES))]
+    project = {
+        'projectId': project_id,
+        'maxCommentSelections': MAX_COMMENT_CHOICES[rng.integers(len(MAX_COMMENT_CHOICES))],
+        'studentRankingWeight': student_weight,
+        'teacherRankingWeight': teacher_weight,
+        'commentRewardPercentile': PERCENTILE_CHOICES[rng.integers(len(PERCENTILE_CHOICES))],
+    }
+    config = effective_scoring_config(project)
+    loader.add('projects', [(
+        project_id, f'Course Project {p}', f'Synthetic project {p}', shape.stages, shape.stages, owner,
+        project_start, project_start, project_start, project_start, project['maxCommentSelections'],
+        student_weight, teacher_weight, project['commentRewardPercentile'],
+    )])
+    loader.add('projectviewers', [
+        (project_id, email, 'teacher', owner, project_start) for email in teacher_emails
+    ])
+    loader.add('groups', [
+        (group_id, project_id, name, owner, project_start) for group_id, name in zip(group_ids, group_names)
+    ])
+
+    # Students that changed group keep an inactive membership in their first one
+    memberships = []
+    moved = rng.random(n_students) < shape.churn
+    for i, email in enumerate(emails):
+        g = group_of[i]
+        if moved[i] and shape.groups > 1:
+            memberships.append((project_id, group_ids[(g + 1) % shape.groups], email, 'member', project_start, 0))
+        role = 'leader' if i == group_members[g][0] else 'member'
+        memberships.append((project_id, group_ids[g], email, role, project_start + (DAY_MS if moved[i] else 0), 1))
+    loader.add('usergroups', [
+        (f'mem_{p:05d}_{m:05d}', *membership) for m, membership in enumerate(memberships)
+    ])
+
+    for k in range(shape.stages):
+        generate_stage(loader, shape, rng, p, k, project_start, config, {
+            'projectId': project_id, 'emails': emails, 'userIds': user_ids, 'teacherEmails': teacher_emails,
+            'groupIds': group_ids, 'groupNames': group_names, 'groupOf': group_of,
+            'groupMembers': group_members, 'owner': owner,
+        })
+
+    generate_logs(loader, shape, rng, p, project_id, project_start, project_end,
+                  user_ids, group_ids, n_students)
+    generate_notifications(loader, shape, rng, p, project_id, project_start, project_end,
+                           emails, group_ids, group_of)
+
+
+def generate_stage(loader, shape, rng, p, k, project_start, config, ctx):
+    """Stage row, submissions, comments and (past the active phase) ballots and settlement"""
+    project_id = ctx['projectId']
+    emails, group_ids = ctx['emails'], ctx['groupIds']
+    n_students, n_groups = len(emails), len(group_ids)
+    stage_id = f'stg_{p:05d}_{k:02d}'
+    start = project_start + k * STAGE_MS
+    phase = 'completed' if k < shape.stages - 2 else 'voting' if k == shape.stages - 2 else 'active'
+    end = OPEN_END_TIME if phase == 'active' else start + 5 * DAY_MS
+    settle_time = start + STAGE_MS - HOUR_MS
+    report_pool = REPORT_POOLS[rng.integers(len(REPORT_POOLS))]
+    comment_pool = COMMENT_POOLS[rng.integers(len(COMMENT_POOLS))]
+    prefix = f'{p:05d}_{k:02d}'
+
+    # Submissions: a version chain per group, earlier versions withdrawn, the latest approved
+    latest_submission = {}
+    participation = {}
+    submissions, approvals = [], []
+    for g, group_id in enumerate(group_ids):
+        members = [emails[i] for i in ctx['groupMembers'][g]]
+        versions = int(rng.integers(1, shape.versions + 1))
+        times = np.sort(start + rng.integers(HOUR_MS, 4 * DAY_MS, size=versions))
+        for v in range(versions):
+            submission_id = f'sub_{prefix}_{g:03d}_{v}'
+            submit_time = int(times[v]) + v
+            latest = v == versions - 1
+            shares = dict(zip(members, split_shares(rng, len(members))))
+            approved = latest and (phase != 'active' or rng.random() < 0.5)
+            withdrawn_time = None if latest else int(times[v + 1]) + v
+            submissions.append((
+                submission_id, project_id, stage_id, group_id, f'# {ctx["groupNames"][g]} report, draft {v + 1}',
+                json.dumps(members), json.dumps(shares), submit_time, members[0],
+                withdrawn_time, None if latest else members[0],
+                submit_time + HOUR_MS if approved else None, submit_time, submit_time,
+            ))
+            for m, voter in enumerate(members):
+                if approved or rng.random() < 0.8:
+                    approvals.append((f'sav_{prefix}_{g:03d}_{v}_{m:03d}', project_id, submission_id, stage_id,
+                                      group_id, voter, 1 if approved or rng.random() < 0.5 else 0,
+                                      submit_time + 1 + m))
+            if latest:
+                latest_submission[group_id] = submission_id
+                participation[group_id] = shares
+    loader.add('submissions', submissions)
+    loader.add('submissionapprovalvotes', approvals)
+
+    comments, comment_quality, helpful = generate_comments(loader, shape, rng, ctx, stage_id, prefix,
+                                                           start, start + 5 * DAY_MS)
+
+    stage_row = [stage_id, project_id, f'Stage {k + 1}', k + 1, start, end, phase, project_start,
+                 start, report_pool, comment_pool, None, None]
+    if phase == 'active':
+        loader.add('stages', [tuple(stage_row)])
+        loader.add('comments', [tuple(comment) for comment in comments])
+        return
+
+    group_quality = rng.normal(size=n_groups)
+    ballot_times = end + rng.integers(0, DAY_MS, size=n_students)
+
+    # Student ballots in `rankings`: every group but the voter's own, best first
+    orders = noisy_order(rng, group_quality, n_students)
+    ballots = []
+    for i in range(n_students):
+        own = ctx['groupOf'][i]
+        ballots.append({group_ids[g]: rank for rank, g in enumerate((g for g in orders[i] if g != own), 1)})
+    resubmitted = rng.random(n_students) < 0.15
+    loader.add('rankings', [
+        (f'rnk_{prefix}_{i:04d}', stage_id, group_ids[ctx['groupOf'][i]], ctx['userIds'][i],
+         json.dumps(ballot), 'submitted', int(ballot_times[i]),
+         int(ballot_times[i]) + (HOUR_MS if resubmitted[i] else 0))
+        for i, ballot in enumerate(ballots)
+    ])
+
+    # Group proposals: earlier versions withdrawn or reset, the latest agreed (and settled)
+    agreed_ballots = []
+    proposals, votes = [], []
+    for g, group_id in enumerate(group_ids):
+        member_ids = ctx['groupMembers'][g]
+        versions = int(rng.integers(1, shape.versions + 1))
+        times = np.sort(end + rng.integers(DAY_MS // 2, DAY_MS + DAY_MS // 2, size=versions))
+        for v in range(versions):
+            proposal_id = f'rpp_{prefix}_{g:03d}_{v}'
+            created = int(times[v]) + v
+            proposer = member_ids[int(rng.integers(len(member_ids)))]
+            latest = v == versions - 1
+            closed = None if latest else int(times[v + 1]) + v
+            withdrawn = closed if closed is not None and v % 2 == 0 else None
+            reset = closed if closed is not None and v % 2 == 1 else None
+            proposals.append((
+                proposal_id, project_id, stage_id, group_id, emails[proposer], json.dumps(ballots[proposer]),
+                created, settle_time if latest and phase == 'completed' else None,
+                withdrawn, emails[proposer] if withdrawn else None, reset,
+            ))
+            agree = np.where(rng.random(len(member_ids)) < PROPOSAL_AGREE_RATE, 1, -1)
+            agree[member_ids.index(proposer)] = 1
+            if latest:
+                if (agree == 1).sum() <= (agree == -1).sum():
+                    agree[:] = 1
+                agreed_ballots.append(ballots[proposer])
+            votes.extend(
+                (f'pvt_{prefix}_{g:03d}_{v}_{m:03d}', project_id, proposal_id, emails[member], group_id,
+                 int(agree[m]), created + 1 + m)
+                for m, member in enumerate(member_ids)
+            )
+    loader.add('rankingproposals', proposals)
+    loader.add('proposalvotes', votes)
+
+    teacher_orders = noisy_order(rng, group_quality, len(ctx['teacherEmails']), noise=0.5)
+    teacher_ballots = {}
+    teacher_rows = []
+    for t, teacher in enumerate(ctx['teacherEmails']):
+        teacher_ballots[teacher] = {group_ids[g]: rank for rank, g in enumerate(teacher_orders[t], 1)}
+        created = end + DAY_MS + t
+        teacher_rows.extend(
+            (f'tsr_{prefix}_{t}_{g:03d}', stage_id, project_id, teacher, latest_submission[group_ids[g]],
+             group_ids[g], rank, created)
+            for rank, g in enumerate(teacher_orders[t], 1)
+        )
+    loader.add('teachersubmissionrankings', teacher_rows)
+
+    comment_student, comment_teacher = generate_comment_rankings(
+        loader, rng, ctx, config, stage_id, prefix, end, comments, comment_quality)
+
+    if phase == 'completed':
+        stage_row[11], stage_row[12] = settle_stage(
+            loader, rng, ctx, config, stage_id, prefix, settle_time, report_pool, comment_pool,
+            teacher_ballots, agreed_ballots, participation, latest_submission,
+            comments, helpful, comment_student, comment_teacher)
+    loader.add('stages', [tuple(stage_row)])
+    loader.add('comments', [tuple(comment) for comment in comments])
+
+
+def generate_comments(loader, shape, rng, ctx, stage_id, prefix, start, stop):
+    """Comments (rows kept mutable for award flags) and reactions
+
+    Returns (comment rows, quality per comment, ids of comments with a helpful reaction).
+    """
+    project_id, emails, group_ids = ctx['projectId'], ctx['emails'], ctx['groupIds']
+    n_students = len(emails)
+    counts = rng.poisson(shape.comments, size=n_students)
+    authors = np.repeat(np.arange(n_students), counts)
+    rng.shuffle(authors)
+    times = np.sort(start + rng.integers(0, stop - start, size=len(authors)))
+    quality = rng.normal(size=len(authors))
+    replies = rng.random(len(authors)) < REPLY_RATE
+    mentions = rng.integers(0, len(group_ids), size=len(authors))
+
+    comments, top_level = [], []
+    for c, author in enumerate(authors.tolist()):
+        comment_id = f'cmt_{prefix}_{c:05d}'
+        created = int(times[c]) + c
+        if replies[c] and top_level:
+            parent = top_level[int(rng.integers(len(top_level)))]
+            comments.append([comment_id, project_id, stage_id, emails[author], f'Reply {c} on {parent}',
+                             None, parent, 1, 1, 0, None, created])
+        else:
+            top_level.append(comment_id)
+            mentioned = group_ids[int(mentions[c])]
+            comments.append([comment_id, project_id, stage_id, emails[author], f'Feedback {c} for {mentioned}',
+                             json.dumps([mentioned]), None, 0, 0, 0, None, created])
+
+    # Reactions: distinct users per comment, taken as a run of consecutive students
+    reaction_counts = np.minimum(rng.poisson(shape.reactions, size=len(comments)), n_students)
+    total = int(reaction_counts.sum())
+    targets = np.repeat(np.arange(len(comments)), reaction_counts)
+    offsets = np.arange(total) - np.repeat(np.cumsum(reaction_counts) - reaction_counts, reaction_counts)
+    users = (np.repeat(rng.integers(0, n_students, size=len(comments)), reaction_counts) + offsets) % max(n_students, 1)
+    helpful = rng.random(total) < HELPFUL_RATE
+    comment_ids = np.array([comment[0] for comment in comments], dtype=object)
+    comment_times = np.array([comment[11] for comment in comments], dtype=np.int64)
+    loader.add('reactions', zip(
+        repeat(prefix), range(total), repeat(project_id), comment_ids[targets].tolist(),
+        np.array(emails, dtype=object)[users].tolist(),
+        np.where(helpful, 'helpful', 'disagreed').astype(object).tolist(),
+        (comment_times[targets] + rng.integers(1, HOUR_MS, size=total)).tolist(),
+    ))
+    return comments, quality, set(comment_ids[targets[helpful]].tolist())
+
+
+def generate_comment_rankings(loader, rng, ctx, config, stage_id, prefix, end, comments, quality):
+    """Student comment ranking proposals and teacher comment rankings over top-level comments"""
+    project_id, emails = ctx['projectId'], ctx['emails']
+    limit = config['maxCommentSelections']
+    candidates = [c for c, comment in enumerate(comments) if not comment[7]]
+    student_ballots, teacher_ballots = {}, {}
+    if not candidates:
+        return [], teacher_ballots
+
+    candidate_quality = quality[candidates]
+    orders = noisy_order(rng, candidate_quality, len(emails))
+    rows = []
+    for i, email in enumerate(emails):
+        if rng.random() >= 0.9:
+            continue
+        picked = list(islice((candidates[j] for j in orders[i] if comments[candidates[j]][3] != email), limit))
+        if not picked:
+            continue
+        ballot = {comments[c][0]: rank for rank, c in enumerate(picked, 1)}
+        student_ballots[email] = ballot
+        rows.append((f'crp_{prefix}_{i:04d}', project_id, stage_id, email, json.dumps(ballot),
+                     end + DAY_MS + i))
+    loader.add('commentrankingproposals', rows)
+
+    teacher_orders = noisy_order(rng, candidate_quality, len(ctx['teacherEmails']), noise=0.5)
+    rows = []
+    for t, teacher in enumerate(ctx['teacherEmails']):
+        picked = [candidates[j] for j in teacher_orders[t][:limit]]
+        teacher_ballots[teacher] = {comments[c][0]: rank for rank, c in enumerate(picked, 1)}
+        rows.extend(
+            (f'tcr_{prefix}_{t}_{rank:03d}', stage_id, project_id, teacher, comments[c][0], comments[c][3],
+             rank, end + DAY_MS + t)
+            for rank, c in enumerate(picked, 1)
+        )
+    loader.add('teachercommentrankings', rows)
+    # Settlement reads ballots partitioned by authorEmail / ordered by teacherEmail,
+    # and that order decides which exact tie gets the remainder point
+    return ([student_ballots[email] for email in sorted(student_ballots)],
+            {teacher: teacher_ballots[teacher] for teacher in sorted(teacher_ballots)})
+
+
+def settle_stage(loader, rng, ctx, config, stage_id, prefix, settle_time, report_pool, comment_pool,
+                 teacher_ballots, agreed_ballots, participation, latest_submission,
+                 comments, helpful, comment_student, comment_teacher):
+    """Score the stage as the backend would and write its settlement rows; returns (finalRankings, settledTime)"""
+    project_id, owner = ctx['projectId'], ctx['owner']
+    settlement_id = f'stl_{prefix}'
+    group_names = dict(zip(ctx['groupIds'], ctx['groupNames']))
+    records = score_ballots((teacher_ballots[teacher] for teacher in sorted(teacher_ballots)),
+                            agreed_ballots, report_pool, config)
+
+    details, transactions = [], []
+    for group_id, rank in records['rankings'].items():
+        allocated = records['scores'][group_id]
+        shares = participation[group_id]
+        distribution = {email: round(allocated * share, 2) for email, share in shares.items() if share > 0}
+        detail_id = f'sts_{prefix}_{group_id[-3:]}'
+        details.append((
+            detail_id, project_id, settlement_id, stage_id, group_id, rank,
+            records['studentScores'][group_id], records['teacherScores'][group_id],
+            records['weightedScores'][group_id], allocated, json.dumps(list(distribution)),
+            json.dumps(distribution),
+        ))
+        for email, points in distribution.items():
+            transactions.append((
+                f'txn_{prefix}_{len(transactions):05d}', project_id, email, stage_id, settlement_id,
+                'stage_settlement', math.ceil(points),
+                f'階段結算獎勵 - {group_names[group_id]} (參與度 {round(shares[email] * 100)}%)',
+                settle_time, latest_submission[group_id], None,
+                json.dumps({'groupId': group_id, 'groupName': group_names[group_id], 'rank': rank,
+                            'participationPercentage': shares[email], 'settlementDetailId': detail_id,
+                            'originalAmount': points}),
+            ))
+    participants = len(transactions)
+
+    # Comment rewards: top-level comments with a mention and a helpful reaction count as authors
+    unique_authors = len({comment[3] for comment in comments if not comment[7] and comment[0] in helpful})
+    top_n = calculate_comment_reward_limit(unique_authors, config['commentRewardPercentile'],
+                                           config['maxCommentSelections'])
+    comment_rows = []
+    if comment_pool > 0 and (comment_student or comment_teacher):
+        by_id = {comment[0]: comment for comment in comments}
+        comment_records = score_ballots(comment_teacher.values(), comment_student, comment_pool, config, top_n)
+        for comment_id, points in comment_records['scores'].items():
+            if points <= 0:
+                continue
+            comment, rank = by_id[comment_id], comment_records['rankings'][comment_id]
+            comment[9], comment[10] = 1, rank
+            detail_id = f'cms_{prefix}_{comment_id[-5:]}'
+            comment_rows.append((
+                detail_id, project_id, settlement_id, stage_id, comment_id, comment[3], rank,
+                comment_records['studentScores'][comment_id], comment_records['teacherScores'][comment_id],
+                comment_records['weightedScores'][comment_id], points, points / comment_pool,
+            ))
+            transactions.append((
+                f'txn_{prefix}_{len(transactions):05d}', project_id, comment[3], stage_id, settlement_id,
+                'comment_settlement', math.ceil(points), f'評論獎勵 - 第{rank}名: "{comment[4][:30]}..."',
+                settle_time, None, comment_id,
+                json.dumps({'commentId': comment_id, 'rank': rank, 'contentPreview': comment[4][:30],
+                            'settlementDetailId': detail_id, 'originalAmount': points}),
+            ))
+
+    loader.add('settlementhistory', [(
+        settlement_id, project_id, stage_id, 'stage', settle_time, owner, sum(records['scores'].values()),
+        participants, 'active', json.dumps({'rankings': records['rankings'], 'voteCount': len(agreed_ballots)}),
+    )])
+    loader.add('stagesettlements', details)
+    loader.add('commentsettlements', comment_rows)
+    loader.add('transactions', transactions)
+    return json.dumps(records['rankings']), settle_time
+
+
+def generate_logs(loader, shape, rng, p, project_id, start, stop, user_ids, group_ids, n_students):
+    """eventlogs and sys_logs rows, drawn column-wise (no per-row Python)"""
+    users = np.array(user_ids, dtype=object)
+
+    count = n_students * shape.event_logs
+    loader.add('eventlogs', zip(
+        repeat(p), range(count), repeat(project_id),
+        np.array(EVENT_TYPES, dtype=object)[rng.choice(len(EVENT_TYPES), size=count, p=EVENT_WEIGHTS)].tolist(),
+        users[rng.integers(0, n_students, size=count)].tolist(),
+        np.sort(rng.integers(start, stop, size=count)).tolist(),
+    ))
+
+    # Entities a log line can point at, per entityType
+    stage_ids = [f'stg_{p:05d}_{k:02d}' for k in range(shape.stages)]
+    entity_pools = {
+        'submission': [f'sub_{p:05d}_{k:02d}_{g:03d}_0' for k in range(shape.stages) for g in range(len(group_ids))],
+        'stage': stage_ids,
+        'comment': [f'cmt_{p:05d}_{k:02d}_{c:05d}' for k in range(shape.stages)
+                    for c in range(max(1, int(n_students * shape.comments)))],
+        'project': [project_id],
+    }
+
+    count = n_students * shape.sys_logs
+    operations = rng.choice(len(SYS_LOG_OPERATIONS), size=count, p=SYS_LOG_WEIGHTS)
+    actors = users[rng.integers(0, n_students, size=count)]
+    entity_types = np.array([operation[2] for operation in SYS_LOG_OPERATIONS], dtype=object)[operations]
+    entity_ids = actors.copy()
+    projects = np.full(count, project_id, dtype=object)
+    for entity_type, pool in entity_pools.items():
+        mask = entity_types == entity_type
+        entity_ids[mask] = np.array(pool, dtype=object)[rng.integers(0, len(pool), size=int(mask.sum()))]
+    projects[entity_types == 'user'] = None
+    loader.add('sys_logs', zip(
+        repeat(p), range(count),
+        np.array(SYS_LOG_LEVELS, dtype=object)[
+            rng.choice(len(SYS_LOG_LEVELS), size=count, p=SYS_LOG_LEVEL_WEIGHTS)].tolist(),
+        np.array([operation[0] for operation in SYS_LOG_OPERATIONS], dtype=object)[operations].tolist(),
+        actors.tolist(),
+        np.array([operation[1] for operation in SYS_LOG_OPERATIONS], dtype=object)[operations].tolist(),
+        np.sort(rng.integers(start, stop, size=count)).tolist(),
+        projects.tolist(), entity_types.tolist(), entity_ids.tolist(),
+    ))
+
+
+def generate_notifications(loader, shape, rng, p, project_id, start, stop, emails, group_ids, group_of):
+    """notifications rows with the entity columns their type fills, drawn column-wise"""
+    count = len(emails) * shape.notifications
+    if not count:
+        return
+    recipients = rng.integers(0, len(emails), size=count)
+    stages = rng.integers(0, shape.stages, size=count)
+    kinds = rng.choice(len(NOTIFICATION_KINDS), size=count, p=NOTIFICATION_WEIGHTS)
+    entities = np.array([kind[1] for kind in NOTIFICATION_KINDS], dtype=object)[kinds]
+    groups = np.array(group_of)[recipients]
+    n_comments = max(1, int(len(emails) * shape.comments))
+    comments = rng.integers(0, n_comments, size=count)
+
+    # Id pools indexed by stage (and group / comment slot); only settled stages have a settlement
+    stage_pool = np.array([f'stg_{p:05d}_{k:02d}' for k in range(shape.stages)], dtype=object)
+    submission_pool = np.array([[f'sub_{p:05d}_{k:02d}_{g:03d}_0' for g in range(len(group_ids))]
+                                for k in range(shape.stages)], dtype=object)
+    comment_pool = np.array([[f'cmt_{p:05d}_{k:02d}_{c:05d}' for c in range(n_comments)]
+                             for k in range(shape.stages)], dtype=object)
+    settlement_pool = np.array([f'stl_{p:05d}_{k:02d}' if k < shape.stages - 2 else None
+                                for k in range(shape.stages)], dtype=object)
+
+    def entity_column(pool, *entity_types):
+        column = np.full(count, None, dtype=object)
+        mask = np.isin(entities, entity_types)
+        column[mask] = pool[mask]
+        return column.tolist()
+
+    loader.add('notifications', zip(
+        repeat(p), range(count),
+        np.array(emails, dtype=object)[recipients].tolist(),
+        np.array([kind[0] for kind in NOTIFICATION_KINDS], dtype=object)[kinds].tolist(),
+        repeat(project_id),
+        entity_column(stage_pool[stages], 'submission', 'comment', 'stage', 'settlement'),
+        entity_column(comment_pool[stages, comments], 'comment'),
+        entity_column(submission_pool[stages, groups], 'submission'),
+        entity_column(np.array(group_ids, dtype=object)[groups], 'submission', 'group'),
+        entity_column(settlement_pool[stages], 'settlement'),
+        (rng.random(count) < NOTIFICATION_READ_RATE).astype(int).tolist(),
+        np.sort(rng.integers(start, stop, size=count)).tolist(),
+    ))
+
+
+def build_dataset(path, shape, seed=0, chunk_rows=DEFAULT_CHUNK_ROWS):
+    """Create `path` from schema.sql and load `shape`; returns ({table: rows}, {step: seconds})"""
+    Path(path).unlink(missing_ok=True)
+    conn = sqlite3.connect(path, isolation_level=None)
+    timings = {}
+    try:
+        conn.execute("PRAGMA journal_mode = OFF")
+        conn.execute("PRAGMA synchronous = OFF")
+        conn.execute("PRAGMA locking_mode = EXCLUSIVE")
+        conn.execute("PRAGMA temp_store = MEMORY")
+        conn.execute("PRAGMA cache_size = -262144")
+        deferred_indexes = create_schema(conn)
+
+        started = time.perf_counter()
+        loader = BulkLoader(conn, chunk_rows)
+        conn.execute("BEGIN")
+        for p in range(shape.projects):
+            generate_project(loader, shape, p, seed)
+        loader.flush()
+        conn.execute("COMMIT")
+        timings['load'] = time.perf_counter() - started
+
+        started = time.perf_counter()
+        conn.execute("BEGIN")
+        for statement in deferred_indexes:
+            conn.execute(statement)
+        conn.execute("COMMIT")
+        timings['indexes'] = time.perf_counter() - started
+
+        conn.execute("PRAGMA locking_mode = NORMAL")
+        conn.execute("PRAGMA journal_mode = DELETE")
+    finally:
+        conn.close()
+    return loader.counts, timings
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Generate a seeded synthetic D1 database from database/schema.sql",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument('--output', required=True, help='SQLite file to (re)create')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed')
+    parser.add_argument('--chunk-rows', type=int, default=DEFAULT_CHUNK_ROWS,
+                        help='Rows per executemany batch')
+    for field in DatasetShape._fields:
+        default = getattr(DEFAULT_SHAPE, field)
+        parser.add_argument(f"--{field.replace('_', '-')}", type=type(default), default=default,
+                            help=f'Dataset shape: {field}')
+    args = parser.parse_args()
+    shape = DatasetShape(**{field: getattr(args, field) for field in DatasetShape._fields})
+    if shape.stages < 1 or shape.groups < 2 or shape.members < 1:
+        parser.error('need at least 1 stage, 2 groups and 1 member per group')
+
+    print("=" * 80)
+    print("🏗️  Synthetic D1 Dataset")
+    print("=" * 80)
+    print(f"📁 {args.output}: {shape.projects} projects × {shape.groups} groups × {shape.members} members, "
+          f"{shape.stages} stages, seed {args.seed}")
+
+    counts, timings = build_dataset(args.output, shape, args.seed, args.chunk_rows)
+
+    total = sum(counts.values())
+    print()
+    for table, rows in sorted(counts.items(), key=lambda item: -item[1]):
+        print(f"  {table:<28} {rows:>12,}")
+    print(f"  {'total':<28} {total:>12,}")
+    print()
+    seconds = timings['load'] + timings['indexes']
+    print(f"✅ Loaded {total:,} rows in {timings['load']:.1f}s, indexes in {timings['indexes']:.1f}s "
+          f"({total / seconds:,.0f} rows/s, {Path(args.output).stat().st_size / 2**20:,.0f} MiB)")
+
+
+if __name__ == "__main__":
+    main()
@@ -5,37 +5,177 @@ Settlement Implementation Test Script
 This script analyzes the Cloudflare Workers D1 database to:
 1. Verify database schema matches expectations
 2. Query test data for settlement simulation
-3. Simulate settlement calculations
-4. Test SQL queries for correctness
-5. Generate detailed report
+3. Simulate settlement calculations (NumPy engine in settlement_engine.py)
+4. Simulate comment settlement (eligibility indexes in comment_settlement.py)
+5. Test SQL queries for correctness and warm/cold latency (query_latency.py)
+6. Generate detailed report
 
 Usage:
     python test_settlement.py
+    python test_settlement.py --batch [--workers N]   # replay every project/stage from agreed proposals
+    python test_settlement.py --batch-size 5000       # rankings rows per fetchmany()
+    python test_settlement.py --verify                # diff stored settlements vs replay
+    python test_settlement.py --db export.sqlite --immutable --mmap-size 4294967296
+    SETTLEMENT_DB_PATH=export.sqlite python test_settlement.py --in-memory
+    python test_settlement.py --batch --quiet --report replay.ndjson
+    python test_settlement.py --ledger --ledger-checkpoint ledger.json   # balances + reconciliation
+    python test_settlement.py --stability --replicates 5000 --weight-jitter 0.1   # rank stability
+    python test_settlement.py --watch --poll-interval 0.05   # live projection as votes land
+    python test_settlement.py --query-plans --query-runs 5   # EXPLAIN QUERY PLAN audit of handler SQL
+    python test_settlement.py --latency --latency-output latency.json   # warm/cold p50/p95/p99 per query
+    python test_settlement.py --latency --latency-baseline latency.json # flag p50 regressions
+
+Requires: numpy
 """
 
-import sqlite3
+import argparse
 import json
+import os
+import sqlite3
 import sys
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from datetime import datetime
+from itertools import groupby
+from operator import itemgetter
 from pathlib import Path
-from collections import defaultdict
 
-# Database path (wrangler D1 miniflare database)
+from query_latency import (
+    DEFAULT_LATENCY_RUNS,
+    DEFAULT_REGRESSION_THRESHOLD,
+    MODES as LATENCY_MODES,
+    REGRESSION_STAT,
+    SQL_CHECKS,
+    compare_to_baseline,
+    latency_document,
+    measure_query,
+    measure_registry,
+    table_sizes,
+)
+from query_plan_audit import DEFAULT_RUNS, audit_registry, median_ms
+from rank_stability import RESAMPLE_METHODS, analyze_stability, summarize_stability
+from comment_settlement import ProjectMembership, simulate_comment_stage
+from settlement_distribution import distribute_member_points, load_latest_submissions
+from schema_audit import SCHEMA_DIR, audit_schema
+from settlement_engine import (
+    BallotStore,
+    ItemIndex,
+    MAX_SQL_PARAMS,
+    RankAccumulator,
+    aggregate_teacher_rankings,
+    build_rank_matrix,
+    calculate_scores_from_accumulators,
+    effective_scoring_config,
+    result_to_dicts,
+)
+from settlement_ledger import WalletLedger, reconcile_settlements
+from settlement_report import NDJSONReportWriter
+from settlement_verify import POINTS_TOLERANCE, SCORE_TOLERANCE, SettlementVerifier, load_stage_ballots
+from settlement_watch import DEFAULT_POLL_INTERVAL, RankingsWatcher
+
+# Database path (wrangler D1 miniflare database); override with --db or SETTLEMENT_DB_PATH
 DB_PATH = Path(__file__).parent / "Cloudflare-Workers/.wrangler/state/v3/d1/miniflare-D1DatabaseObject/9df28f04f05382502329e45f8b5feac5bbb6f3790e2007def3f0e4e7a73a6de9.sqlite"
+DB_PATH_ENV = 'SETTLEMENT_DB_PATH'
+
+
+# Rows per fetchmany() when streaming rankings
+DEFAULT_BATCH_SIZE = 1000
+
+# Stage statuses (from stages_with_status) that batch replay will simulate
+SETTLEABLE_STATUSES = ('voting', 'settling', 'completed')
+
+# Teacher ranking tables and the item column each one ranks
+TEACHER_RANKING_TABLES = {
+    'teachersubmissionrankings': 'groupId',
+    'teachercommentrankings': 'commentId',
+}
+
+GroupMember = namedtuple('GroupMember', ['userEmail', 'displayName', 'role'])
+
+# How the tester opens the database. The tester only reads, so connections are
+# read-only by default; `immutable` additionally skips locking and change
+# detection (only safe on a snapshot nobody is writing). `mmap_size` is in
+# bytes, `cache_size` follows PRAGMA cache_size (negative = KiB), and
+# `in_memory` copies the whole file into :memory: with the backup API first.
+DatabaseOptions = namedtuple(
+    'DatabaseOptions', ['read_only', 'immutable', 'mmap_size', 'cache_size', 'in_memory'],
+    defaults=(True, False, None, None, False)
+)
+
+
+def resolve_db_path(cli_path=None):
+    """Database path from --db, then SETTLEMENT_DB_PATH, then the default miniflare file"""
+    return Path(cli_path or os.environ.get(DB_PATH_ENV) or DB_PATH)
+
+
+def open_connection(db_path, read_only=False, options=None):
+    """Open a SQLite connection with sqlite3.Row rows
+
+    Read-only connections go through a file: URI (mode=ro, plus immutable=1
+    when requested) so they never take write locks against a running
+    `wrangler dev`.
+    """
+    options = options or DatabaseOptions(read_only=read_only)
+    if options.read_only or options.immutable:
+        query = 'mode=ro&immutable=1' if options.immutable else 'mode=ro'
+        conn = sqlite3.connect(f"{Path(db_path).resolve().as_uri()}?{query}", uri=True)
+    else:
+        conn = sqlite3.connect(db_path)
+
+    if options.in_memory:
+        memory = sqlite3.connect(':memory:')
+        conn.backup(memory)
+        conn.close()
+        conn = memory
+
+    if options.mmap_size is not None and not options.in_memory:
+        conn.execute(f"PRAGMA mmap_size = {int(options.mmap_size)}")
+    if options.cache_size is not None:
+        conn.execute(f"PRAGMA cache_size = {int(options.cache_size)}")
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+def _replay_project_worker(db_path, project_id, options=None):
+    """Process pool task: replay one project on its own read-only connection"""
+    options = (options or DatabaseOptions())._replace(read_only=True, in_memory=False)
+    tester = SettlementTester(db_path, db_options=options)
+    tester.conn = open_connection(db_path, options=options)
+    try:
+        stages = tester.replay_project(project_id)
+    finally:
+        tester.conn.close()
+    return project_id, stages, tester.issues, tester.warnings
+
 
 class SettlementTester:
-    def __init__(self, db_path):
+    def __init__(self, db_path, batch_size=DEFAULT_BATCH_SIZE, db_options=None, quiet=False, report=None):
         self.db_path = db_path
+        self.batch_size = batch_size
+        self.db_options = db_options or DatabaseOptions()
+        self.quiet = quiet
+        self.report = report
         self.conn = None
         self.issues = []
         self.warnings = []
 
+    def record(self, record_type, **fields):
+        """Stream one NDJSON record when a report writer is attached"""
+        if self.report is not None:
+            self.report.write(record_type, **fields)
+
     def connect(self):
         """Connect to SQLite database"""
         try:
-            self.conn = sqlite3.connect(self.db_path)
-            self.conn.row_factory = sqlite3.Row
-            print(f"✅ Connected to database: {self.db_path}")
+            started = time.perf_counter()
+            self.conn = open_connection(self.db_path, options=self.db_options)
+            mode = 'read-only' if self.db_options.read_only or self.db_options.immutable else 'read-write'
+            if self.db_options.immutable:
+                mode += ', immutable'
+            if self.db_options.in_memory:
+                mode += f', copied to :memory: in {time.perf_counter() - started:.2f}s'
+            print(f"✅ Connected to database: {self.db_path} ({mode})")
             return True
         except Exception as e:
             print(f"❌ Failed to connect to database: {e}")
@@ -108,8 +248,46 @@ class SettlementTester:
             if col not in txn_columns:
                 self.issues.append(f"Missing column in transactions table: {col}")
 
-    def query_test_data(self):
-        """Query test data from database"""
+    def audit_schema_catalog(self, schema_dir=SCHEMA_DIR):
+        """Diff the live tables, columns, idx_* indexes and views against schema.sql + migrations"""
+        print("\n" + "="*80)
+        print("🗂️  SCHEMA & INDEX AUDIT")
+        print("="*80)
+
+        if not (Path(schema_dir) / 'schema.sql').exists():
+            print(f"  ⚠️  {Path(schema_dir) / 'schema.sql'} not found, skipping audit")
+            self.warnings.append("Schema audit skipped: schema.sql not found")
+            return []
+
+        started = time.perf_counter()
+        findings, expected, skipped = audit_schema(self.conn, schema_dir)
+        print(f"\n✅ Expected catalog: {len(expected['table'])} tables, {len(expected['view'])} views, "
+              f"{sum(1 for name in expected['index'] if name.startswith('idx_'))} idx_* indexes "
+              f"({len(skipped)} migration statements already in schema.sql), "
+              f"audited in {(time.perf_counter() - started) * 1000:.0f} ms")
+        if not self.quiet:
+            for file_name, statement, error in skipped:
+                print(f"  ⏭️  {file_name}: {statement} ({error})")
+
+        for severity, kind, name, detail in findings:
+            self.record('schema', severity=severity, kind=kind, name=name, detail=detail)
+            if severity == 'issue':
+                print(f"  ❌ {kind} {name}: {detail}")
+                self.issues.append(f"Schema audit: {kind} {name} {detail}")
+            else:
+                print(f"  ⚠️  {kind} {name}: {detail}")
+                self.warnings.append(f"Schema audit: {kind} {name} {detail}")
+        if not findings:
+            print("  ✅ Live catalog matches schema.sql + migrations")
+        return findings
+
+    def query_test_data(self, keep_ballots=False):
+        """Query test data from database
+
+        With keep_ballots, every parsed student ballot stays in
+        test_data['student_ballots'] (--stability resamples them); otherwise
+        only the running totals outlive each fetch batch.
+        """
         print("\n" + "="*80)
         print("📊 TEST DATA QUERY")
         print("="*80)
@@ -120,8 +298,9 @@ class SettlementTester:
         cursor.execute("SELECT * FROM projects LIMIT 5")
         projects = cursor.fetchall()
         print(f"\n✅ Found {len(projects)} projects")
-        for proj in projects:
-            print(f"  - {proj['projectName']} (ID: {proj['projectId']})")
+        if not self.quiet:
+            for proj in projects:
+                print(f"  - {proj['projectName']} (ID: {proj['projectId']})")
 
         if not projects:
             print("  ⚠️  No test projects found!")
@@ -141,10 +320,11 @@ class SettlementTester:
         stages = cursor.fetchall()
 
         print(f"\n✅ Found {len(stages)} stages in project '{test_project_name}':")
-        for stage in stages:
-            reward_pool = stage['reportRewardPool'] if stage['reportRewardPool'] is not None else 0
-            print(f"  - {stage['stageName']} (Status: {stage['status']}, "
-                  f"Reward Pool: {reward_pool})")
+        if not self.quiet:
+            for stage in stages:
+                reward_pool = stage['reportRewardPool'] if stage['reportRewardPool'] is not None else 0
+                print(f"  - {stage['stageName']} (Status: {stage['status']}, "
+                      f"Reward Pool: {reward_pool})")
 
         if not stages:
             print("  ⚠️  No stages found!")
@@ -184,47 +364,130 @@ class SettlementTester:
         groups = cursor.fetchall()
 
         print(f"\n✅ Found {len(groups)} active groups:")
-        for group in groups:
-            print(f"  - {group['groupName']} (ID: {group['groupId']})")
+        if not self.quiet:
+            for group in groups:
+                print(f"  - {group['groupName']} (ID: {group['groupId']})")
+
+        # Get group members (one query for the whole project)
+        group_members = self.load_group_members([test_project_id])
+        if not self.quiet:
+            for group in groups:
+                members = group_members.get(group['groupId'], [])
+                print(f"  - {group['groupName']}: {len(members)} members")
+                for member in members:
+                    print(f"    • {member.displayName} ({member.userEmail})")
+
+        # Get rankings/votes (streamed in batches; only running totals are kept)
+        cursor.execute("SELECT COUNT(*) FROM rankings WHERE stageId = ?", (test_stage_id,))
+        vote_count = cursor.fetchone()[0]
 
-        # Get group members
-        group_members = {}
-        for group in groups:
-            cursor.execute("""
-                SELECT ug.*, u.displayName
-                FROM usergroups ug
-                JOIN users u ON ug.userEmail = u.userEmail
-                WHERE ug.groupId = ? AND ug.isActive = 1
-            """, (group['groupId'],))
-            members = cursor.fetchall()
-            group_members[group['groupId']] = members
-            print(f"  - {group['groupName']}: {len(members)} members")
-            for member in members:
-                print(f"    • {member['displayName']} ({member['userEmail']})")
-
-        # Get rankings/votes
         cursor.execute("""
-            SELECT r.*, u.userEmail as proposerEmail, u.displayName
+            SELECT r.rankingData, u.userEmail as proposerEmail, u.displayName
             FROM rankings r
             JOIN users u ON r.proposerUserId = u.userId
             WHERE r.stageId = ?
         """, (test_stage_id,))
-        rankings = cursor.fetchall()
 
-        print(f"\n✅ Found {len(rankings)} rankings/votes for stage '{test_stage_name}':")
-        for rank in rankings:
-            ranking_data = json.loads(rank['rankingData']) if rank['rankingData'] else {}
-            print(f"  - {rank['displayName']} ({rank['proposerEmail']})")
-            print(f"    Rankings: {ranking_data}")
+        print(f"\n✅ Found {vote_count} rankings/votes for stage '{test_stage_name}':")
+        # Each payload is decoded once into a compact store and folded into the totals per batch;
+        # a batch's store is dropped afterwards unless keep_ballots collects them all.
+        # Teacher items are registered first so item order matches the backend.
+        teacher_ballots = self.load_teacher_rankings([test_stage_id]).get(test_stage_id, {})
+        student_totals = RankAccumulator(teacher_item_index(teacher_ballots))
+        student_ballots = BallotStore(student_totals.item_index) if keep_ballots else None
+        for rows in self._fetch_batches(cursor):
+            store = student_ballots if keep_ballots else BallotStore(student_totals.item_index)
+            batch_start = len(store)
+            for rank in rows:
+                ranking_data = store.add_raw(rank['rankingData'])
+                if not self.quiet:
+                    print(f"  - {rank['displayName']} ({rank['proposerEmail']})")
+                    print(f"    Rankings: {ranking_data}")
+                if not ranking_data:
+                    self.warnings.append(f"Empty or invalid ranking data from {rank['proposerEmail']}")
+            if len(store) > batch_start:
+                student_totals.add_matrix(store.to_matrix(batch_start))
+
+        print(f"\n✅ Found {len(teacher_ballots)} teacher rankings for stage '{test_stage_name}':")
+        if not self.quiet:
+            for teacher_email, ballot in teacher_ballots.items():
+                print(f"  - {teacher_email}")
+                print(f"    Rankings: {ballot}")
 
         return {
             'project': projects[0],
             'stage': voting_stage,
             'groups': groups,
             'group_members': group_members,
-            'rankings': rankings
+            'vote_count': vote_count,
+            'student_ballots': student_ballots,
+            'student_totals': student_totals,
+            'teacher_ballots': teacher_ballots
         }
 
+    def _fetch_batches(self, cursor):
+        """Yield fetchmany() batches so large result sets never sit in memory at once"""
+        while True:
+            rows = cursor.fetchmany(self.batch_size)
+            if not rows:
+                return
+            yield rows
+
+    def load_group_members(self, project_ids):
+        """Load every active membership for the given projects in one query
+
+        Returns a compact {groupId: [GroupMember, ...]} index shared by the
+        simulation and point distribution steps.
+        """
+        group_members = {}
+        project_ids = list(project_ids)
+        cursor = self.conn.cursor()
+
+        # Chunk to stay under SQLite's bound-parameter limit
+        for start in range(0, len(project_ids), MAX_SQL_PARAMS):
+            chunk = project_ids[start:start + MAX_SQL_PARAMS]
+            placeholders = ','.join('?' * len(chunk))
+            cursor.execute(f"""
+                SELECT ug.groupId, ug.userEmail, u.displayName, ug.role
+                FROM usergroups ug
+                JOIN users u ON ug.userEmail = u.userEmail
+                WHERE ug.projectId IN ({placeholders}) AND ug.isActive = 1
+                ORDER BY ug.groupId, ug.joinTime
+            """, chunk)
+            for group_id, user_email, display_name, role in cursor:
+                group_members.setdefault(group_id, []).append(
+                    GroupMember(user_email, display_name, role)
+                )
+
+        return group_members
+
+    def load_teacher_rankings(self, stage_ids, table='teachersubmissionrankings'):
+        """Load every teacher's latest ranking for a batch of stages
+
+        One query per chunk of stage ids (served by idx_<table>_stage) instead
+        of one per stage. Rows are parsed once into
+        {stageId: {teacherEmail: {itemId: rank}}}, as aggregateTeacherRankings /
+        aggregateTeacherCommentRankings would build them per stage.
+        """
+        item_column = TEACHER_RANKING_TABLES[table]
+        stage_ids = list(stage_ids)
+        ballots = {}
+        cursor = self.conn.cursor()
+
+        for start in range(0, len(stage_ids), MAX_SQL_PARAMS):
+            chunk = stage_ids[start:start + MAX_SQL_PARAMS]
+            placeholders = ','.join('?' * len(chunk))
+            cursor.execute(f"""
+                SELECT stageId, teacherEmail, {item_column}, rank, createdTime
+                FROM {table}
+                WHERE stageId IN ({placeholders})
+                ORDER BY stageId, teacherEmail ASC, createdTime DESC
+            """, chunk)
+            for stage_id, rows in groupby(cursor, key=itemgetter(0)):
+                ballots[stage_id] = aggregate_teacher_rankings(row[1:] for row in rows)
+
+        return ballots
+
     def simulate_settlement(self, test_data):
         """Simulate settlement calculation based on test data"""
         print("\n" + "="*80)
@@ -237,93 +500,711 @@ class SettlementTester:
 
         stage = test_data['stage']
         groups = test_data['groups']
-        rankings = test_data['rankings']
-        group_members = test_data['group_members']
+        vote_count = test_data['vote_count']
+        student_totals = test_data['student_totals']
+        teacher_ballots = test_data['teacher_ballots']
 
         reward_pool = stage['reportRewardPool'] if stage['reportRewardPool'] is not None else 0
         print(f"\n📊 Simulating settlement for: {stage['stageName']}")
         print(f"Reward Pool: {reward_pool} points")
         print(f"Groups: {len(groups)}")
-        print(f"Votes: {len(rankings)}")
+        print(f"Votes: {vote_count} student, {len(teacher_ballots)} teacher")
 
-        if len(rankings) == 0:
+        if student_totals.ballot_count == 0 and not teacher_ballots:
             print("\n⚠️  No votes to calculate! Cannot simulate settlement.")
             self.warnings.append("No rankings found for test stage")
             return
 
-        # Calculate Borda count scores
-        print("\n🔢 Calculating Borda Count Scores:")
-        group_scores = defaultdict(lambda: {'total': 0, 'votes': 0})
+        # Score from the streamed student rank totals and the teacher ballot matrix
+        group_names = {g['groupId']: g['groupName'] for g in groups}
+        item_index, result, (student_weight, teacher_weight) = self.score_stage(
+            test_data['project'], student_totals, reward_pool, teacher_ballots
+        )
+        print(f"\n🔢 Rank totals: {student_totals.ballot_count} student + {len(teacher_ballots)} teacher "
+              f"ballots × {len(item_index)} groups")
 
-        for rank in rankings:
-            try:
-                ranking_data = json.loads(rank['rankingData']) if rank['rankingData'] else {}
-                voter = rank['proposerEmail']
+        # Calculate final rankings
+        print(f"\n🏆 Final Rankings (mid-rank average, {student_weight:.0%} student + {teacher_weight:.0%} teacher):")
+        final_rankings = {}
 
-                print(f"\n  Voter: {voter}")
-                for group_id, position in ranking_data.items():
-                    # Borda count: higher position = more points
-                    # If 5 groups: 1st=5pts, 2nd=4pts, 3rd=3pts, 4th=2pts, 5th=1pt
-                    borda_points = len(groups) - position + 1
-                    group_scores[group_id]['total'] += borda_points
-                    group_scores[group_id]['votes'] += 1
+        for column in result['order']:
+            group_id = item_index.ids[column]
+            final_rankings[group_id] = {
+                'rank': int(result['rankings'][column]),
+                'weighted_score': float(result['weightedScores'][column]),
+                'student_score': float(result['studentScores'][column]),
+                'teacher_score': float(result['teacherScores'][column]),
+                'points': float(result['scores'][column]),
+                'votes_received': int(result['studentVoteCounts'][column] + result['teacherVoteCounts'][column])
+            }
+            ranking = final_rankings[group_id]
+            if not self.quiet:
+                print(f"  {ranking['rank']}. {group_names.get(group_id, group_id)}: "
+                      f"{ranking['weighted_score']:.3f} weighted "
+                      f"(student {ranking['student_score']:.3f}, teacher {ranking['teacher_score']:.3f}, "
+                      f"{ranking['votes_received']} votes) → {ranking['points']:.0f} pts")
+
+        self.record('stage', projectId=test_data['project']['projectId'], stageId=stage['stageId'],
+                    stageName=stage['stageName'], rewardPool=reward_pool,
+                    ballotCount=student_totals.ballot_count, teacherBallotCount=len(teacher_ballots),
+                    groupCount=len(final_rankings),
+                    weights={'student': student_weight, 'teacher': teacher_weight})
+        for group_id, ranking in final_rankings.items():
+            self.record('group', stageId=stage['stageId'], groupId=group_id,
+                        groupName=group_names.get(group_id, group_id), **ranking)
+
+        # Pay members by the participationProposal of each group's latest approved submission
+        print("\n💰 Point Distribution:")
+        if reward_pool <= 0:
+            print("  ⚠️  No reward pool set for this stage")
+            return final_rankings
+
+        submissions = load_latest_submissions(self.conn, [stage['stageId']]).get(stage['stageId'], {})
+        distribution, skipped = distribute_member_points(
+            {group_id: ranking['points'] for group_id, ranking in final_rankings.items()}, submissions
+        )
+        for group_id in skipped:
+            self.warnings.append(f"Group {group_names.get(group_id, group_id)} has no participants "
+                                 "in its latest approved submission; its points are not paid out")
+
+        for group_id, ranking in final_rankings.items():
+            group_name = group_names.get(group_id, group_id)
+            row = distribution.get(group_id)
+            ranking['allocated_points'] = ranking['points'] if row else 0.0
+            if row is None:
+                if not self.quiet:
+                    print(f"\n  {group_name} (Rank {ranking['rank']}): {ranking['points']:.2f} points, "
+                          "skipped (no participants)")
+                continue
+
+            for email, points in row['memberPointsDistribution'].items():
+                self.record('member', stageId=stage['stageId'], groupId=group_id, submissionId=row['submissionId'],
+                            userEmail=email, percentage=row['participationPercentages'][email],
+                            points=points, amount=row['amounts'][email])
+            if self.quiet:
+                continue
+
+            print(f"\n  {group_name} (Rank {ranking['rank']}):")
+            print(f"    Total: {ranking['points']:.2f} points → {len(row['memberEmails'])} participants "
+                  f"(submission {row['submissionId']})")
+            for email, points in row['memberPointsDistribution'].items():
+                print(f"      • {email} ({row['participationPercentages'][email]:.0%}): "
+                      f"{points:.2f} → +{row['amounts'][email]:.0f}")
+
+        paid = sum(sum(row['amounts'].values()) for row in distribution.values())
+        print(f"\n  📊 {len(distribution)} groups paid, {len(skipped)} skipped; "
+              f"{paid:.0f} points in transactions")
 
-                    # Find group name
-                    group_name = next((g['groupName'] for g in groups if g['groupId'] == group_id), group_id)
-                    print(f"    - {group_name}: Position {position} → {borda_points} points")
+        return final_rankings
 
-            except Exception as e:
-                print(f"    ⚠️  Error processing ranking: {e}")
-                self.warnings.append(f"Error parsing ranking data: {e}")
+    def score_stage(self, project, student_totals, reward_pool, teacher_ballots=None):
+        """Run the engine on one stage's streamed rank totals with the project's weights
 
-        # Calculate final rankings
-        print("\n🏆 Final Rankings (by Borda Count):")
-        sorted_groups = sorted(group_scores.items(), key=lambda x: x[1]['total'], reverse=True)
+        `teacher_ballots` ({teacherEmail: {itemId: rank}}) become a separate
+        teacher matrix on the students' ItemIndex.
+        """
+        config = effective_scoring_config(project)
+        student_weight = config['studentRankingWeight']
+        teacher_weight = config['teacherRankingWeight']
+
+        item_index = student_totals.item_index
+        teacher_totals = RankAccumulator(item_index)
+        teacher_totals.add_ballots(list((teacher_ballots or {}).values()))
+
+        result = calculate_scores_from_accumulators(
+            teacher_totals, student_totals, reward_pool,
+            student_weight=student_weight, teacher_weight=teacher_weight
+        )
+        return item_index, result, (student_weight, teacher_weight)
+
+    def simulate_comment_settlement(self, test_data):
+        """Simulate the comment reward pool from per-stage eligibility indexes"""
+        print("\n" + "="*80)
+        print("💬 COMMENT SETTLEMENT SIMULATION")
+        print("="*80)
 
-        final_rankings = {}
-        total_reward = stage['reportRewardPool'] if stage['reportRewardPool'] is not None else 0
+        if not test_data:
+            print("⚠️  No test data available for simulation")
+            return
 
-        for rank, (group_id, scores) in enumerate(sorted_groups, 1):
-            group_name = next((g['groupName'] for g in groups if g['groupId'] == group_id), group_id)
-            avg_score = scores['total'] / scores['votes'] if scores['votes'] > 0 else 0
-            final_rankings[group_id] = {
-                'rank': rank,
-                'score': scores['total'],
-                'avg_score': avg_score,
-                'votes_received': scores['votes']
+        project = test_data['project']
+        stage = test_data['stage']
+        comment_pool = stage['commentRewardPool'] if stage['commentRewardPool'] is not None else 0
+        config = effective_scoring_config(project)
+
+        started = time.perf_counter()
+        membership = ProjectMembership(self.conn, project['projectId'])
+        teacher_ballots = self.load_teacher_rankings([stage['stageId']], 'teachercommentrankings')
+        simulation = simulate_comment_stage(self.conn, membership, stage['stageId'], comment_pool, config,
+                                            teacher_ballots.get(stage['stageId'], {}))
+        index = simulation['index']
+        elapsed = time.perf_counter() - started
+
+        print(f"\n📊 Comments in '{stage['stageName']}': {len(index.comments)} "
+              f"({len(index.helpful)} with a helpful reaction, {len(index.rankable)} rankable, "
+              f"{simulation['uniqueAuthors']} eligible authors)")
+        print(f"   Indexed reaction/reply users in {elapsed:.2f}s")
+        if not self.quiet:
+            for comment_id in index.rankable:
+                row = index.comments[comment_id]
+                print(f"  - {comment_id} by {row['authorEmail']}: "
+                      f"{index.helpful[comment_id]} helpful, "
+                      f"{len(index.reaction_users[comment_id])} reaction users, "
+                      f"{len(index.reply_users[comment_id])} reply users")
+
+        print(f"\nComment Reward Pool: {comment_pool} points")
+        records = simulation['records']
+        if records is None:
+            print("  ⚠️  No comment reward pool set for this stage")
+            return simulation
+
+        print(f"Ballots: {simulation['teacherBallots']} teacher, {simulation['studentBallots']} student; "
+              f"top {simulation['topN']} comments are rewarded")
+        if not records['rankings']:
+            print("\n⚠️  No comment rankings to calculate!")
+            self.warnings.append("No comment rankings found for test stage")
+
+        rankable = set(index.rankable)
+        distributed = sum(records['scores'].values())
+        self.record('comment_stage', projectId=project['projectId'], stageId=stage['stageId'],
+                    stageName=stage['stageName'], commentRewardPool=comment_pool,
+                    commentCount=len(index.comments), helpfulCount=len(index.helpful),
+                    rankableCount=len(rankable), uniqueAuthors=simulation['uniqueAuthors'],
+                    topN=simulation['topN'], teacherBallots=simulation['teacherBallots'],
+                    studentBallots=simulation['studentBallots'], totalDistributed=distributed)
+
+        print("\n🏆 Comment Rankings:")
+        for comment_id, rank in sorted(records['rankings'].items(), key=lambda item: item[1]):
+            points = records['scores'][comment_id]
+            self.record('comment', stageId=stage['stageId'], commentId=comment_id, rank=rank, points=points,
+                        weighted_score=records['weightedScores'][comment_id],
+                        rankable=comment_id in rankable)
+            if points > 0 and comment_id not in rankable:
+                self.warnings.append(f"Comment {comment_id} is rewarded but not rankable "
+                                     "(no helpful reaction, mentions or eligible author)")
+            if not self.quiet:
+                author = index.comments[comment_id]['authorEmail'] if comment_id in index.comments else '?'
+                print(f"  {rank}. {comment_id} ({author}): "
+                      f"{records['weightedScores'][comment_id]:.3f} weighted → {points:.0f} pts")
+        print(f"\n💰 Distributed {distributed:.0f}/{comment_pool:.0f} comment points")
+        return simulation
+
+    def analyze_rank_stability(self, test_data, replicates=2000, method='bootstrap', weight_jitter=0.0,
+                               workers=None, seed=None):
+        """Monte Carlo rank distribution of every group from resampled ballots and jittered weights"""
+        print("\n" + "="*80)
+        print("🎲 RANK STABILITY")
+        print("="*80)
+
+        if not test_data:
+            print("⚠️  No test data available for stability analysis")
+            return None
+
+        stage = test_data['stage']
+        student_ballots = test_data['student_ballots']
+        teacher_ballots = test_data['teacher_ballots']
+        item_index = student_ballots.item_index
+        width = len(item_index)
+        if width == 0:
+            print("⚠️  No ranked groups to analyze")
+            return None
+
+        config = effective_scoring_config(test_data['project'])
+        student_weight = config['studentRankingWeight']
+        teacher_weight = config['teacherRankingWeight']
+        student_matrix = student_ballots.to_matrix(width=width)
+        teacher_matrix = build_rank_matrix(list(teacher_ballots.values()), item_index, width)
+        baseline = self.score_stage(test_data['project'], test_data['student_totals'], 0,
+                                    teacher_ballots)[1]['rankings']
+
+        workers = max(1, workers or os.cpu_count() or 1)
+        print(f"\n📊 {stage['stageName']}: {method}, {replicates if method == 'bootstrap' else len(student_ballots)} "
+              f"replicates, weight jitter ±{weight_jitter:g}, {workers} worker(s)")
+        started = time.perf_counter()
+        study = analyze_stability(teacher_matrix, student_matrix, student_weight, teacher_weight,
+                                  replicates=replicates, method=method, weight_jitter=weight_jitter,
+                                  seed=seed, workers=workers)
+        items, swaps = summarize_stability(study, baseline, item_index.ids)
+        print(f"   Simulated {study['replicates']} replicates in {time.perf_counter() - started:.2f}s")
+
+        group_names = {g['groupId']: g['groupName'] for g in test_data['groups']}
+        print(f"\n   {'Group':<24} {'Rank':>4} {'Mean':>6} {'P(same)':>8}  Distribution")
+        print(f"   {'-'*76}")
+        for item in items:
+            self.record('stability', stageId=stage['stageId'], groupId=item['itemId'], method=method,
+                        replicates=study['replicates'], weightJitter=weight_jitter, **item)
+            mean_rank = f"{item['meanRank']:.2f}" if item['meanRank'] is not None else '-'
+            distribution = ', '.join(f"{rank}: {p:.0%}" for rank, p in item['rankDistribution'].items()
+                                     if p >= 0.01)
+            print(f"   {group_names.get(item['itemId'], item['itemId']):<24} {item['baselineRank']:>4} "
+                  f"{mean_rank:>6} {item['pBaselineRank']:>8.1%}  {distribution}")
+
+        close = sorted((swap for swap in swaps if swap['pSwap'] > 0), key=lambda swap: -swap['pSwap'])
+        for swap in close:
+            self.record('swap', stageId=stage['stageId'], **swap)
+        print(f"\n🔀 Rank swaps ({len(close)} of {len(swaps)} pairs ever swap):")
+        for swap in close if not self.quiet else close[:5]:
+            print(f"   {group_names.get(swap['behind'], swap['behind'])} ahead of "
+                  f"{group_names.get(swap['ahead'], swap['ahead'])}: {swap['pSwap']:.1%} "
+                  f"(tied {swap['pTie']:.1%})")
+        return items, swaps
+
+    def run_stability(self, replicates=2000, method='bootstrap', weight_jitter=0.0, workers=None, seed=None):
+        """Run the test-stage simulation followed by the Monte Carlo stability analysis"""
+        if not self.connect():
+            return False
+
+        try:
+            self.check_schema()
+            test_data = self.query_test_data(keep_ballots=True)
+            self.simulate_settlement(test_data)
+            self.analyze_rank_stability(test_data, replicates, method, weight_jitter, workers, seed)
+            self.generate_report()
+            return True
+        except Exception as e:
+            print(f"\n❌ Test execution error: {e}")
+            import traceback
+            traceback.print_exc()
+            return False
+        finally:
+            if self.conn:
+                self.conn.close()
+                print("\n📌 Database connection closed")
+
+    def _stage_source(self):
+        """Prefer the stages_with_status VIEW (computed status) over the deprecated column"""
+        row = self.conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'view' AND name = 'stages_with_status'"
+        ).fetchone()
+        return 'stages_with_status' if row else 'stages'
+
+    def replay_project(self, project_id):
+        """Simulate every settleable stage of one project without per-row output
+
+        Ballots are what the backend settlement scores: teacher rankings plus
+        each group's latest agreed rankingproposal (load_stage_ballots, as in
+        --verify), as of the stage's active settlement or now if it has none,
+        so replayed totals compare with stored stagesettlements.
+        Returns one JSON-serializable summary dict per stage; stages that are
+        not settleable are included with a `skipped` reason.
+        """
+        cursor = self.conn.cursor()
+        cursor.execute("SELECT * FROM projects WHERE projectId = ?", (project_id,))
+        project = cursor.fetchone()
+
+        cursor.execute(f"""
+            SELECT stageId, stageName, stageOrder, status, reportRewardPool, commentRewardPool
+            FROM {self._stage_source()}
+            WHERE projectId = ?
+            ORDER BY stageOrder
+        """, (project_id,))
+        stages = cursor.fetchall()
+
+        cursor.execute("""
+            SELECT stageId, MAX(settlementTime)
+            FROM settlementhistory
+            WHERE projectId = ? AND status = 'active' AND settlementType = 'stage'
+            GROUP BY stageId
+        """, (project_id,))
+        settled_at = dict(cursor.fetchall())
+        now = int(time.time() * 1000)
+
+        config = effective_scoring_config(project)
+        membership = ProjectMembership(self.conn, project_id)
+
+        # Teacher comment rankings for every settleable stage in one query
+        settleable = [stage['stageId'] for stage in stages if stage['status'] in SETTLEABLE_STATUSES]
+        teacher_comment_rankings = self.load_teacher_rankings(settleable, 'teachercommentrankings')
+        latest_submissions = load_latest_submissions(self.conn, settleable)
+
+        summaries = []
+        for stage in stages:
+            summary = {
+                'projectId': project_id,
+                'projectName': project['projectName'],
+                'stageId': stage['stageId'],
+                'stageName': stage['stageName'],
+                'stageOrder': stage['stageOrder'],
+                'status': stage['status'],
             }
-            print(f"  {rank}. {group_name}: {scores['total']} points ({avg_score:.2f} avg)")
+            summaries.append(summary)
 
-        # Calculate point distribution (example: simple percentage)
-        print("\n💰 Point Distribution:")
-        if total_reward > 0:
-            # Simple distribution: divide by rank weights
-            # Example: 1st gets 40%, 2nd gets 30%, 3rd gets 20%, 4th gets 10%
-            rank_weights = {1: 0.4, 2: 0.3, 3: 0.2, 4: 0.1}
+            if stage['status'] not in SETTLEABLE_STATUSES:
+                summary['skipped'] = f"status '{stage['status']}' is not settleable"
+                continue
 
-            for group_id, ranking in final_rankings.items():
-                rank = ranking['rank']
-                weight = rank_weights.get(rank, 0.05)  # 5% for others
-                allocated_points = total_reward * weight
-                ranking['allocated_points'] = allocated_points
+            # One agreed proposal per group: memory is O(groups), not O(votes)
+            as_of = settled_at.get(stage['stageId'], now)
+            teacher_ballots, proposals = load_stage_ballots(self.conn, project_id, stage['stageId'], as_of)
+            summary.update({'asOf': as_of, 'proposalCount': len(proposals)})
+            if not proposals and not teacher_ballots:
+                summary['skipped'] = 'no agreed proposals or teacher rankings'
+                self.warnings.append(f"{project['projectName']} / {stage['stageName']}: no rankings to replay")
+                continue
 
-                group_name = next((g['groupName'] for g in groups if g['groupId'] == group_id), group_id)
-                members = group_members.get(group_id, [])
-                points_per_member = allocated_points / len(members) if len(members) > 0 else 0
+            # Teacher items are registered first so item order matches the backend
+            student_totals = RankAccumulator(teacher_item_index(teacher_ballots))
+            student_totals.add_ballots([ballot for _, ballot in proposals if ballot])
 
-                print(f"\n  {group_name} (Rank {rank}):")
-                print(f"    Total: {allocated_points:.2f} points ({weight*100:.0f}%)")
-                print(f"    Per member ({len(members)}): {points_per_member:.2f} points")
+            reward_pool = stage['reportRewardPool'] if stage['reportRewardPool'] is not None else 0
+            if reward_pool <= 0:
+                self.warnings.append(f"{project['projectName']} / {stage['stageName']}: reward pool is {reward_pool}")
+
+            item_index, result, weights = self.score_stage(project, student_totals, reward_pool, teacher_ballots)
+            records = result_to_dicts(result, item_index.ids)
+            summary.update({
+                'rewardPool': reward_pool,
+                'ballotCount': student_totals.ballot_count,
+                'teacherBallotCount': len(teacher_ballots),
+                'groupCount': len(records['rankings']),
+                'weights': {'student': weights[0], 'teacher': weights[1]},
+                'totalDistributed': sum(records['scores'].values()),
+                **records,
+            })
+
+            members, skipped = distribute_member_points(
+                records['scores'], latest_submissions.get(stage['stageId'], {})
+            )
+            summary.update({
+                'paidGroups': len(members),
+                'skippedGroups': skipped,
+                'transactionTotal': sum(sum(row['amounts'].values()) for row in members.values()),
+                'members': members,
+            })
+
+            comment_pool = stage['commentRewardPool'] or 0
+            if comment_pool > 0:
+                simulation = simulate_comment_stage(self.conn, membership, stage['stageId'], comment_pool, config,
+                                                    teacher_comment_rankings.get(stage['stageId'], {}))
+                comment_scores = simulation['records']['scores']
+                summary.update({
+                    'commentRewardPool': comment_pool,
+                    'commentCount': len(simulation['index'].comments),
+                    'rankableComments': len(simulation['index'].rankable),
+                    'commentTopN': simulation['topN'],
+                    'commentsAwarded': sum(1 for points in comment_scores.values() if points > 0),
+                    'commentDistributed': sum(comment_scores.values()),
+                })
+
+        return summaries
+
+    def run_batch_replay(self, workers=None):
+        """Replay every project in a process pool and print one merged report"""
+        print("\n" + "="*80)
+        print("🗂️  BATCH REPLAY")
+        print("="*80)
 
-                for member in members:
-                    print(f"      • {member['displayName']}: +{points_per_member:.2f}")
+        project_ids = [row[0] for row in self.conn.execute(
+            "SELECT projectId FROM projects ORDER BY createdTime, projectId"
+        )]
+        if not project_ids:
+            print("  ⚠️  No projects found!")
+            self.warnings.append("No projects in database")
+            return []
+
+        workers = max(1, min(workers or os.cpu_count() or 1, len(project_ids)))
+        print(f"\n🚀 Replaying {len(project_ids)} projects with {workers} worker(s)")
+
+        started = time.perf_counter()
+        results = {}
+        if workers == 1:
+            for project_id in project_ids:
+                _, stages, issues, warnings = _replay_project_worker(self.db_path, project_id, self.db_options)
+                results[project_id] = stages
+                self.issues.extend(issues)
+                self.warnings.extend(warnings)
         else:
-            print("  ⚠️  No reward pool set for this stage")
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                futures = [pool.submit(_replay_project_worker, self.db_path, project_id, self.db_options)
+                           for project_id in project_ids]
+                for future in as_completed(futures):
+                    try:
+                        project_id, stages, issues, warnings = future.result()
+                    except Exception as e:
+                        self.issues.append(f"Batch replay worker failed: {e}")
+                        continue
+                    results[project_id] = stages
+                    self.issues.extend(issues)
+                    self.warnings.extend(warnings)
+        elapsed = time.perf_counter() - started
+
+        merged = [stage for project_id in project_ids for stage in results.get(project_id, [])]
+        simulated = [stage for stage in merged if 'skipped' not in stage]
+
+        print(f"\n📊 Merged Results ({len(simulated)} simulated / {len(merged)} stages):")
+        self._record_replay(merged)
+        current_project = None
+        for stage in merged if not self.quiet else ():
+            if stage['projectId'] != current_project:
+                current_project = stage['projectId']
+                print(f"\n  📁 {stage['projectName']} ({current_project})")
+            if 'skipped' in stage:
+                print(f"    ⏭️  {stage['stageName']}: skipped ({stage['skipped']})")
+                continue
+            winners = [group_id for group_id, rank in stage['rankings'].items() if rank == 1]
+            print(f"    ✅ {stage['stageName']}: {stage['ballotCount']} + {stage['teacherBallotCount']} teacher ballots, "
+                  f"{stage['groupCount']} groups, "
+                  f"{stage['totalDistributed']:.0f}/{stage['rewardPool']:.0f} pts, "
+                  f"1st: {', '.join(winners)}")
+            print(f"       💰 {stage['paidGroups']} groups paid ({stage['transactionTotal']:.0f} pts in transactions), "
+                  f"{len(stage['skippedGroups'])} without participants")
+            if 'commentRewardPool' in stage:
+                print(f"       💬 {stage['rankableComments']}/{stage['commentCount']} comments rankable, "
+                      f"{stage['commentsAwarded']} awarded, "
+                      f"{stage['commentDistributed']:.0f}/{stage['commentRewardPool']:.0f} pts")
+
+        print(f"\n⏱️  Batch replay finished in {elapsed:.2f}s")
+        return merged
+
+    def _record_replay(self, stages):
+        """One `stage` record per replayed stage and one `group` record per scored group"""
+        if self.report is None:
+            return
+        for stage in stages:
+            per_group = {key: stage.pop(key, {}) for key in
+                         ('rankings', 'scores', 'weightedScores', 'studentScores', 'teacherScores', 'members')}
+            self.record('stage', **stage)
+            for group_id, rank in per_group['rankings'].items():
+                self.record('group', projectId=stage['projectId'], stageId=stage['stageId'], groupId=group_id,
+                            rank=rank, points=per_group['scores'][group_id],
+                            weighted_score=per_group['weightedScores'][group_id],
+                            student_score=per_group['studentScores'][group_id],
+                            teacher_score=per_group['teacherScores'][group_id])
+            for group_id, row in per_group['members'].items():
+                for email, points in row['memberPointsDistribution'].items():
+                    self.record('member', projectId=stage['projectId'], stageId=stage['stageId'],
+                                groupId=group_id, submissionId=row['submissionId'], userEmail=email,
+                                percentage=row['participationPercentages'][email],
+                                points=points, amount=row['amounts'][email])
+            stage.update(per_group)
+
+    def run_batch(self, workers=None):
+        """Run schema checks and the whole-database batch replay"""
+        if not self.connect():
+            return False
 
-        return final_rankings
+        try:
+            self.check_schema()
+            self.run_batch_replay(workers)
+            self.generate_report()
+            return True
+        except Exception as e:
+            print(f"\n❌ Test execution error: {e}")
+            import traceback
+            traceback.print_exc()
+            return False
+        finally:
+            if self.conn:
+                self.conn.close()
+                print("\n📌 Database connection closed")
+
+    def verify_settlements(self, score_tolerance=SCORE_TOLERANCE, points_tolerance=POINTS_TOLERANCE):
+        """Replay every active stage settlement and diff it against the stored rows"""
+        print("\n" + "="*80)
+        print("🔁 SETTLEMENT REPLAY VERIFICATION")
+        print("="*80)
+        print(f"   Tolerances: score ±{score_tolerance:g}, points ±{points_tolerance:g}")
+
+        verifier = SettlementVerifier(self.conn, score_tolerance, points_tolerance)
+        reports = verifier.verify_all()
+        if not reports:
+            print("   ⚠️  No active stage settlements found")
+            self.warnings.append("No active settlements to verify")
+            return reports
+
+        for report in reports:
+            label = f"{report['stageName']} ({report['settlementId']})"
+            mismatches = [('group', *m) for m in report['groupMismatches']]
+            mismatches += [('comment', *m) for m in report['commentMismatches']]
+            expected_total, stored_total = report['totalRewardDistributed']
+
+            self.record('settlement', settlementId=report['settlementId'], projectId=report['projectId'],
+                        stageId=report['stageId'], stageName=report['stageName'],
+                        groupRows=report['groupRows'], commentRows=report['commentRows'],
+                        totalRewardDistributed=report['totalRewardDistributed'],
+                        totalMismatch=report['totalMismatch'], mismatchCount=len(mismatches))
+            for kind, item_id, field, expected, stored in mismatches:
+                self.record('mismatch', settlementId=report['settlementId'], kind=kind, itemId=item_id,
+                            field=field, expected=expected, stored=stored)
+
+            if not mismatches and not report['totalMismatch']:
+                print(f"   ✅ {label}: {report['groupRows'][1]} group rows, "
+                      f"{report['commentRows'][1]} comment rows match")
+                continue
+
+            print(f"   ❌ {label}: {len(mismatches)} mismatches")
+            if mismatches and not self.quiet:
+                print(f"      {'Kind':<8} {'Item':<24} {'Field':<16} {'Expected':>12} {'Stored':>12}")
+                print(f"      {'-'*76}")
+                for kind, item_id, field, expected, stored in mismatches:
+                    print(f"      {kind:<8} {item_id:<24} {field:<16} "
+                          f"{_format_value(expected):>12} {_format_value(stored):>12}")
+            if report['totalMismatch']:
+                print(f"      totalRewardDistributed: expected {expected_total:.2f}, stored {stored_total:.2f}")
+                self.issues.append(
+                    f"Settlement {report['settlementId']}: totalRewardDistributed "
+                    f"{stored_total:.2f} != recomputed {expected_total:.2f}"
+                )
+            if mismatches:
+                self.issues.append(
+                    f"Settlement {report['settlementId']} ({report['stageName']}): "
+                    f"{len(mismatches)} stored values differ from replay"
+                )
+
+        failed = sum(1 for r in reports if r['groupMismatches'] or r['commentMismatches'] or r['totalMismatch'])
+        print(f"\n   📊 Verified {len(reports)} settlements, {failed} with mismatches")
+        return reports
+
+    def run_verify(self, score_tolerance=SCORE_TOLERANCE, points_tolerance=POINTS_TOLERANCE):
+        """Run schema checks and replay-verify every active settlement"""
+        if not self.connect():
+            return False
+
+        try:
+            self.check_schema()
+            reports = self.verify_settlements(score_tolerance, points_tolerance)
+            self.generate_report()
+            return not any(r['groupMismatches'] or r['commentMismatches'] or r['totalMismatch'] for r in reports)
+        except Exception as e:
+            print(f"\n❌ Test execution error: {e}")
+            import traceback
+            traceback.print_exc()
+            return False
+        finally:
+            if self.conn:
+                self.conn.close()
+                print("\n📌 Database connection closed")
+
+    def materialize_ledger(self, checkpoint_path=None, points_tolerance=POINTS_TOLERANCE):
+        """Materialize wallet balances (incrementally from a checkpoint) and reconcile settlements"""
+        print("\n" + "="*80)
+        print("💰 WALLET LEDGER")
+        print("="*80)
+
+        ledger = WalletLedger(self.conn, checkpoint_path)
+        if ledger.load_checkpoint():
+            print(f"   📌 Resuming from checkpoint {checkpoint_path} (watermark {ledger.watermark})")
+        started = time.perf_counter()
+        folded = ledger.refresh()
+        print(f"   ✅ Folded {folded} transactions in {time.perf_counter() - started:.2f}s")
+
+        for project_id, (user_count, transaction_count, total) in sorted(ledger.project_totals().items()):
+            mismatches = ledger.verify_project(project_id)
+            self.record('ledger', projectId=project_id, userCount=user_count,
+                        transactionCount=transaction_count, totalBalance=total,
+                        balanceMismatches=len(mismatches))
+            if not self.quiet:
+                print(f"   📁 {project_id}: {user_count} wallets, {transaction_count} transactions, "
+                      f"{total:.2f} points outstanding")
+            if mismatches:
+                print(f"   ❌ {project_id}: {len(mismatches)} balances differ from SUM(amount) "
+                      "(checkpoint is stale; rebuild it)")
+                self.issues.append(f"Project {project_id}: materialized balances differ from SUM(amount)")
+
+        print("\n🧾 Settlement reconciliation:")
+        results = reconcile_settlements(self.conn, points_tolerance)
+        for result in results:
+            self.record('reconcile', **result)
+            if result['ok']:
+                if not self.quiet:
+                    print(f"   ✅ {result['settlementId']} ({result['settlementType']}, {result['status']}): "
+                          f"{result['totalRewardDistributed']:.2f} ↔ ledger {result['ledgerTotal']:.2f}")
+                continue
+            print(f"   ❌ {result['settlementId']} ({result['settlementType']}, {result['status']}): "
+                  f"totalRewardDistributed {result['totalRewardDistributed']:.2f}, {result['reason']}")
+            self.issues.append(f"Settlement {result['settlementId']} does not reconcile: {result['reason']}")
+
+        failed = sum(1 for result in results if not result['ok'])
+        print(f"\n   📊 Reconciled {len(results)} settlements, {failed} mismatched")
+
+        ledger.save_checkpoint()
+        if checkpoint_path:
+            print(f"   📝 Checkpoint saved to {checkpoint_path} (watermark {ledger.watermark})")
+        return ledger, results
+
+    def run_ledger(self, checkpoint_path=None, points_tolerance=POINTS_TOLERANCE):
+        """Run the wallet ledger materializer and settlement reconciliation"""
+        if not self.connect():
+            return False
+
+        try:
+            _, results = self.materialize_ledger(checkpoint_path, points_tolerance)
+            self.generate_report()
+            return all(result['ok'] for result in results)
+        except Exception as e:
+            print(f"\n❌ Test execution error: {e}")
+            import traceback
+            traceback.print_exc()
+            return False
+        finally:
+            if self.conn:
+                self.conn.close()
+                print("\n📌 Database connection closed")
 
-    def test_sql_queries(self, test_data):
-        """Test the actual SQL queries that will be used"""
+    def watch_rankings(self, poll_interval=DEFAULT_POLL_INTERVAL, timeout=None):
+        """Keep voting-stage projections in memory and re-score a stage whenever its rankings change"""
+        print("\n" + "="*80)
+        print("👀 WATCH MODE")
+        print("="*80)
+        print(f"   Polling PRAGMA data_version every {poll_interval * 1000:.0f} ms"
+              + (f" for {timeout:g}s" if timeout is not None else " (Ctrl+C to stop)"))
+
+        watcher = RankingsWatcher(self.conn, self._stage_source(), self.load_teacher_rankings)
+        updates = 0
+        try:
+            for changes, elapsed in watcher.poll(poll_interval, timeout):
+                scoring_started = time.perf_counter()
+                projections = {stage_id: watcher.stages[stage_id].project() for stage_id in changes}
+                elapsed += time.perf_counter() - scoring_started
+                label = 'Loaded' if updates == 0 else 'Updated'
+                print(f"\n🔄 {label} {len(changes)} stage(s) in {elapsed * 1000:.1f} ms "
+                      f"(watermark {watcher.watermark})")
+                for stage_id, (added, replaced, rebuilt) in changes.items():
+                    projection = watcher.stages[stage_id]
+                    records = projections[stage_id]
+                    self.record('watch', stageId=stage_id, added=added, replaced=replaced, rebuilt=rebuilt,
+                                ballotCount=projection.student.ballot_count,
+                                teacherBallotCount=len(projection.teacher_ballots),
+                                elapsedMs=elapsed * 1000, rankings=records['rankings'], scores=records['scores'])
+                    print(f"   📍 {projection.project_name} / {projection.stage_name}: "
+                          f"+{added} new, {replaced} resubmitted{' (reloaded)' if rebuilt else ''}, "
+                          f"{projection.student.ballot_count} student / {len(projection.teacher_ballots)} "
+                          f"teacher ballots")
+                    if not self.quiet:
+                        for group_id, rank in sorted(records['rankings'].items(), key=lambda item: item[1]):
+                            print(f"      #{rank} {group_id}: {records['scores'][group_id]:.0f} points "
+                                  f"(score {records['weightedScores'][group_id]:.4f})")
+                updates += 1
+        except KeyboardInterrupt:
+            print("\n   ⏹️  Stopped")
+        print(f"\n   📊 {updates - 1 if updates else 0} live update(s), "
+              f"{len(watcher.stages)} stage(s) watched")
+        return watcher
+
+    def run_watch(self, poll_interval=DEFAULT_POLL_INTERVAL, timeout=None):
+        """Run watch mode until interrupted or `timeout` seconds have passed"""
+        if self.db_options.immutable or self.db_options.in_memory:
+            print("❌ --watch needs change detection; drop --immutable / --in-memory")
+            return False
+        if not self.connect():
+            return False
+
+        try:
+            self.watch_rankings(poll_interval, timeout)
+            self.generate_report()
+            return True
+        except Exception as e:
+            print(f"\n❌ Test execution error: {e}")
+            import traceback
+            traceback.print_exc()
+            return False
+        finally:
+            if self.conn:
+                self.conn.close()
+                print("\n📌 Database connection closed")
+
+    def test_sql_queries(self, test_data, runs=DEFAULT_LATENCY_RUNS):
+        """Test the actual SQL queries that will be used, timing each warm and cold"""
         print("\n" + "="*80)
         print("🧪 SQL QUERY TESTING")
         print("="*80)
@@ -333,24 +1214,22 @@ class SettlementTester:
             return
 
         cursor = self.conn.cursor()
-        stage_id = test_data['stage']['stageId']
+        context = {'stageId': test_data['stage']['stageId']}
+        votes, history, settlements = SQL_CHECKS
 
         # Test 1: Query votes (as in CF Workers code)
         print("\n1️⃣  Testing vote query (from settlement.ts line 112):")
-        query1 = """
-            SELECT u.userEmail as proposerEmail, rp.rankingData
-            FROM rankings rp
-            JOIN users u ON rp.proposerUserId = u.userId
-            WHERE rp.stageId = ? AND rp.status = 'submitted'
-        """
-        print(f"   Query: {query1}")
+        print(f"   Query: {votes.sql}")
 
         try:
-            cursor.execute(query1, (stage_id,))
-            results = cursor.fetchall()
-            print(f"   ✅ Success! Found {len(results)} votes")
-            for row in results:
-                print(f"      - {row['proposerEmail']}: {row['rankingData'][:50]}...")
+            result = self._measure_latency(votes, context, runs)
+            print(f"   ✅ Success! Found {result['rows']} votes")
+            if not self.quiet:
+                for row in result['sample'][:5]:
+                    print(f"      - {row['proposerEmail']}: {row['rankingData'][:50]}...")
+                if result['rows'] > 5:
+                    print(f"      ... and {result['rows'] - 5} more")
+            self._print_latency(result)
         except Exception as e:
             print(f"   ❌ Error: {e}")
             self.issues.append(f"Vote query failed: {e}")
@@ -389,8 +1268,9 @@ class SettlementTester:
         # Test 3: Check if settlementhistory table exists
         print("\n3️⃣  Testing settlement history table:")
         try:
-            cursor.execute("SELECT * FROM settlementhistory LIMIT 1")
+            result = self._measure_latency(history, context, runs)
             print(f"   ✅ settlementhistory table exists")
+            self._print_latency(result)
         except Exception as e:
             print(f"   ❌ settlementhistory table missing or error: {e}")
             self.issues.append("settlementhistory table not accessible")
@@ -398,18 +1278,165 @@ class SettlementTester:
         # Test 4: Check if stagesettlements table exists
         print("\n4️⃣  Testing stage settlements table:")
         try:
-            cursor.execute("SELECT * FROM stagesettlements LIMIT 1")
+            result = self._measure_latency(settlements, context, runs)
             print(f"   ✅ stagesettlements table exists")
+            self._print_latency(result)
         except Exception as e:
             print(f"   ❌ stagesettlements table missing or error: {e}")
             self.issues.append("stagesettlements table not accessible")
 
+    def _reopen(self):
+        """Fresh connection for cold latency runs (None for --in-memory: shrink_memory instead)"""
+        if self.db_options.in_memory:
+            return None
+        return lambda: open_connection(self.db_path, options=self.db_options)
+
+    def _measure_latency(self, query, context, runs):
+        result = measure_query(self.conn, query, context, runs, self._reopen())
+        self.record('latency', name=result['name'], source=result['source'], rows=result['rows'],
+                    **{mode: result[mode] for mode in LATENCY_MODES})
+        return result
+
+    def _print_latency(self, result, indent="   "):
+        for mode in LATENCY_MODES:
+            stats = result[mode]
+            print(f"{indent}⏱️  {mode}: p50 {stats['p50']:.3f} ms, p95 {stats['p95']:.3f} ms, "
+                  f"p99 {stats['p99']:.3f} ms ({stats['runs']} runs)")
+
+    def measure_query_latency(self, runs=DEFAULT_LATENCY_RUNS, output=None, baseline_path=None,
+                              threshold=DEFAULT_REGRESSION_THRESHOLD):
+        """Warm/cold p50/p95/p99 of every registered read; stores and compares baselines"""
+        print("\n" + "="*80)
+        print("⏱️  QUERY LATENCY")
+        print("="*80)
+
+        sizes = table_sizes(self.conn)
+        print("\n📊 Hot tables: " + ', '.join(f"{table} {rows:,} rows" for table, rows in sizes.items()))
+        cold_mode = 'PRAGMA shrink_memory' if self.db_options.in_memory else 'fresh connection'
+        print(f"   {runs} warm + {runs} cold runs per query (cold: {cold_mode})")
+
+        context, results = measure_registry(self.conn, runs=runs, reopen=self._reopen())
+        print(f"\n{'Query':<44} {'Rows':>6} {'warm p50':>9} {'p95':>8} {'p99':>8} "
+              f"{'cold p50':>9} {'p95':>8} {'p99':>8}")
+        print("-" * 108)
+        for result in results:
+            self.record('latency', name=result['name'], source=result['source'], rows=result['rows'],
+                        **{mode: result[mode] for mode in LATENCY_MODES})
+            warm, cold = result['warm'], result['cold']
+            print(f"{result['name']:<44} {result['rows']:>6} {warm['p50']:>9.3f} {warm['p95']:>8.3f} "
+                  f"{warm['p99']:>8.3f} {cold['p50']:>9.3f} {cold['p95']:>8.3f} {cold['p99']:>8.3f}")
+
+        document = latency_document(context, results, sizes, runs)
+        slowest = max(results, key=lambda result: result['cold']['p95'])
+        print(f"\n   📊 {len(results)} queries; slowest cold p95: {slowest['name']} "
+              f"at {slowest['cold']['p95']:.3f} ms")
+        if output:
+            Path(output).write_text(json.dumps(document, indent=2), encoding='utf-8')
+            print(f"   📝 Latency results written to {output}")
+
+        if baseline_path:
+            baseline = json.loads(Path(baseline_path).read_text(encoding='utf-8'))
+            regressions = compare_to_baseline(document, baseline, threshold)
+            before_sizes = baseline.get('tableRows', {})
+            if before_sizes != sizes:
+                print("   ℹ️  Baseline table sizes differ: " + ', '.join(
+                    f"{table} {before_sizes.get(table, 0):,} → {rows:,}" for table, rows in sizes.items()))
+            for name, mode, before, after in regressions:
+                print(f"   ❌ {name} ({mode}): {REGRESSION_STAT} {before:.3f} ms → {after:.3f} ms "
+                      f"({after / before:.2f}×)")
+                self.issues.append(f"Latency regression {name} ({mode}): {REGRESSION_STAT} "
+                                   f"{before:.3f} ms → {after:.3f} ms")
+            if not regressions:
+                print(f"   ✅ No regressions vs {baseline_path} (threshold {threshold}×)")
+        return document
+
+    def run_latency(self, runs=DEFAULT_LATENCY_RUNS, output=None, baseline_path=None,
+                    threshold=DEFAULT_REGRESSION_THRESHOLD):
+        """Run the query latency harness on its own"""
+        if not self.connect():
+            return False
+
+        try:
+            self.measure_query_latency(runs, output, baseline_path, threshold)
+            self.generate_report()
+            return not self.issues
+        except Exception as e:
+            print(f"\n❌ Test execution error: {e}")
+            import traceback
+            traceback.print_exc()
+            return False
+        finally:
+            if self.conn:
+                self.conn.close()
+                print("\n📌 Database connection closed")
+
+    def audit_query_plans(self, runs=DEFAULT_RUNS):
+        """EXPLAIN QUERY PLAN and time the handlers' settlement, leaderboard and voting SQL"""
+        print("\n" + "="*80)
+        print("🧭 QUERY PLAN AUDIT")
+        print("="*80)
+
+        context, results = audit_registry(self.conn, runs=runs)
+        print(f"\n📍 Representative parameters: project {context['projectId']!r}, stage {context['stageId']!r}, "
+              f"{len(context['groupIds'])} groups, {len(context['commentIds'])} comments")
+
+        for result in results:
+            median = median_ms(result)
+            issues = [flag for flag in result['flags'] if flag[0] == 'issue']
+            self.record('query_plan', name=result['name'], source=result['source'], plan=result['plan'],
+                        flags=[{'severity': severity, 'flag': flag, 'detail': detail}
+                               for severity, flag, detail in result['flags']],
+                        rows=result['rows'], medianMs=median)
+            status = "❌" if issues else "⚠️ " if result['flags'] else "✅"
+            timing = f"{median:.3f} ms, {result['rows']} rows" if median is not None else "planned only (write)"
+            if issues or not self.quiet:
+                print(f"  {status} {result['name']} ({result['source']}): {timing}")
+            for severity, flag, detail in result['flags']:
+                if severity == 'issue' or not self.quiet:
+                    print(f"      {'❌' if severity == 'issue' else '⚠️ '} {flag}: {detail}")
+            for severity, flag, detail in issues:
+                self.issues.append(f"Query plan {result['name']} ({result['source']}): {flag} — {detail}")
+            warned = sorted({flag for severity, flag, _ in result['flags'] if severity == 'warning'})
+            if warned:
+                self.warnings.append(f"Query plan {result['name']}: {', '.join(warned)}")
+
+        flagged = sum(1 for result in results if result['flags'])
+        slowest = max(results, key=lambda result: median_ms(result) or 0)
+        print(f"\n   📊 {len(results)} queries audited, {flagged} with flagged plan steps; "
+              f"slowest {slowest['name']} at {median_ms(slowest) or 0:.3f} ms (median of {runs})")
+        return results
+
+    def run_query_plans(self, runs=DEFAULT_RUNS):
+        """Run the query plan audit on its own"""
+        if not self.connect():
+            return False
+
+        try:
+            self.audit_query_plans(runs)
+            self.generate_report()
+            return not self.issues
+        except Exception as e:
+            print(f"\n❌ Test execution error: {e}")
+            import traceback
+            traceback.print_exc()
+            return False
+        finally:
+            if self.conn:
+                self.conn.close()
+                print("\n📌 Database connection closed")
+
     def generate_report(self):
         """Generate final report"""
         print("\n" + "="*80)
         print("📋 FINAL REPORT")
         print("="*80)
 
+        for issue in self.issues:
+            self.record('issue', severity='critical', message=issue)
+        for warning in self.warnings:
+            self.record('issue', severity='warning', message=warning)
+        self.record('summary', issues=len(self.issues), warnings=len(self.warnings))
+
         if len(self.issues) == 0 and len(self.warnings) == 0:
             print("\n🎉 All tests passed! No issues found.")
         else:
@@ -434,8 +1461,10 @@ class SettlementTester:
 
         try:
             self.check_schema()
+            self.audit_schema_catalog()
             test_data = self.query_test_data()
             self.simulate_settlement(test_data)
+            self.simulate_comment_settlement(test_data)
             self.test_sql_queries(test_data)
             self.generate_report()
             return True
@@ -449,21 +1478,127 @@ class SettlementTester:
                 self.conn.close()
                 print("\n📌 Database connection closed")
 
+def teacher_item_index(teacher_ballots):
+    """ItemIndex seeded with the teacher-ranked items, in the order the backend collects them"""
+    return ItemIndex(item_id for ballot in teacher_ballots.values() for item_id in ballot)
+
+def _format_value(value):
+    if isinstance(value, float):
+        return f"{value:.4f}"
+    return str(value)
+
 def main():
     """Main entry point"""
+    parser = argparse.ArgumentParser(description="Cloudflare Workers settlement implementation test")
+    parser.add_argument('--db', default=None,
+                        help=f'SQLite database path (default: ${DB_PATH_ENV} or the wrangler miniflare file)')
+    parser.add_argument('--read-write', action='store_true',
+                        help='open the database read-write instead of read-only')
+    parser.add_argument('--immutable', action='store_true',
+                        help='open with immutable=1 (snapshots only: no locking or change detection)')
+    parser.add_argument('--mmap-size', type=int, default=None,
+                        help='PRAGMA mmap_size in bytes (e.g. 4294967296 to map a multi-GB export)')
+    parser.add_argument('--cache-size', type=int, default=None,
+                        help='PRAGMA cache_size (pages, or KiB when negative)')
+    parser.add_argument('--in-memory', action='store_true',
+                        help='copy the database into :memory: with the backup API before running')
+    parser.add_argument('--quiet', action='store_true',
+                        help='skip per-voter/group/member console output (summaries only)')
+    parser.add_argument('--report', default=None, metavar='PATH',
+                        help='stream NDJSON records (stage, group, issue, ...) to PATH')
+    parser.add_argument('--batch', action='store_true',
+                        help='replay every settleable stage of every project')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='process pool size for --batch / --stability (default: CPU count)')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+                        help=f'rankings rows per fetchmany() batch (default: {DEFAULT_BATCH_SIZE})')
+    parser.add_argument('--verify', action='store_true',
+                        help='replay active settlements and diff against stored rows')
+    parser.add_argument('--ledger', action='store_true',
+                        help='materialize wallet balances and reconcile settlements with transactions')
+    parser.add_argument('--ledger-checkpoint', default=None, metavar='PATH',
+                        help='balance checkpoint JSON for --ledger (only newer transactions are folded in)')
+    parser.add_argument('--stability', action='store_true',
+                        help='Monte Carlo rank stability of the test stage (resampled ballots, jittered weights)')
+    parser.add_argument('--replicates', type=int, default=2000,
+                        help='bootstrap replicates for --stability (default: 2000)')
+    parser.add_argument('--resample', choices=RESAMPLE_METHODS, default='bootstrap',
+                        help='ballot resampling for --stability (jackknife: one replicate per ballot)')
+    parser.add_argument('--weight-jitter', type=float, default=0.0,
+                        help='max ± shift of student/teacher weight per replicate for --stability')
+    parser.add_argument('--seed', type=int, default=None,
+                        help='random seed for --stability')
+    parser.add_argument('--watch', action='store_true',
+                        help='keep voting-stage projections live, re-scoring as rankings change')
+    parser.add_argument('--poll-interval', type=float, default=DEFAULT_POLL_INTERVAL,
+                        help=f'seconds between PRAGMA data_version polls for --watch (default: {DEFAULT_POLL_INTERVAL})')
+    parser.add_argument('--watch-timeout', type=float, default=None,
+                        help='stop --watch after this many seconds (default: run until Ctrl+C)')
+    parser.add_argument('--query-plans', action='store_true',
+                        help='EXPLAIN QUERY PLAN and time the settlement / leaderboard / voting handler SQL')
+    parser.add_argument('--query-runs', type=int, default=DEFAULT_RUNS,
+                        help=f'timed executions per query for --query-plans (default: {DEFAULT_RUNS})')
+    parser.add_argument('--latency', action='store_true',
+                        help='time every registered read warm and cold (p50/p95/p99)')
+    parser.add_argument('--latency-runs', type=int, default=DEFAULT_LATENCY_RUNS,
+                        help=f'warm and cold executions per query for --latency (default: {DEFAULT_LATENCY_RUNS})')
+    parser.add_argument('--latency-output', default=None, metavar='PATH',
+                        help='write --latency results as JSON (usable as a later --latency-baseline)')
+    parser.add_argument('--latency-baseline', default=None, metavar='PATH',
+                        help='previous --latency-output JSON; slower medians are reported as issues')
+    parser.add_argument('--latency-threshold', type=float, default=DEFAULT_REGRESSION_THRESHOLD,
+                        help=f'p50 slowdown factor flagged as a regression (default: {DEFAULT_REGRESSION_THRESHOLD})')
+    parser.add_argument('--score-tolerance', type=float, default=SCORE_TOLERANCE,
+                        help=f'allowed score difference for --verify (default: {SCORE_TOLERANCE:g})')
+    parser.add_argument('--points-tolerance', type=float, default=POINTS_TOLERANCE,
+                        help=f'allowed points difference for --verify/--ledger (default: {POINTS_TOLERANCE:g})')
+    args = parser.parse_args()
+
     print("="*80)
     print("🔍 CLOUDFLARE WORKERS SETTLEMENT IMPLEMENTATION TEST")
     print("="*80)
-    print(f"Database: {DB_PATH}")
+    db_path = resolve_db_path(args.db)
+    print(f"Database: {db_path}")
     print(f"Time: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
 
-    if not DB_PATH.exists():
-        print(f"\n❌ Database file not found: {DB_PATH}")
-        print("   Please ensure wrangler dev has been run at least once.")
+    if not db_path.exists():
+        print(f"\n❌ Database file not found: {db_path}")
+        print(f"   Please ensure wrangler dev has been run at least once, or pass --db / set {DB_PATH_ENV}.")
         sys.exit(1)
 
-    tester = SettlementTester(DB_PATH)
-    success = tester.run_all_tests()
+    db_options = DatabaseOptions(
+        read_only=not args.read_write,
+        immutable=args.immutable,
+        mmap_size=args.mmap_size,
+        cache_size=args.cache_size,
+        in_memory=args.in_memory,
+    )
+    report = NDJSONReportWriter(args.report) if args.report else None
+    tester = SettlementTester(db_path, batch_size=args.batch_size, db_options=db_options,
+                              quiet=args.quiet, report=report)
+    try:
+        if args.ledger:
+            success = tester.run_ledger(args.ledger_checkpoint, args.points_tolerance)
+        elif args.verify:
+            success = tester.run_verify(args.score_tolerance, args.points_tolerance)
+        elif args.batch:
+            success = tester.run_batch(args.workers)
+        elif args.query_plans:
+            success = tester.run_query_plans(args.query_runs)
+        elif args.latency:
+            success = tester.run_latency(args.latency_runs, args.latency_output, args.latency_baseline,
+                                         args.latency_threshold)
+        elif args.watch:
+            success = tester.run_watch(args.poll_interval, args.watch_timeout)
+        elif args.stability:
+            success = tester.run_stability(args.replicates, args.resample, args.weight_jitter,
+                                           args.workers, args.seed)
+        else:
+            success = tester.run_all_tests()
+    finally:
+        if report is not None:
+            report.close()
+            print(f"📝 Wrote {report.count} NDJSON records to {report.path}")
 
     sys.exit(0 if success else 1)
 